@@ -290,6 +290,7 @@ if __name__ == '__main__':
                                         html.Div(style = {'height' : '25px'}),
                                         html.Div(
                                             children = [dcc.Store(id = 'bsGraphMem'),
+                                                        dcc.Store(id = 'bsFigMem'),
                                                         dcc.Loading(
                                                         id ="iCLIP_loading",
                                                         type = 'dot',
@@ -394,6 +395,7 @@ if __name__ == '__main__':
                                         type = 'circle',
                                         children = [
                                             dcc.Store(id = 'spliceMem'),
+                                            dcc.Store(id = 'spliceFigMem'),
                                             dcc.Graph(id='spliceGraph',
                                             style = {'padding' : '3px'},
                                             config = {'toImageButtonOptions' : 
@@ -0,0 +1,150 @@
+/* Clientside callbacks for display only settings. The server lays out the traces of all
+   computed datasets and describes the rows of the figure, these functions hide the rows
+   of unselected datasets, apply the confirmed colors and scale the row heights without
+   a request to the server. */
+
+if (!window.dash_clientside) {
+    window.dash_clientside = {};
+}
+
+window.dash_clientside.seqing = (function() {
+    /* Returns the position of the row a trace is drawn in. */
+    function rowIndex(trace) {
+        var number = (trace.yaxis || 'y').slice(1);
+        return number === '' ? 0 : parseInt(number, 10) - 1;
+    }
+
+    /* Copies the layout and sets the domains of the y-axes the same way make_subplots does,
+       hidden rows are collapsed. Also sets the figure height.
+
+       rows -- Row descriptions from the server, from top to bottom.
+       shown -- Visibility per row.
+       scales -- Scaling factors by name, as referenced in the row descriptions.
+       spacingSpace -- Space left for spacer tracks.
+       baseHeight -- Height in pixels of a row with relative height one.
+       margin -- Height in pixels added for the margins. */
+    function layoutRows(layout, rows, shown, scales, spacingSpace, baseHeight, margin) {
+        var newLayout = Object.assign({}, layout);
+        var weights = rows.map(function(row) {
+            return row.weight * (row.scale ? scales[row.scale] : 1);
+        });
+        var numRows = 0;
+        var total = 0;
+        rows.forEach(function(row, index) {
+            if (shown[index]) {
+                numRows += 1;
+                total += weights[index];
+            }
+        });
+        var vSpace = numRows > 1 ? spacingSpace / (numRows - 1) : spacingSpace;
+        var plotSpace = 1.0 - vSpace * (numRows - 1);
+        var top = 1.0;
+        rows.forEach(function(row, index) {
+            var name = index === 0 ? 'yaxis' : 'yaxis' + (index + 1);
+            var axis = Object.assign({}, layout[name]);
+            if (shown[index]) {
+                var height = total > 0 ? weights[index] / total * plotSpace : 0;
+                axis.domain = [Math.max(top - height, 0.0), top];
+                top -= height + vSpace;
+            } else {
+                axis.domain = [0.0, 0.0];
+                axis.visible = false;
+            }
+            newLayout[name] = axis;
+        });
+        newLayout.height = baseHeight * total + margin;
+        return newLayout;
+    }
+
+    return {
+        /* Applies dataset selection, colors and scaling to the iCLIP figure.
+
+           figData -- Figure and row descriptions from showICLIP.
+           dataSets -- Selected datasets.
+           colors -- Confirmed colors per dataset.
+           iCLIPScale -- Scaling factor for crosslink rows.
+           bsScale -- Scaling factor for binding site rows. */
+        showICLIP: function(figData, dataSets, colors, iCLIPScale, bsScale) {
+            if (!figData) {
+                return {'data' : [], 'layout' : {}};
+            }
+            var selected = dataSets || [];
+            var shown = figData.rows.map(function(row) {
+                return row.dataSet === null || selected.indexOf(row.dataSet) >= 0;
+            });
+            var data = figData.figure.data.map(function(trace) {
+                var index = rowIndex(trace);
+                var row = figData.rows[index];
+                var newTrace = Object.assign({}, trace);
+                if (!shown[index]) {
+                    newTrace.visible = false;
+                }
+                if (row.dataSet !== null && colors[row.dataSet] !== undefined) {
+                    newTrace.marker = {'color' : colors[row.dataSet]};
+                }
+                return newTrace;
+            });
+            var scales = {'iCLIPScale' : iCLIPScale, 'bsScale' : bsScale};
+            return {
+                'data' : data,
+                'layout' : layoutRows(figData.figure.layout, figData.rows, shown, scales, 0.2, 30, 80)
+            };
+        },
+
+        /* Applies dataset selection, colors and scaling to the RNA-seq figure.
+
+           figData -- Figure and row descriptions from showRNA.
+           dataSets -- Selected datasets, without replicate suffix.
+           covColors -- Confirmed colors per dataset for the coverage plots.
+           eventColors -- Confirmed colors per splice event type.
+           coverageScale -- Scaling factor for coverage rows.
+           eventScale -- Scaling factor for splice event rows. */
+        showRNA: function(figData, dataSets, covColors, eventColors, coverageScale, eventScale) {
+            if (!figData) {
+                return {'data' : [], 'layout' : {}};
+            }
+            var selected = dataSets || [];
+            var shown = figData.rows.map(function(row) {
+                return row.dataSet === null || selected.indexOf(row.dataSet.split('_')[0]) >= 0;
+            });
+            var shownLegends = {}; // Legend groups of event traces that already show a legend item
+            var data = figData.figure.data.map(function(trace) {
+                var index = rowIndex(trace);
+                var row = figData.rows[index];
+                var newTrace = Object.assign({}, trace);
+                if (!shown[index]) {
+                    newTrace.visible = false;
+                }
+                if (row.type === 'coverage') {
+                    newTrace.fillcolor = covColors[row.dataSet.split('_')[0]];
+                }
+                if (row.type === 'events' && trace.legendgroup !== undefined) {
+                    // Show each legend item once over the displayed datasets
+                    newTrace.showlegend = shown[index] && !shownLegends[trace.legendgroup];
+                    if (shown[index]) {
+                        shownLegends[trace.legendgroup] = true;
+                    }
+                    if (trace.name === trace.legendgroup && eventColors[trace.name] !== undefined) {
+                        newTrace.marker = {'color' : eventColors[trace.name]};
+                    }
+                }
+                return newTrace;
+            });
+            var scales = {'coverageScale' : coverageScale, 'eventScale' : eventScale};
+            var layout = layoutRows(figData.figure.layout, figData.rows, shown, scales, 0.1, 50, 85);
+            // Scale the coverage axes to the displayed datasets
+            var maxY = 0;
+            figData.rows.forEach(function(row, index) {
+                if (shown[index] && row.type === 'coverage') {
+                    maxY = Math.max(maxY, row.maxY);
+                }
+            });
+            figData.rows.forEach(function(row, index) {
+                if (row.type === 'coverage') {
+                    layout['yaxis' + (index + 1)].range = [0, maxY];
+                }
+            });
+            return {'data' : data, 'layout' : layout};
+        }
+    };
+})();
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Columnar on-disk cache for parsed input files. Every cached dataframe is a
+directory holding one .npy file per column and a json manifest. Numeric columns stay
+memory mapped in the loaded dataframe, until an operation consolidates the frame, like
+taking rows with iloc. The manifest stores a fingerprint of the input file and the
+version of the cache format, so outdated entries are detected and rebuilt.
+Also holds the in memory cache for the figure data of the dashboard callbacks."""
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+import pandas
+
+if __name__ == '__main__':
+    print('Please start the program via validator.py')
+    exit()
+
+cacheVersion = 1 # Increase whenever the layout of cached files changes
+pandasVersion = tuple(int(i) for i in re.findall(r'\d+', pandas.__version__)[:2])
+
+def writeFrame(cacheDir, df, fingerprint):
+    """ Writes a dataframe to the cache. The manifest is written last, so interrupted
+    writes leave an entry without manifest, which is treated as missing.
+
+    Positional arguments:
+    cacheDir -- Directory for this cache entry, will be replaced if it exists.
+    df -- Dataframe to store.
+    fingerprint -- Fingerprint of the input file the dataframe was created from.
+    """
+    if os.path.exists(cacheDir):
+        shutil.rmtree(cacheDir)
+    os.makedirs(cacheDir)
+    columns = []
+    for index, name in enumerate(df.columns):
+        fileName = 'col' + str(index)
+        columns.append(writeColumn(cacheDir, fileName, name, df[name]))
+    manifest = {'version' : cacheVersion, 'fingerprint' : fingerprint, 'rows' : len(df), 'columns' : columns}
+    tmpPath = os.path.join(cacheDir, 'manifest.json.tmp')
+    with open(tmpPath, 'w') as out:
+        json.dump(manifest, out)
+    os.replace(tmpPath, os.path.join(cacheDir, 'manifest.json'))
+
+def writeColumn(cacheDir, fileName, name, column):
+    """ Writes a single column and returns its manifest entry. Categorical columns are
+    stored as codes and categories, strings as one utf-8 buffer with a null mask.
+
+    Positional arguments:
+    cacheDir -- Directory of the cache entry.
+    fileName -- File name for the column, without suffix.
+    name -- Name of the column in the dataframe.
+    column -- Series to store.
+    """
+    entry = {'name' : name, 'file' : fileName}
+    if isinstance(column.dtype, pandas.CategoricalDtype):
+        entry['kind'] = 'category'
+        numpy.save(os.path.join(cacheDir, fileName + '.npy'), column.cat.codes.values)
+        entry['categories'] = writeColumn(cacheDir, fileName + '_categories', None, pandas.Series(column.cat.categories))
+    elif column.dtype == object:
+        # Fields of tab separated files can not contain line breaks, use them as separator
+        entry['kind'] = 'string'
+        nulls = column.isnull().values
+        text = '\n'.join(column.where(~nulls, '').astype(str).tolist())
+        numpy.save(os.path.join(cacheDir, fileName + '.npy'), numpy.frombuffer(text.encode('utf-8'), dtype = numpy.uint8))
+        numpy.save(os.path.join(cacheDir, fileName + '_nulls.npy'), nulls)
+    else:
+        entry['kind'] = 'numeric'
+        numpy.save(os.path.join(cacheDir, fileName + '.npy'), column.values)
+    return entry
+
+def readColumn(cacheDir, entry):
+    """ Reads a single column described by its manifest entry.
+
+    Positional arguments:
+    cacheDir -- Directory of the cache entry.
+    entry -- Manifest entry of the column.
+    """
+    path = os.path.join(cacheDir, entry['file'] + '.npy')
+    if entry['kind'] == 'numeric':
+        return numpy.load(path, mmap_mode = 'r')
+    if entry['kind'] == 'category':
+        codes = numpy.load(path, mmap_mode = 'r')
+        categories = readColumn(cacheDir, entry['categories'])
+        return pandas.Categorical.from_codes(codes, categories)
+    if entry['kind'] == 'string':
+        text = numpy.load(path, mmap_mode = 'r').tobytes().decode('utf-8')
+        nulls = numpy.load(os.path.join(cacheDir, entry['file'] + '_nulls.npy'))
+        values = numpy.array(text.split('\n'), dtype = object)[:len(nulls)] # Splitting an empty text yields one field
+        values[nulls] = numpy.nan
+        return values
+    raise ValueError('Unknown column kind ' + str(entry['kind']))
+
+def entryValid(cacheDir, fingerprint):
+    """ Checks whether a cache entry exists and matches the version of the cache and
+    the fingerprint of the current input file, without loading any columns.
+
+    Positional arguments:
+    cacheDir -- Directory of the cache entry.
+    fingerprint -- Fingerprint of the current input file.
+    """
+    try:
+        with open(os.path.join(cacheDir, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        return False
+    return manifest.get('version') == cacheVersion and manifest.get('fingerprint') == fingerprint
+
+def readFrame(cacheDir, fingerprint):
+    """ Loads a dataframe from the cache. Returns None if there is no entry, the entry
+    was written by a different version of the cache or for a different input file.
+
+    Positional arguments:
+    cacheDir -- Directory of the cache entry.
+    fingerprint -- Fingerprint of the current input file.
+    """
+    try:
+        with open(os.path.join(cacheDir, 'manifest.json')) as f:
+            manifest = json.load(f)
+        if manifest.get('version') != cacheVersion or manifest.get('fingerprint') != fingerprint:
+            return None
+        columns = [readColumn(cacheDir, entry) for entry in manifest['columns']]
+        return mappedFrame([i['name'] for i in manifest['columns']], columns, manifest['rows'])
+    except (IOError, ValueError, KeyError):
+        return None
+
+def mappedFrame(names, columns, rows):
+    """ Creates a dataframe from the columns of a cache entry without copying memory mapped
+    columns. Since pandas 1.3 the constructor keeps columns passed in a dict with
+    copy = False. Older versions stack columns of the same type into one block, which copies
+    them. For the pinned pandas 0.24 the blocks are created directly, other versions fall
+    back to the copying constructor.
+
+    Positional arguments:
+    names -- Names of the columns.
+    columns -- Arrays or categoricals holding the values of the columns.
+    rows -- Number of rows.
+    """
+    data = OrderedDict(zip(names, columns))
+    if pandasVersion >= (1, 3):
+        return pandas.DataFrame(data, index = pandas.RangeIndex(rows), columns = names, copy = False)
+    if pandasVersion == (0, 24): # Internal api of the pinned version, one block per column
+        from pandas.core.internals import BlockManager, make_block
+        blocks = []
+        for index, values in enumerate(columns):
+            if isinstance(values, numpy.ndarray): # Blocks of numpy columns are two dimensional
+                values = values.reshape(1, -1)
+            blocks.append(make_block(values, placement = [index], ndim = 2))
+        return pandas.DataFrame(BlockManager(blocks, [pandas.Index(names), pandas.RangeIndex(rows)]))
+    return pandas.DataFrame(data, index = pandas.RangeIndex(rows), columns = names)
+
+def fileStat(path):
+    """ Returns size, modification time in nanoseconds and inode of a file.
+
+    Positional arguments:
+    path -- Path of the file.
+    """
+    stat = os.stat(str(path))
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+def contentHash(path):
+    """ Returns the md5 checksum over the raw bytes of a file as hex string. The file
+    is read in blocks, compressed files are hashed as they are.
+
+    Positional arguments:
+    path -- Path of the file.
+    """
+    checksum = hashlib.md5()
+    with open(str(path), 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+class FingerprintStore:
+    """ Fingerprints of input files, persisted as json between starts. By default the
+    fingerprint of a file is made up of its size, modification time and inode, which
+    only requires a stat call. With content hashing enabled the fingerprint is the md5
+    checksum of the file, the stat values are kept to skip hashing unchanged files.
+    """
+    def __init__(self, path, hashContent = False, workers = 4):
+        """ Positional arguments:
+        path -- Location of the json file holding the fingerprints.
+
+        Keyword arguments:
+        hashContent -- Use content hashes as fingerprints.
+        workers -- Number of threads used for hashing.
+        """
+        self.path = path
+        self.hashContent = hashContent
+        self.workers = workers
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (IOError, ValueError):
+            self.entries = {}
+
+    def stale(self, key, stat):
+        """ Checks whether the stored entry for a file has to be recomputed. """
+        entry = self.entries.get(key)
+        if entry == None or entry['stat'] != stat:
+            return True
+        return self.hashContent and entry.get('hash') == None
+
+    def update(self, paths):
+        """ Recomputes the fingerprints of all changed files, hashes are computed in a
+        thread pool. Missing files are skipped.
+
+        Positional arguments:
+        paths -- Paths of the input files.
+        """
+        changed = {}
+        for path in paths:
+            key = os.path.abspath(str(path))
+            try:
+                stat = fileStat(path)
+            except (IOError, TypeError):
+                continue
+            if self.stale(key, stat):
+                changed[key] = stat
+        hashes = [None] * len(changed)
+        if self.hashContent and len(changed) > 0:
+            with ThreadPoolExecutor(max_workers = self.workers) as pool:
+                hashes = list(pool.map(contentHash, changed.keys()))
+        for (key, stat), checksum in zip(changed.items(), hashes):
+            self.entries[key] = {'stat' : stat, 'hash' : checksum}
+
+    def get(self, path):
+        """ Returns the fingerprint of a file as string, raises FileNotFoundError for
+        missing files.
+
+        Positional arguments:
+        path -- Path of the file.
+        """
+        key = os.path.abspath(str(path))
+        if self.stale(key, fileStat(path)):
+            self.update([path])
+        entry = self.entries[key]
+        if self.hashContent:
+            return 'md5:' + entry['hash']
+        return 'stat:' + '-'.join(str(i) for i in entry['stat'])
+
+    def save(self):
+        """ Writes the fingerprints to disk. """
+        tmpPath = self.path + '.tmp'
+        with open(tmpPath, 'w') as out:
+            json.dump(self.entries, out)
+        os.replace(tmpPath, self.path)
+
+class FigureCache:
+    """ Server side store for the serialized figure data of the data callbacks. Entries are
+    addressed by random tokens, so the browser only has to hold the token instead of the
+    trace data. The least recently used entries are evicted once the total size of the
+    stored strings exceeds the limit, the most recent entry is always kept.
+    """
+    def __init__(self, maxSize):
+        """ Positional arguments:
+        maxSize -- Maximum total length of the stored strings.
+        """
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock() # Callbacks may run in parallel threads
+
+    def put(self, text):
+        """ Stores a string and returns the token for it.
+
+        Positional arguments:
+        text -- Serialized figure data.
+        """
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.entries[token] = text
+            self.size += len(text)
+            while self.size > self.maxSize and len(self.entries) > 1:
+                self.size -= len(self.entries.popitem(last = False)[1])
+        return token
+
+    def get(self, token):
+        """ Returns the string stored for a token, None if there is no such entry or it
+        has been evicted.
+
+        Positional arguments:
+        token -- Token returned by put.
+        """
+        with self.lock:
+            text = self.entries.get(token)
+            if text is not None:
+                self.entries.move_to_end(token)
+        return text
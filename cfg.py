@@ -44,10 +44,18 @@ def init(globs):
     sequences = globs['sequences']
     global geneAnnotations
     geneAnnotations = globs['geneAnnotations']
+    global geneIndices
+    geneIndices = globs['geneIndices']
+    global intervalIndices
+    intervalIndices = globs['intervalIndices']
+    global exonTable
+    exonTable = globs['exonTable']
     global sortKeys
     sortKeys = globs['sortKeys']
     global advancedDesc
     advancedDesc = globs['advancedDesc']
+    global advancedDescIndex
+    advancedDescIndex = globs['advancedDescIndex']
     global subTables
     subTables = globs['subTables']
     global spliceEventElements
@@ -66,5 +74,9 @@ def init(globs):
     eventTypes = globs['eventTypes']
     global authentication
     authentication = globs['authentication']
+    global figureCache
+    figureCache = globs['figureCache']
+    global fullResolution
+    fullResolution = globs['fullResolution']
     global coverageData
     coverageData = globs['coverageData']
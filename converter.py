@@ -14,6 +14,88 @@ if __name__ == '__main__':
 gtfHeader = ['chrom','chromStart','chromEnd','geneID', 'transID','score','strand','thickStart','thickEnd','itemRGB','blockCount','blockSizes','blockStarts']
 dtypes = {'chrom' : 'category', 'chromStart' : 'uint32','chromEnd': 'uint32','geneID' : 'object', 'transID' : 'object','score' : 'int16','strand' : 'category','thickStart' : 'uint64',
                                   'thickEnd' : 'uint64', 'itemRGB' : 'int16', 'blockCount' : 'uint32','blockSizes' : 'object','blockStarts' : 'object'}
+# Column layout shared by GTF and GFF3 files
+gtfColumns = ['seqname', 'source', 'feature', 'start', 'end', 'score', 'strand', 'frame', 'attribute']
+gtfTypes = {'seqname' : 'object', 'source' : 'object', 'feature' : 'object', 'start' : 'uint32', 'end': 'uint32', 'score' : 'object',
+            'strand' : 'category', 'frame' : 'object', 'attribute' : 'object'}
+
+def extractAttribute(attributes, name):
+    """ Extracts the value of a single attribute from the attribute column of a GTF
+    dataframe. Surrounding quotes are removed, lines without the attribute yield an
+    empty string.
+
+    Positional arguments:
+    attributes -- Series of attribute strings.
+    name -- Name of the attribute, e.g. gene_id.
+    """
+    return attributes.str.extract(r'(?:^|;)\s*' + name + r'\s+"?([^";]*)"?', expand = False).fillna('')
+
+def joinValues(values, groups):
+    """ Joins integer values to one comma separated string per group, keeping
+    the order of the values within each group.
+
+    Positional arguments:
+    values -- Array of integer values.
+    groups -- Group label for each value.
+    """
+    return pd.Series(values.astype(str)).groupby(groups, sort = True).agg(','.join)
+
+def reduceGTFLines(df):
+    """ Keeps only the exon and CDS lines of a GTF dataframe and replaces the attribute
+    column by the gene and transcript ids. Returns a compact dataframe with the
+    columns chrom, strand, start, end, exon, geneID and transID.
+
+    Positional arguments:
+    df -- GTF dataframe.
+    """
+    lines = df[df['feature'].isin(['exon', 'CDS'])]
+    return pd.DataFrame({'chrom' : lines['seqname'].values,
+                         'strand' : lines['strand'].values,
+                         'start' : lines['start'].values.astype(np.int64),
+                         'end' : lines['end'].values.astype(np.int64),
+                         'exon' : (lines['feature'] == 'exon').values,
+                         'geneID' : extractAttribute(lines['attribute'], 'gene_id').values,
+                         'transID' : extractAttribute(lines['attribute'], 'transcript_id').values})
+
+def convertGTFLinesToBed(lines):
+    """ Builds the BED12 dataframe from exon and CDS lines as returned by reduceGTFLines.
+    Consecutive lines with the same transcript id form one transcript, exons become the
+    blocks and cds lines define the thick part.
+
+    Positional arguments:
+    lines -- Dataframe with exon and CDS lines.
+    """
+    transIDs = lines['transID'].values
+    # Number transcripts by runs of the same transcript id, the first line of a run
+    # defines chromosome, strand and ids of the transcript
+    runStarts = np.concatenate([[True], transIDs[1:] != transIDs[:-1]])[:len(lines)]
+    transcripts = np.cumsum(runStarts)
+    starts = lines['start'].values
+    ends = lines['end'].values
+    isExon = lines['exon'].values
+    firstLines = np.flatnonzero(runStarts)
+    first = pd.DataFrame({'chrom' : lines['chrom'].values[firstLines],
+                          'geneID' : lines['geneID'].values[firstLines],
+                          'transID' : transIDs[firstLines],
+                          'strand' : lines['strand'].values[firstLines]}, index = transcripts[firstLines])
+    # Blocks, transcripts without exons are dropped
+    exonTranscripts = transcripts[isExon]
+    exons = pd.DataFrame({'start' : starts[isExon], 'end' : ends[isExon]}).groupby(exonTranscripts, sort = True)
+    chromStarts = exons['start'].min()
+    bed = pd.DataFrame({'chromStart' : chromStarts - 1, 'chromEnd' : exons['end'].max(), 'blockCount' : exons.size()})
+    bed['blockSizes'] = joinValues(ends[isExon] - starts[isExon] + 1, exonTranscripts)
+    bed['blockStarts'] = joinValues(starts[isExon] - chromStarts.reindex(exonTranscripts).values, exonTranscripts)
+    # Thick part from the cds lines, transcripts without cds are not coding
+    cds = pd.DataFrame({'start' : starts[~isExon], 'end' : ends[~isExon]}).groupby(transcripts[~isExon], sort = True)
+    bed['thickStart'] = (cds['start'].min() - 1).reindex(bed.index).fillna(bed['chromStart'])
+    bed['thickEnd'] = cds['end'].max().reindex(bed.index).fillna(bed['chromEnd'])
+    bed = bed.join(first)
+    bed['score'] = 0
+    bed['itemRGB'] = 0
+    finDF = bed[gtfHeader].reset_index(drop = True)
+    for key, dtype in dtypes.items():
+        finDF[key] = finDF[key].astype(dtype)
+    return finDF
 
 def convertGTFToBed(df):
     """ Convert a GTF dataframe to a BED12 dataframe for internal use. Only relevant
@@ -23,148 +105,150 @@ def convertGTFToBed(df):
     Positional arguments:
     df -- GTF dataframe.
     """
-    bedFile = []
-    current = ''
-    currentGene = ''
-    chrom = ''
-    strand = ''
-    itemRGB = 0
-    score = 0
-    blockCount = 0
-    blockStarts = []
-    blockEnds = []
-    blockSizes = []
-    thickStart = -1
-    thickEnd = -1
-    
-    rowIndex = 1
-    percent = 10
-    for i in df.iterrows():
-        if rowIndex/len(df)*100 >= percent:
-            print(str(percent) + '%')
-            percent += 10
-        rowIndex +=1
-        # Split attributes for relevant lines and extract needed ones
-        if i[1]['feature'] == 'exon' or i[1]['feature'] == 'CDS':
-            attributes = i[1]['attribute'].split(';')
-            geneID = [s for s in attributes if 'gene_id' in s]
-            transID = [s for s in attributes if 'transcript_id' in s]
-            # check if gene and transcript id are specified only once
-            if len(geneID) == 1:
-                geneID = geneID[0].split(' ')[-1]
-                if geneID[0] == '"':
-                    geneID = geneID[1:-1]
-            else:
-                geneID = ''
-            if len(transID) == 1:
-                transID = transID[0].split(' ')[-1]
-                if transID[0] == '"':
-                    transID = transID[1:-1]
-            else:
-                transID = ''
-#            # handle ids that consist of multiple, point seperated values
-#            geneParts = geneID.split('.')
-#            transParts = transID.split('.')
-#            finalID = '' # this will be the final id used for the gene
-#            if geneID != '':
-#                if transID != '':
-#                    if len(geneParts) == 1 and len(transParts) == 1:
-#                        finalID = geneParts[0] + '.' + transParts[0]
-#                    else:
-#                        if len(geneParts) == 1 and len(transParts) == 2:
-#                            if geneParts[0] == transParts[0]:
-#                                finalID = geneParts[0] + '.' + transParts[1]
-#                            else:
-#                                finalID = geneParts[0] + '.' + '_'.join(transParts)
-#                        else:
-#                            finalID = '_'.join(geneParts) + '.' + '_'.join(transParts)
-#                else:
-#                    finalID = geneID
-#            else:
-#                continue
-            # convert the data into bed 12
-            if current == '':
-                current = transID
-                currentGene = geneID
-                chrom = i[1]['seqname']
-                strand = i[1]['strand']
-                blockCount = 0
-                blockStarts = []
-                blockEnds = []
-                blockSizes = []
-                thickStart = -1
-                thickEnd = -1
-                if i[1]['feature'] == 'exon':
-                    blockCount += 1
-                    blockStarts.append(int(i[1]['start']))
-                    blockEnds.append(int(i[1]['end']))
-                    blockSizes.append(int(i[1]['end'])-int(i[1]['start'])+1)
-                if i[1]['feature'] == 'CDS':
-                    if thickStart == -1 or thickStart > i[1]['start']:
-                        thickStart = int(i[1]['start'])-1
-                    if thickEnd == -1 or thickEnd < i[1]['end']:
-                        thickEnd = i[1]['end']
-            else:
-                if transID == current: # line still belongs to the same gene
-                    if i[1]['feature'] == 'exon':
-                        blockCount += 1
-                        blockStarts.append(int(i[1]['start']))
-                        blockEnds.append(int(i[1]['end']))
-                        blockSizes.append(int(i[1]['end'])-int(i[1]['start'])+1)
-                    if i[1]['feature'] == 'CDS':
-                        if thickStart == -1 or thickStart > i[1]['start']:
-                            thickStart = int(i[1]['start'])-1
-                        if thickEnd == -1 or thickEnd < i[1]['end']:
-                            thickEnd = i[1]['end']
-                else:   # line belongs to a new gene with a different final id
-                    chromStart = min(blockStarts)
-                    chromEnd = max(blockEnds)
-                    if thickEnd == -1:
-                        thickEnd = chromEnd
-                    if thickStart == -1:
-                        thickStart = chromStart-1
-                    bBlockStarts = [int(i)-int(chromStart) for i in blockStarts]
-                    # append data of previous gene before resetting values for
-                    # the new one
-                    bedFile.append([chrom, chromStart-1, chromEnd, currentGene, current, score,
-                                    strand, thickStart, thickEnd, itemRGB,
-                                    blockCount, ','.join(map(str, blockSizes)), ','.join(map(str, bBlockStarts))])
-                    current = transID
-                    currentGene = geneID
-                    chrom = i[1]['seqname']
-                    strand = i[1]['strand']
-                    blockCount = 0
-                    blockStarts = []
-                    blockEnds = []
-                    blockSizes = []
-                    thickStart = -1
-                    thickEnd = -1    
-                    if i[1]['feature'] == 'exon':
-                        blockCount += 1
-                        blockStarts.append(int(i[1]['start']))
-                        blockEnds.append(int(i[1]['end']))
-                        blockSizes.append(int(i[1]['end'])-int(i[1]['start'])+1)
-                    if i[1]['feature'] == 'CDS':
-                        if thickStart == -1 or thickStart > i[1]['start']:
-                            thickStart = int(i[1]['start'])-1
-                        if thickEnd == -1 or thickEnd < i[1]['end']:
-                            thickEnd = i[1]['end']
-    chromStart = min(blockStarts)
-    chromEnd = max(blockEnds)
-    if thickEnd == -1:
-        thickEnd = chromEnd
-    if thickStart == -1:
-        thickStart = chromStart-1
-    bBlockStarts = [int(i)-int(chromStart) for i in blockStarts]
-    # append data of previous gene before resetting values for
-    # the new one
-    bedFile.append([chrom, chromStart-1, chromEnd, geneID, transID, score,
-                                    strand, thickStart, thickEnd, itemRGB,
-                                    blockCount, ','.join(map(str, blockSizes)), ','.join(map(str, bBlockStarts))])
-    finDF = pd.DataFrame(data = bedFile, columns = gtfHeader)
+    return convertGTFLinesToBed(reduceGTFLines(df))
+
+def streamGTFToBed(path, header, validate, chunkSize = 1000000):
+    """ Reads a GTF file in chunks and converts it to a BED12 dataframe. Only exon and
+    CDS lines with their ids are kept from each chunk, transcripts that continue in the
+    next chunk are carried over, so memory use depends on the output, not on the size
+    of the file. Returns the dataframe and the validation result of the first invalid
+    chunk, or of the last chunk if all are valid.
+
+    Positional arguments:
+    path -- Path of the GTF file.
+    header -- Row number of the header, None if there is none.
+    validate -- Function that validates a chunk of the GTF file.
+
+    Keyword arguments:
+    chunkSize -- Number of lines per chunk.
+    """
+    bedParts = []
+    carry = None
+    validation = [True, '']
+    for chunk in pd.read_csv(path, sep = '\t', compression = 'infer', comment = '#', names = gtfColumns, dtype = gtfTypes,
+                             header = header, chunksize = chunkSize):
+        validation = validate(chunk)
+        if validation[0] != True:
+            return None, validation
+        lines = reduceGTFLines(chunk)
+        if carry is not None:
+            lines = pd.concat([carry, lines], ignore_index = True)
+        # The last transcript of the chunk may continue in the next one
+        transIDs = lines['transID'].values
+        runStarts = np.flatnonzero(transIDs[1:] != transIDs[:-1]) + 1
+        lastRun = runStarts[-1] if len(runStarts) > 0 else 0
+        if lastRun > 0:
+            bedParts.append(convertGTFLinesToBed(lines.iloc[:lastRun]))
+        carry = lines.iloc[lastRun:]
+    if carry is not None:
+        bedParts.append(convertGTFLinesToBed(carry))
+    if len(bedParts) == 0:
+        bedParts.append(convertGTFLinesToBed(reduceGTFLines(pd.DataFrame(columns = gtfColumns))))
+    finDF = pd.concat(bedParts, ignore_index = True)
     for key, dtype in dtypes.items():
         finDF[key] = finDF[key].astype(dtype)
-    return finDF
+    return finDF, validation
+
+def extractGFF3Attribute(attributes, name):
+    """ Extracts the value of a single attribute from the attribute column of a GFF3
+    dataframe, attributes are written as name=value. Lines without the attribute
+    yield an empty string.
+
+    Positional arguments:
+    attributes -- Series of attribute strings.
+    name -- Name of the attribute, e.g. Parent.
+    """
+    return attributes.str.extract(r'(?:^|;)\s*' + name + r'=([^;]*)', expand = False).fillna('')
+
+def reduceGFF3Lines(df):
+    """ Splits a GFF3 dataframe into exon and CDS lines and the links between the
+    remaining features. Lines with multiple parents, e.g. exons shared by several
+    isoforms, are repeated once per parent. Returns a dataframe with the columns chrom,
+    strand, start, end, exon and parent, and a dataframe with the columns ID and Parent
+    for all other features that have both attributes.
+
+    Positional arguments:
+    df -- GFF3 dataframe.
+    """
+    isFeature = df['feature'].isin(['exon', 'CDS']).values
+    lines = df[isFeature]
+    parents = extractGFF3Attribute(lines['attribute'], 'Parent').str.split(',')
+    rows = np.repeat(np.arange(len(lines)), parents.str.len().values)
+    parents = np.concatenate(parents.values) if len(lines) > 0 else np.empty(0, dtype = object)
+    reduced = pd.DataFrame({'chrom' : lines['seqname'].values[rows],
+                            'strand' : lines['strand'].astype(object).values[rows], # Drops strands of other features
+                            'start' : lines['start'].values[rows].astype(np.int64),
+                            'end' : lines['end'].values[rows].astype(np.int64),
+                            'exon' : (lines['feature'] == 'exon').values[rows],
+                            'parent' : parents})
+    others = df['attribute'][~isFeature]
+    links = pd.DataFrame({'ID' : extractGFF3Attribute(others, 'ID').values,
+                          'Parent' : extractGFF3Attribute(others, 'Parent').values})
+    return reduced, links[(links['ID'] != '') & (links['Parent'] != '')]
+
+def convertGFF3LinesToBed(lines, links):
+    """ Builds the BED12 dataframe from the output of reduceGFF3Lines. The parent of
+    exon and CDS lines is the transcript, the gene is found by joining the transcript
+    with the feature links. Exons attached directly to a gene, without a transcript in
+    between, form a transcript named after the gene.
+
+    Positional arguments:
+    lines -- Dataframe with exon and CDS lines.
+    links -- Dataframe with ID and Parent of all other features.
+    """
+    genes = links.drop_duplicates('ID').set_index('ID')['Parent'].str.split(',').str[0]
+    transIDs = lines['parent']
+    lines = lines.assign(transID = transIDs, geneID = transIDs.map(genes).fillna(transIDs))
+    # Lines of one transcript do not have to be adjacent in GFF3 files, group them by
+    # transcript in order of appearance and keep the file order within each transcript
+    order = np.argsort(pd.factorize(transIDs)[0], kind = 'mergesort')
+    return convertGTFLinesToBed(lines.iloc[order])
+
+def convertGFF3ToBed(df):
+    """ Convert a GFF3 dataframe to a BED12 dataframe for internal use. Transcripts
+    are reconstructed from exon and cds lines and linked to their genes through the
+    Parent attributes.
+
+    Positional arguments:
+    df -- GFF3 dataframe.
+    """
+    return convertGFF3LinesToBed(*reduceGFF3Lines(df))
+
+def streamGFF3ToBed(path, validate, chunkSize = 1000000):
+    """ Reads a GFF3 file in chunks and converts it to a BED12 dataframe. Features of a
+    transcript can be spread over the whole file, so the exon and CDS lines and the links
+    between features are collected from all chunks before they are converted. Only exon
+    and CDS lines are validated, other features like chromosomes are often unstranded.
+    Returns the dataframe and the validation result of the first invalid chunk, or of
+    the last chunk if all are valid.
+
+    Positional arguments:
+    path -- Path of the GFF3 file.
+    validate -- Function that validates a chunk of the GFF3 file.
+
+    Keyword arguments:
+    chunkSize -- Number of lines per chunk.
+    """
+    lineParts = []
+    linkParts = []
+    validation = [True, '']
+    # Directives and comments start with '#', so there is no header line
+    for chunk in pd.read_csv(path, sep = '\t', compression = 'infer', comment = '#', names = gtfColumns, dtype = gtfTypes,
+                             header = None, chunksize = chunkSize):
+        features = chunk[chunk['feature'].isin(['exon', 'CDS'])].copy()
+        features['strand'] = features['strand'].cat.remove_unused_categories()
+        validation = validate(features)
+        if validation[0] != True:
+            return None, validation
+        lines, links = reduceGFF3Lines(chunk)
+        lineParts.append(lines)
+        linkParts.append(links)
+    if len(lineParts) == 0:
+        lineParts, linkParts = [[i] for i in reduceGFF3Lines(pd.DataFrame(columns = gtfColumns))]
+    finDF = convertGFF3LinesToBed(pd.concat(lineParts, ignore_index = True), pd.concat(linkParts, ignore_index = True))
+    for key, dtype in dtypes.items():
+        finDF[key] = finDF[key].astype(dtype)
+    return finDF, validation
 
 
 class FileInput:
@@ -226,6 +310,9 @@ def check_input_file(file_path):
         else:
             if '"' in file_head.iloc[0, 8]:
                 return FileInput(file_path, 'GTF', file_zipped, zip_type, header_present)
+            # GFF3 attributes are written as name=value without quotes
+            if '=' in file_head.iloc[0, 8]:
+                return FileInput(file_path, 'GFF3', file_zipped, zip_type, header_present)
     elif head_dim[1] == 12:
         return FileInput(file_path, 'BED12', file_zipped, zip_type, header_present)
     else:
@@ -2,10 +2,10 @@
 # -*- coding: utf-8 -*-
 
 import dash
-import pandas
 import dash_html_components as html
 from app import app
 import cfg
+from iclip_tab import geneRegion
 
 tableColors = ['rgb(255, 255 ,255)', 'rgb(220, 220, 220)']
 
@@ -19,13 +19,7 @@ def showDetails(name):
     Positional arguments:
     name -- Gene name for initialization.
     """
-    if cfg.advancedDesc is not None:
-        try:
-            df = cfg.advancedDesc[cfg.advancedDesc['gene_ids'].str.contains(name)]
-        except TypeError:
-            df = pandas.DataFrame()
-    else:
-        df = pandas.DataFrame()
+    df = geneRegion(name).details
     columns = list(df.columns.values)
     rowCounter = 1  # Keep track of the row number to alternate coloring
     usedColumns = []  # Keeps track of preset columns already added, needed later
@@ -2,9 +2,13 @@
 # -*- coding: utf-8 -*-
 
 import dash
+import functools
+import json
+import numpy
 import pandas
 from app import app
 import cfg
+import indexing
 import dash_html_components as html
 from plotly import tools
 import plotly.graph_objs as go
@@ -20,104 +24,65 @@ def setDesc(name):
     Positional arguments:
     name -- Name of the currently selected gene
     """
-    if cfg.descAvail:
-        try:
-            return [
-                html.P(    
-                    cfg.geneDescriptions.loc[
-                        cfg.geneDescriptions['ensembl_gene_id'] == name,
-                        ['description']
-                    ].iloc[0]
-                )
-            ]
-        except IndexError:
-            return ['No description available']
-        except KeyError:
-            return ['No description available']        
-    else:
+    if not cfg.descAvail:
+        return ['No description available']
+    description = geneRegion(name).description
+    if description is None:
         return ['No description available']
+    return [html.P(description)]
 
 @app.callback(
-    dash.dependencies.Output('bsGraph', 'figure'),
+    dash.dependencies.Output('bsFigMem', 'data'),
     [dash.dependencies.Input('bsGraphMem', 'data'),
-     dash.dependencies.Input('paramList', 'values'),
      dash.dependencies.Input('sequenceRadio', 'value'),
-     dash.dependencies.Input('colorFinal', 'data'),
-     dash.dependencies.Input('legendSpacingDiv', 'data'),
-     dash.dependencies.Input('iCLIPScale', 'value'),
-     dash.dependencies.Input('bsScale', 'value')]
+     dash.dependencies.Input('legendSpacingDiv', 'data')]
 )
-def showICLIP(figData, dataSets, seqDisp, colorF, legendSpacing,  iCLIPScale, bsScale):
-    """ Update callbacks that selects traces to be displayed based on user input.
+def showICLIP(figToken, seqDisp, legendSpacing):
+    """ Update callback that lays out the traces of all computed datasets. Selection of the
+    displayed datasets, colors and scaling of the rows are applied in the browser by the
+    showICLIP clientside callback, which uses the row descriptions returned with the figure.
     
     Positional arguments:
-    figData -- Trace data from the data callback.
-    datasets -- List of selected datasets.
+    figToken -- Token for the trace data from the data callback.
     seqDisp -- Sytle for the reference sequence.
-    colorF -- Colors for the traces.
     legendSpacing -- Spacing between legend and colorbar.
     """
-    figData = figData
+    figData = loadFigureData(figToken)
+    if figData is None: # Nothing computed yet or evicted from the cache
+        raise dash.exceptions.PreventUpdate()
     traces = []
-    rowHeights = []
     legendColumnSpacing = legendSpacing
-    numRows = 1
     try:
         seqTrace = figData[seqDisp]
     except:
         seqTrace = []
-    colorDict = colorF
     numIsoforms = len(figData['geneModels'])
-    numParams = 0
-    for index, elem in enumerate(figData['iCLIPTraces']):
-            name = elem[0]['meta']
-            newColor = colorDict[name]
-            if name in dataSets:
-                numParams += 1
-                element = figData['iCLIPTraces'][index][0]
-                element['marker'] = go.bar.Marker(
-                        color = newColor 
-                        )
-                traces.append(element)
-                
-                numRows += 1
-                if len(elem) == 2:
-                    if elem[1] != [] or cfg.procAvail:
-                        elements = elem[1]
-                        for i in elements:
-                            i['marker'] = {'color' : newColor}
-                        traces.append(elements)
-                        numRows += 1
+    numParams = len(figData['iCLIPTraces'])
+    rowOffset = 4  # Relative size of data tracks compared to gene model tracks
+    # Rows from top to bottom with their dataset, relative height and the scale for the height
+    rows = [{'dataSet' : None, 'weight' : 1, 'scale' : None}] # Sequence row
+    for elem in figData['iCLIPTraces']:
+        name = elem[0]['meta']
+        traces.append(elem[0])
+        rows.append({'dataSet' : name, 'weight' : rowOffset, 'scale' : 'iCLIPScale'})
+        if len(elem) == 2:
+            if elem[1] != [] or cfg.procAvail:
+                traces.append(elem[1])
+                rows.append({'dataSet' : name, 'weight' : 0.5, 'scale' : 'bsScale'})
     for i in figData['geneModels']:
         traces.append(i)
-        numRows += 1
+        rows.append({'dataSet' : None, 'weight' : 1, 'scale' : None})
+    numRows = len(rows)
     plotSpace = 0.8  # Space taken up by data tracks
     spacingSpace = 1.0 - plotSpace  # Space left for spacer tracks
-    rowHeight = plotSpace / numRows
     if numRows > 1:
         vSpace = spacingSpace / (numRows - 1)
     else:
         vSpace = spacingSpace
 
-    # Final height values for rows respecting type, has to be in bottom-up order
-    dataSetHeights = [] # Base unit to build height list from contains entries for one dataset
-    # Set correct graph height based on row number and type
-    rowOffset = 4  # Relative size of data tracks compared to gene model tracks
+    # Final height values for rows, has to be in bottom-up order
+    rowHeights = [i['weight'] for i in rows][::-1]
     baseHeight = 30  # Size of gene model row, for plot scaling
-    if cfg.rawAvail == True:
-        rawDataRows = numParams * rowOffset
-    else:
-        rawDataRows = 0
-    if cfg.procAvail == True and rawDataRows > 0:
-        procDataRows = numParams * 0.5
-    else:
-        procDataRows = 0
-    if cfg.procAvail == True:
-        dataSetHeights.append(rowHeight / 2 * bsScale)
-    if cfg.rawAvail == True:
-        dataSetHeights.append(rowHeight * rowOffset * iCLIPScale)
-        
-    rowHeights = [rowHeight] * numIsoforms + dataSetHeights * numParams + [rowHeight]
     blockHeight = 0.4
     fig = tools.make_subplots(print_grid=False, rows=numRows, cols=1, shared_xaxes=True, vertical_spacing=vSpace, row_width=rowHeights)
     for i in seqTrace:
@@ -144,7 +109,9 @@ def showICLIP(figData, dataSets, seqDisp, colorF, legendSpacing,  iCLIPScale, bs
     fig['layout']['xaxis'].update(ticks='outside')
     fig['layout']['xaxis'].update(ticksuffix='b')
     fig['layout'].update(hovermode='x')
-    if strand == '-':
+    if figData['window'] is not None: # Zoomed in, show the computed part of the region
+        fig['layout']['xaxis'].update(range=figData['window'][::1 if strand == '+' else -1])
+    elif strand == '-':
         fig['layout']['xaxis'].update(autorange='reversed')
     # The trailing ',' actually matters for some reason, don't remove
     fig['layout'].update(
@@ -161,101 +128,145 @@ def showICLIP(figData, dataSets, seqDisp, colorF, legendSpacing,  iCLIPScale, bs
     for i in range(1,numRows + 1):  # Prevent zoom on y axis
         fig['layout']['yaxis' + str(i)].update(fixedrange=True)
 
-    fig['layout']['height'] = (baseHeight * rawDataRows * iCLIPScale
-                               + baseHeight * procDataRows *bsScale
-                               + baseHeight * (numIsoforms + 1)
-                               + 80)
+    fig['layout']['height'] = baseHeight * sum(rowHeights) + 80
     fig['layout']['legend'].update(x = legendColumnSpacing)            
-    return fig
+    return {'figure' : fig, 'rows' : rows}
+
+# Display only settings are applied in the browser, see assets/clientside.js
+app.clientside_callback(
+    dash.dependencies.ClientsideFunction('seqing', 'showICLIP'),
+    dash.dependencies.Output('bsGraph', 'figure'),
+    [dash.dependencies.Input('bsFigMem', 'data'),
+     dash.dependencies.Input('paramList', 'values'),
+     dash.dependencies.Input('colorFinal', 'data'),
+     dash.dependencies.Input('iCLIPScale', 'value'),
+     dash.dependencies.Input('bsScale', 'value')]
+)
 
 
 @app.callback(
     dash.dependencies.Output('bsGraphMem', 'data'),
-    [dash.dependencies.Input('geneDrop', 'value')],
-    [dash.dependencies.State('paramList', 'values'),
-     dash.dependencies.State('sequenceRadio', 'value'),
+    [dash.dependencies.Input('geneDrop', 'value'),
+     dash.dependencies.Input('paramList', 'values'),
+     dash.dependencies.Input('bsGraph', 'relayoutData')],
+    [dash.dependencies.State('sequenceRadio', 'value'),
      dash.dependencies.State('colorFinal', 'data'),
-     dash.dependencies.State('legendSpacingDiv', 'data')]
+     dash.dependencies.State('legendSpacingDiv', 'data'),
+     dash.dependencies.State('bsGraphMem', 'data')]
 )
-def iCLIPCallback(geneName, dataSets, seqDisp, colorsFinal, legendSpacing):
-    """Data callback that handles the selection of data and creates all possible traces.
+def iCLIPCallback(geneName, dataSets, relayoutData, seqDisp, colorsFinal, legendSpacing, oldToken):
+    """Data callback that handles the selection of data and creates the traces of the selected
+    datasets. If only the dataset selection changed, traces of datasets that were already computed
+    for the current gene are kept and only newly selected datasets are computed. After zooming
+    or panning the traces are created for the shown part of the gene region only. The trace data
+    is kept in the figure cache, the store only receives its token.
 
     Positional arguments:
     geneName -- Name of the selected gene in order to filter the data.
     dataSets -- Selected data tracks with raw binding site data.
+    relayoutData -- Last zoom or pan of the graph.
     seqDisp -- Display mode for dna sequence trace.
     colorsFinal -- Last confirmed color.
     legendSpacing -- Specifies margin between colorbar and other legend items.
+    oldToken -- Token for the data of the last call of this callback.
     """
-    dataSets = cfg.dataSetNames
     # Check which of the two triggering buttons was pressed last
     colors = colorsFinal
+    # Keep the order of the sorted list of data tracks for the selected tracks
+    selected = [i for i in sortDataSets() if i in (dataSets or [])]
+    triggers = [t['prop_id'] for t in dash.callback_context.triggered]
+    oldFigData = loadFigureData(oldToken)
+    sameGene = oldFigData is not None and oldFigData.get('gene') == geneName
+    region = geneRegion(geneName)
+    if region.isoforms.empty: # Unknown gene or no gene selected
+        raise dash.exceptions.PreventUpdate()
+    if triggers == ['paramList.values'] and sameGene:
+        # Only the dataset selection changed, add the datasets that are missing
+        computed = [elem[0]['meta'] for elem in oldFigData['iCLIPTraces']]
+        missing = [i for i in selected if i not in computed]
+        if len(missing) == 0:
+            raise dash.exceptions.PreventUpdate()
+        xAxisMin, xAxisMax = oldFigData['window'] or (region.xAxisMin, region.xAxisMax)
+        iCLIPTraces = [createICLIPTrace(i, xAxisMax, xAxisMin,
+                                        region.chrom, region.strand, colors) for i in missing]
+        oldFigData.update({'iCLIPTraces' : mergeICLIPTraces(oldFigData['iCLIPTraces'], iCLIPTraces)})
+        return storeFigureData(oldFigData)
+    window = None # Part of the gene region that is shown, None for the whole region
+    if triggers == ['bsGraph.relayoutData']:
+        if not sameGene:
+            raise dash.exceptions.PreventUpdate()
+        try:
+            window = viewWindow(relayoutData, region)
+        except ValueError:
+            raise dash.exceptions.PreventUpdate()
+        if window == (tuple(oldFigData['window']) if oldFigData['window'] else None):
+            raise dash.exceptions.PreventUpdate()
     # Dict that will store plot data, to be serialized later
     figData = {}
-    # Sort the list of selected data tracks to keep consistent order
-    for i in cfg.sortKeys:
-        try:
-            dataSets.sort(key=eval(i[0], {'__builtins__': None}, {}), reverse=eval(i[1], {'__builtins__': None}, {}))
-        except (TypeError, SyntaxError):
-            print(
-                'Please check your keys. Each key should be added similar to this: -k \'lambda x : x[-2:]\' \'False\'	. For multiple keys use multiple instances of -k')
-    # Select appropriate data from either the coding or non-coding set
-    currentGene = pandas.DataFrame()
-    for elem in cfg.geneAnnotations:
-        currentGene = elem[elem['geneID'].str.contains(geneName)]
-        if not currentGene.empty:
-            break
     # Setup some variables for plot creation 
-    xAxisMin = currentGene['chromStart'].min() # Left border of the plot region
-    xAxisMax = currentGene['chromEnd'].max() # Rigt border of the plot region
-    strand = currentGene['strand'].iloc[0] # Strand the selected gene is on
-    chrom = currentGene['chrom'].iloc[0] # Chromosome the selected gene is on
+    xAxisMin, xAxisMax = window or (region.xAxisMin, region.xAxisMax) # Borders of the plot region
+    strand = region.strand # Strand the selected gene is on
+    chrom = region.chrom # Chromosome the selected gene is on
    
+    figData.update({'gene' : geneName})
     figData.update({'strand' : strand})
-    overlappingGenes = []
-    for i in cfg.geneAnnotations: # Select data for gene model from all annotaion files
-        bcrit11 = i['chrom'] == chrom
-        bcrit21 = i['chromStart'] >= xAxisMin
-        bcrit22 = i['chromStart'] <= xAxisMax
-        bcrit31 = i['chromEnd'] >= xAxisMin
-        bcrit32 = i['chromEnd'] <= xAxisMax
-        bcrit41 = i['chromStart'] <= xAxisMin
-        bcrit42 = i['chromEnd'] >= xAxisMax
-        preDF = i.loc[bcrit11 & ((bcrit21 & bcrit22) | (bcrit31 & bcrit32) | (bcrit41 & bcrit42))]
-        result = preDF[~preDF['geneID'].str.contains(geneName)]
-        overlappingGenes.append(result)
-        
-    overlaps = pandas.concat(overlappingGenes)
-    isoformList = pandas.concat([currentGene, overlaps]) 
-
-    # Create list of 3-tupels containing start, end, name for each isoform.
-    isoformRanges = []
-    for elem in currentGene.itertuples():
-        name = elem.transID
-        isoformRanges.append((elem.chromStart, elem.chromEnd, name))
-    # Create master sequence for sequence display
-    try:
-        combinedSeq = generateMasterSequence(cfg.sequences, isoformRanges, xAxisMin, xAxisMax)
-    except TypeError:
-        combinedSeq = ''
-    try:  # Create traces for sequence display, either scatter or heatmap
-        figData.update({'heatSeq' : createSequenceTrace('heatSeq', strand, combinedSeq, xAxisMin, xAxisMax)})
-        figData.update({'letterSeq' : createSequenceTrace('letterSeq', strand, combinedSeq, xAxisMin, xAxisMax)})
-    except IndexError:
-        pass
-    except TypeError:
-        pass
+    figData.update({'window' : window})
+    # Traces for sequence display, either scatter or heatmap
+    figData.update(sequenceTraces(region, xAxisMin, xAxisMax))
 
     iCLIPTraces = []
-    for i in range(len(dataSets)):
-        bsTraces = createICLIPTrace(dataSets[i], xAxisMax, xAxisMin, chrom, strand, colors)  # Plot binding site data
+    for i in selected:
+        bsTraces = createICLIPTrace(i, xAxisMax, xAxisMin, chrom, strand, colors)  # Plot binding site data
         iCLIPTraces.append(bsTraces)
     figData.update({'iCLIPTraces' : iCLIPTraces})
-    # Calculate gene models. We have to distinguish between coding region and non-coding region
-    blockHeight = 0.4
-    geneModels = createGeneModelPlot(isoformList, xAxisMin, xAxisMax, blockHeight, strand)
-    figData.update({'geneModels' : geneModels})
-    return figData
+    figData.update({'geneModels' : region.geneModels})
+    return storeFigureData(figData)
+
+def storeFigureData(figData):
+    """Serializes the data of a data callback into the figure cache and returns its token.
+
+    Positional arguments:
+    figData -- Dict with the plot data.
+    """
+    return cfg.figureCache.put(json.dumps(figData, cls = pu.PlotlyJSONEncoder))
+
+def loadFigureData(token):
+    """Returns the data stored in the figure cache for a token as freshly decoded dict,
+    None if there is no data for the token.
+
+    Positional arguments:
+    token -- Token returned by storeFigureData.
+    """
+    text = cfg.figureCache.get(token)
+    if text is None:
+        return None
+    return json.loads(text)
+
+def sortDataSets():
+    """Sorts the list of data tracks with the user supplied sort keys to keep a consistent
+    order and returns it.
+    """
+    dataSets = cfg.dataSetNames
+    for i in cfg.sortKeys:
+        try:
+            dataSets.sort(key=eval(i[0], {'__builtins__': None}, {}), reverse=eval(i[1], {'__builtins__': None}, {}))
+        except (TypeError, SyntaxError):
+            print(
+                'Please check your keys. Each key should be added similar to this: -k \'lambda x : x[-2:]\' \'False\'	. For multiple keys use multiple instances of -k')
+    return dataSets
+
+def mergeICLIPTraces(iCLIPTraces, newTraces):
+    """Merges the traces of newly computed data tracks into the list of computed traces,
+    ordered like the sorted list of data tracks.
+
+    Positional arguments:
+    iCLIPTraces -- List of traces per data track, as created by createICLIPTrace.
+    newTraces -- List of traces of additional data tracks.
+    """
+    traceDict = {}
+    for elem in iCLIPTraces + newTraces:
+        traceDict[elem[0]['meta']] = elem
+    return [traceDict[i] for i in sortDataSets() if i in traceDict]
 
 def generateMasterSequence(sequences, isoforms, xAxisMin, xAxisMax):
     """Helper function that creates a master sequence given a dataframe with sequences and a list containing
@@ -350,26 +361,18 @@ def createICLIPTrace(name, xMax, xMin, chrom, strand, colors):
     colors -- Colors for the traces.
     """
     colors = colors
-    # Selection criteria
-    crit1 = cfg.bsRawDFs[name]['chrom'] == chrom
-    crit21 = cfg.bsRawDFs[name]['chromStart'] >= xMin
-    crit22 = cfg.bsRawDFs[name]['chromStart'] <= xMax
-    crit31 = cfg.bsRawDFs[name]['chromEnd'] >= xMin
-    crit32 = cfg.bsRawDFs[name]['chromEnd'] <= xMax
-    rawSites = cfg.bsRawDFs[name].loc[crit1 & ((crit21 & crit22) | (crit31 & crit32))]
-    # Setup arrays to hold the values that will be needed for plotting
-    countsX = []
-    countsY = []
-    countsW = []
-    for i in rawSites.itertuples():
-        countsX.append(i.chromStart)
-        countsY.append(i.count)
-        countsW.append(i.chromEnd - i.chromStart)
+    # Select crosslinks in the region, the store returns arrays sorted by start point
+    rawSites = cfg.bsRawDFs[name].query(chrom, xMin, xMax)
+    xVals = rawSites['chromStart']
+    yVals = rawSites['count']
+    widths = rawSites['chromEnd'] - rawSites['chromStart']
+    if xMax - xMin > cfg.fullResolution: # Long region, reduce to one bar per pixel
+        xVals, yVals, widths = envelopeBars(xVals, yVals, xMin, xMax)
     # Plot data
     rawTrace = go.Bar(
-        x=countsX,
-        y=countsY,
-        width=countsW,
+        x=xVals,
+        y=yVals,
+        width=widths,
         hoverinfo='x+y',
         name=name,
         meta = name,
@@ -380,38 +383,52 @@ def createICLIPTrace(name, xMax, xMin, chrom, strand, colors):
         showlegend=True
     )
 
-    # Setup criteria to select binding sites that are within the current region of the genome
-    procSitesList = []
+    # Select binding sites on the strand of the gene, all sites of a dataset share one trace
+    procTrace = []
     try:
-        bcrit11 = cfg.bsProcDFs[name]['chrom'] == chrom
-        bcrit12 = cfg.bsProcDFs[name]['strand'] == strand
-        bcrit21 = cfg.bsProcDFs[name]['chromStart'] >= xMin
-        bcrit22 = cfg.bsProcDFs[name]['chromStart'] <= xMax
-        bcrit31 = cfg.bsProcDFs[name]['chromEnd'] >= xMin
-        bcrit32 = cfg.bsProcDFs[name]['chromEnd'] <= xMax
-        bindingSites = cfg.bsProcDFs[name].loc[bcrit11 & bcrit12 & ((bcrit21 & bcrit22) | (bcrit31 & bcrit32))]
-        # Plot binding sites
-        for k in bindingSites.itertuples():
-                procSitesList.append(
-                    go.Bar(
-                        opacity = 0.5,
-                        x = [k.chromStart + (k.chromEnd - k.chromStart) // 2],
-                        y = [0.1],
-                        hoverinfo = 'name',
-                        legendgroup = name,
-                        width = k.chromEnd - k.chromStart,
-                        name = name + '_bs',
-                        meta = name,
-                        marker = go.bar.Marker(
-                            color = colors[name]
-                        ), showlegend = False
-                    )
-                )
+        bindingSites = cfg.bsProcDFs[name].query(chrom, xMin, xMax, strand)
+        widths = bindingSites['chromEnd'] - bindingSites['chromStart']
+        procTrace = go.Bar(
+            opacity = 0.5,
+            x = bindingSites['chromStart'] + widths // 2,
+            y = numpy.full(len(widths), 0.1),
+            hoverinfo = 'name',
+            legendgroup = name,
+            width = widths,
+            name = name + '_bs',
+            meta = name,
+            marker = go.bar.Marker(
+                color = colors[name]
+            ), showlegend = False
+        )
     except KeyError:
         pass
     except Exception as e:
         print('Error in binding plot: ' + str(type(e).__name__) + str(e.args))
-    return [rawTrace, procSitesList]
+    return [rawTrace, procTrace]
+
+def envelopeBars(chromStarts, counts, xMin, xMax, numBuckets = 2000):
+    """Reduces crosslink bars to one bar per bucket of equal size, holding the highest count
+    of the crosslinks starting in the bucket. Returns x-axis values, counts and widths of
+    the bars, the x-axis values are the bucket centers as plotly centers bars on x.
+
+    Positional arguments:
+    chromStarts -- Sorted array of crosslink start points.
+    counts -- Array of crosslink counts.
+    xMin -- Left border of the region.
+    xMax -- Right border of the region.
+
+    Keyword arguments:
+    numBuckets -- Number of buckets, about the width of the graph in pixels.
+    """
+    length = max(int(xMax) - int(xMin), 1)
+    width = -(-length // numBuckets) # Round up
+    buckets = numpy.clip(numpy.asarray(chromStarts, dtype = numpy.int64) - int(xMin), 0, length - 1) // width
+    if len(buckets) == 0:
+        return buckets, numpy.asarray(counts), buckets
+    firsts = numpy.flatnonzero(numpy.concatenate([[True], buckets[1:] != buckets[:-1]]))
+    maxCounts = numpy.maximum.reduceat(numpy.asarray(counts), firsts)
+    return buckets[firsts] * width + int(xMin) + width / 2, maxCounts, numpy.full(len(firsts), width)
 
 
 
@@ -434,60 +451,62 @@ def setUpBlockConstraints(chromStart, chromEnd, blockStarts, blockSizes, xAxisMi
         Tupel containing finished block starts and block sizes as lists:
         (blockStartsF, blockSizesF)
     """
-    if chromStart >= xAxisMin:
-        if chromEnd <= xAxisMax: # Gene contained entirely in region, no cutting necessary
-            loc = 'cont'
-            blockStartsF = [int(x) + chromStart for x in blockStarts.rstrip(',').split(',')]
-            blockSizesF = [int(x) for x in blockSizes.rstrip(',').split(',')]
-        else: # Gene overlaps region on right, cut end
-            loc = 'left'
-            blockStartsF = [int(x) + chromStart for x in blockStarts.rstrip(',').split(',')]
-            blockSizesF = [int(x) for x in blockSizes.rstrip(',').split(',')]
-            for index, elem in enumerate(blockStartsF):
-                if elem >= xAxisMax: # The current block starts right of the relevant region, disregard
-                    blockStartsF[index] = -1
-                else:
-                    blockEnd = elem + blockSizesF[index]
-                    if  blockEnd > xAxisMax:
-                        blockSizesF[index] = blockSizesF[index] - (blockEnd-xAxisMax)
-    else: 
-        if chromEnd <= xAxisMax: # Gene overlaps on the left, cut start
-            loc = 'right'
-            blockStartsF = [int(x) + chromStart for x in blockStarts.rstrip(',').split(',')]
-            blockSizesF = [int(x) for x in blockSizes.rstrip(',').split(',')]
-            for index, elem in enumerate(blockStartsF):
-                if elem + blockSizesF[index] < xAxisMin: # Block ends left of relevant regeion, disregard
-                    blockStartsF[index] = -1
-                else: 
-                    if  elem < xAxisMin: 
-                        startOffset = xAxisMin - elem
-                        blockStartsF[index] = xAxisMin
-                        blockSizesF[index] = blockSizesF[index] - startOffset
-        else: # Gene extends to the left and right of the region, cut on both ends
-            loc = 'both'
-            blockStartsF = [int(x) + chromStart for x in blockStarts.rstrip(',').split(',')]
-            blockSizesF = [int(x) for x in blockSizes.rstrip(',').split(',')]
-            for index, elem in enumerate(blockStartsF):
-                blockEnd = elem + blockSizesF[index]
-                if  blockEnd < xAxisMin or elem >= xAxisMax: # Block lies left or right of relevant region, disregard
-                    blockStartsF[index] = -1
-                else:
-                    if  elem < xAxisMin: # Block overlaps on the left
-                        startOffset = xAxisMin - elem
-                        blockStartsF[index] = xAxisMin
-                        blockSizesF[index] = blockSizesF[index] - startOffset
-                    if blockEnd > xAxisMax: # Block overlaps on the right
-                        blockSizesF[index] = blockSizesF[index] - (blockEnd-xAxisMax)
+    starts = numpy.array(blockStarts.rstrip(',').split(','), dtype = numpy.int64) + chromStart
+    sizes = numpy.array(blockSizes.rstrip(',').split(','), dtype = numpy.int64)
+    blockStartsF, blockSizesF = clipBlocks(chromStart, chromEnd, starts, starts + sizes, xAxisMin, xAxisMax)
+    return (blockStartsF.tolist(), blockSizesF.tolist(), overlapForm(chromStart, chromEnd, xAxisMin, xAxisMax))
+
+def overlapForm(chromStart, chromEnd, xAxisMin, xAxisMax):
+    """ Returns how an isoform overlaps the relevant region: 'cont' if it is contained
+        in the region, 'left' or 'right' if it is cut on the right or left side of the
+        region and 'both' if it extends to both sides.
+
+        Positional arguments:
+        chromStart -- Isoform start point.
+        chromEnd -- Isoform end point.
+        xAxisMin -- Start of the relevant genomic region.
+        xAxisMax -- End of the relevant genomic region.
+    """
+    forms = {(False, False) : 'cont', (False, True) : 'left', (True, False) : 'right', (True, True) : 'both'}
+    return forms[(bool(chromStart < xAxisMin), bool(chromEnd > xAxisMax))]
+
+def clipBlocks(chromStart, chromEnd, starts, ends, xAxisMin, xAxisMax):
+    """ Vectorized version of setUpBlockConstraints, working on absolute exon coordinates.
+        Isoform start and end points can be given per block, so blocks of several isoforms
+        can be clipped at once. Blocks outside of the region get a start of -1, partially
+        overlapping blocks are cut at the borders of the region.
+
+        Positional arguments:
+        chromStart -- Isoform start point, scalar or array with one value per block.
+        chromEnd -- Isoform end point, scalar or array with one value per block.
+        starts -- Array of absolute block start points.
+        ends -- Array of absolute block end points.
+        xAxisMin -- Start of the relevant genomic region.
+        xAxisMax -- End of the relevant genomic region.
+
+        Returns:
+        Tupel containing block starts and block sizes as arrays:
+        (blockStartsF, blockSizesF)
+    """
+    xAxisMin = int(xAxisMin)
+    xAxisMax = int(xAxisMax)
+    starts = numpy.asarray(starts, dtype = numpy.int64)
+    ends = numpy.asarray(ends, dtype = numpy.int64)
+    cutLeft = numpy.asarray(chromStart, dtype = numpy.int64) < xAxisMin # Isoform overlaps region on the left, cut start
+    cutRight = numpy.asarray(chromEnd, dtype = numpy.int64) > xAxisMax # Isoform overlaps region on the right, cut end
+    # Blocks ending left or starting right of the region are disregarded
+    outside = (cutLeft & (ends < xAxisMin)) | (cutRight & (starts >= xAxisMax))
+    blockStartsF = numpy.where(cutLeft, numpy.maximum(starts, xAxisMin), starts)
+    blockEnds = numpy.where(cutRight, numpy.minimum(ends, xAxisMax), ends)
+    blockSizesF = numpy.where(outside, ends - starts, blockEnds - blockStartsF)
+    blockStartsF = numpy.where(outside, -1, blockStartsF)
     # Additional checks for bad inputs
-    for index, elem in enumerate(blockStartsF):
-        if elem > xAxisMax:
-            blockStartsF[index] = -1 
-        else:
-            if elem + blockSizesF[index] > xAxisMax:
-                blockSizesF[index] = xAxisMax - elem
-    return (blockStartsF, blockSizesF, loc)
+    beyond = blockStartsF > xAxisMax
+    blockSizesF = numpy.where(~beyond & (blockStartsF + blockSizesF > xAxisMax), xAxisMax - blockStartsF, blockSizesF)
+    blockStartsF = numpy.where(beyond, -1, blockStartsF)
+    return (blockStartsF, blockSizesF)
                 
-def calculateBlocks(thickStart, thickEnd, blockStart, blockEnd, blockVals, blockWidths, blockYs, blockHeight, strand):
+def calculateBlocks(thickStart, thickEnd, blockStart, blockEnd, blockVals, blockWidths, blockYs, blockHeight):
     """ This function determines the actual shape of each block, based on wether it's
         located in coding or noncoding region, or on the boundary. The function directly appends to the input lists
         
@@ -502,55 +521,59 @@ def calculateBlocks(thickStart, thickEnd, blockStart, blockEnd, blockVals, block
         blockYa -- Holds the y value of the block, this determines wether it's a coding or noncoding block.
         blockHeight -- The height value to use for coding blocks. Non coding blocks are half height.
     """
-    blockStart = blockStart
-    if blockStart != -1 and blockStart != blockEnd:
-        blockEnd = blockEnd  # Same as codingRegionEnd
-        codingRegionStart = int(thickStart)
-        codingRegionEnd = int(thickEnd)
-        if (blockStart >= codingRegionStart) & (blockEnd <= codingRegionEnd):
-            # Block is inside coding region
-            blockVals.append(blockStart + ((blockEnd-1) - blockStart) / 2)
-            blockWidths.append(blockEnd - blockStart )
-            blockYs.append(blockHeight)
-        if (blockStart >= codingRegionStart) & (blockEnd > codingRegionEnd):
-            if (blockStart >= codingRegionEnd):
-                # Block is right of coding region
-                blockVals.append(blockStart + ((blockEnd-1) - blockStart) / 2)
-                blockWidths.append(blockEnd - blockStart )
-                blockYs.append(blockHeight / 2)
-            else:
-                # Block overlaps coding region on the left
-                blockVals.append(blockStart + ((codingRegionEnd -1)- blockStart) / 2)
-                blockWidths.append(codingRegionEnd - blockStart )
-                blockYs.append(blockHeight)
-                blockVals.append((codingRegionEnd-1)+ (blockEnd - (codingRegionEnd-1)) / 2)
-                blockWidths.append(blockEnd - (codingRegionEnd ))
-                blockYs.append(blockHeight / 2)
-        if (blockStart < codingRegionStart) & (blockEnd <= codingRegionEnd):
-            if blockEnd <= codingRegionStart:
-                # Block is Left of coding region
-                blockVals.append(blockStart + ((blockEnd-1) - blockStart) / 2)
-                blockWidths.append(blockEnd - blockStart)
-                blockYs.append(blockHeight / 2)
-            else:
-                # Block overlaps coding region on the right
-                blockVals.append(blockStart + ((codingRegionStart-1) - blockStart) / 2)
-                blockWidths.append((codingRegionStart-1) - blockStart + 1)
-                blockYs.append(blockHeight / 2)
-                blockVals.append(codingRegionStart + (blockEnd - (codingRegionStart+1)) / 2)
-                blockWidths.append(blockEnd - codingRegionStart)
-                blockYs.append(blockHeight)
-        if (blockStart < codingRegionStart) & (blockEnd > codingRegionEnd):
-            # Block completely contains coding region
-            blockVals.append(blockStart + ((codingRegionStart-1) - blockStart) / 2)
-            blockWidths.append((codingRegionStart-1) - blockStart + 1)
-            blockYs.append(blockHeight / 2)
-            blockVals.append(codingRegionStart + (codingRegionEnd - codingRegionStart) / 2)
-            blockWidths.append(codingRegionEnd - codingRegionStart + 1)
-            blockYs.append(blockHeight)
-            blockVals.append(codingRegionEnd + (blockEnd - codingRegionEnd) / 2)
-            blockWidths.append(blockEnd - (codingRegionEnd + 1))
-            blockYs.append(blockHeight / 2)
+    pieces = splitBlocks([thickStart], [thickEnd], [blockStart], [blockEnd], blockHeight)
+    blockVals.extend(pieces[0].tolist())
+    blockWidths.extend(pieces[1].tolist())
+    blockYs.extend(pieces[2].tolist())
+
+def splitBlocks(thickStarts, thickEnds, blockStarts, blockEnds, blockHeight):
+    """ Vectorized version of calculateBlocks. Splits every block into up to three pieces,
+        a noncoding piece left of the coding region, a coding piece and a noncoding piece
+        right of the coding region. Blocks with a start of -1 or without size are skipped.
+
+        Positional Arguments:
+        thickStarts -- Start point of the coding region for each block.
+        thickEnds -- End point of the coding region for each block.
+        blockStarts -- Start point of each block.
+        blockEnds -- End point of each block.
+        blockHeight -- The height value to use for coding blocks. Non coding blocks are half height.
+
+        Returns:
+        Tupel of arrays with center, width and height of every piece and the position of
+        the block it belongs to, pieces are ordered by block and from left to right:
+        (blockVals, blockWidths, blockYs, blocks)
+    """
+    cs = numpy.asarray(thickStarts).astype(numpy.int64)
+    ce = numpy.asarray(thickEnds).astype(numpy.int64)
+    s = numpy.asarray(blockStarts, dtype = numpy.int64)
+    e = numpy.asarray(blockEnds, dtype = numpy.int64)
+    drawn = (s != -1) & (s != e)
+    inside = drawn & (s >= cs) & (e <= ce) # Block is inside coding region
+    rightOf = drawn & (s >= cs) & (e > ce) & (s >= ce) # Block is right of coding region
+    overlapsEnd = drawn & (s >= cs) & (e > ce) & (s < ce) # Block overlaps coding region on the left
+    leftOf = drawn & (s < cs) & (e <= ce) & (e <= cs) # Block is left of coding region
+    overlapsStart = drawn & (s < cs) & (e <= ce) & (e > cs) # Block overlaps coding region on the right
+    contains = drawn & (s < cs) & (e > ce) # Block completely contains coding region
+    whole = (s + ((e - 1) - s) / 2, e - s)
+    # Noncoding piece left of the coding region
+    leftVals = numpy.where(leftOf, whole[0], s + ((cs - 1) - s) / 2)
+    leftWidths = numpy.where(leftOf, whole[1], cs - s)
+    leftValid = leftOf | overlapsStart | contains
+    # Coding piece
+    midVals = numpy.select([inside, overlapsEnd, overlapsStart], [whole[0], s + ((ce - 1) - s) / 2, cs + (e - (cs + 1)) / 2],
+                           cs + (ce - cs) / 2)
+    midWidths = numpy.select([inside, overlapsEnd, overlapsStart], [whole[1], ce - s, e - cs], ce - cs + 1)
+    midValid = inside | overlapsEnd | overlapsStart | contains
+    # Noncoding piece right of the coding region
+    rightVals = numpy.select([rightOf, overlapsEnd], [whole[0], (ce - 1) + (e - (ce - 1)) / 2], ce + (e - ce) / 2)
+    rightWidths = numpy.select([rightOf, overlapsEnd], [whole[1], e - ce], e - (ce + 1))
+    rightValid = rightOf | overlapsEnd | contains
+    valid = numpy.stack([leftValid, midValid, rightValid], axis = 1).ravel()
+    vals = numpy.stack([leftVals, midVals, rightVals], axis = 1).ravel()[valid]
+    widths = numpy.stack([leftWidths, midWidths, rightWidths], axis = 1).ravel()[valid]
+    ys = numpy.tile([blockHeight / 2, blockHeight, blockHeight / 2], len(s))[valid]
+    blocks = numpy.repeat(numpy.arange(len(s)), 3)[valid]
+    return (vals.astype(float), widths, ys, blocks)
 
 def createSequenceTrace(seqDisp, strand, combinedSeq, xAxisMin, xAxisMax):
     """ Function to generate sequence display trace, either heatmap or scatter
@@ -706,6 +729,120 @@ def createSequenceTrace(seqDisp, strand, combinedSeq, xAxisMin, xAxisMax):
         return [heatTrace]
 
 
+class GeneRegion:
+    """ Everything the callbacks of the different tabs need to know about the region of a
+    gene: its isoforms, the region bounds, strand and chromosome, the overlapping isoforms
+    with their gene model traces and the descriptions of the gene. Use geneRegion to get
+    the shared instance for a gene. Also holds the reference sequence of the region. For
+    unknown genes only the descriptions are set, the isoforms are empty and the region
+    bounds are None.
+
+    Positional arguments:
+    geneName -- Identifier of the gene.
+    """
+    blockHeight = 0.4 # Height of gene model blocks
+
+    def __init__(self, geneName):
+        self.geneName = geneName
+        self.description = None # Description row from the description file, if there is one
+        if cfg.descAvail:
+            try:
+                self.description = cfg.geneDescriptions.loc[
+                    cfg.geneDescriptions['ensembl_gene_id'] == geneName,
+                    ['description']
+                ].iloc[0]
+            except (IndexError, KeyError):
+                pass
+        self.details = pandas.DataFrame() # Rows of the advanced description file
+        if cfg.advancedDesc is not None and geneName in cfg.advancedDescIndex:
+            self.details = cfg.advancedDesc.iloc[cfg.advancedDescIndex[geneName]]
+        self.isoforms = indexing.lookupGene(cfg.geneAnnotations, cfg.geneIndices, geneName)
+        if self.isoforms.empty: # Unknown gene or no gene selected, there is no region to plot
+            self.xAxisMin = self.xAxisMax = self.strand = self.chrom = None
+            self.isoformList = self.isoforms
+            self.geneModels = []
+            self.sequence = ''
+            return
+        self.xAxisMin = int(self.isoforms['chromStart'].min()) # Left border of the plot region
+        self.xAxisMax = int(self.isoforms['chromEnd'].max()) # Right border of the plot region
+        self.strand = self.isoforms['strand'].iloc[0]
+        self.chrom = self.isoforms['chrom'].iloc[0]
+        # Select data for gene models from all annotation files
+        overlaps = indexing.overlappingIsoforms(cfg.geneAnnotations, cfg.intervalIndices,
+                                                self.chrom, self.xAxisMin, self.xAxisMax)
+        overlaps = overlaps[overlaps['geneID'] != geneName]
+        self.isoformList = pandas.concat([self.isoforms, overlaps])
+        self.geneModels = createGeneModelPlot(self.isoformList, self.xAxisMin, self.xAxisMax,
+                                              self.blockHeight, self.strand)
+        # Create list of 3-tupels containing start, end, name for each isoform.
+        isoformRanges = []
+        for elem in self.isoforms.itertuples():
+            isoformRanges.append((elem.chromStart, elem.chromEnd, elem.transID))
+        # Create master sequence for sequence display
+        try:
+            self.sequence = generateMasterSequence(cfg.sequences, isoformRanges, self.xAxisMin, self.xAxisMax)
+        except TypeError:
+            self.sequence = ''
+
+@functools.lru_cache(maxsize = 32)
+def geneRegion(geneName):
+    """ Returns the GeneRegion of a gene. The last recently used regions are kept, so all
+    callbacks triggered by selecting a gene share one computation.
+
+    Positional arguments:
+    geneName -- Identifier of the gene.
+    """
+    return GeneRegion(geneName)
+
+def viewWindow(relayoutData, region):
+    """ Returns the part of a gene region shown after zooming or panning a graph as
+    (start, end), None for the whole region. Raises a ValueError if relayoutData does not
+    change the x-axis.
+
+    Positional arguments:
+    relayoutData -- relayoutData property of the graph.
+    region -- GeneRegion of the displayed gene.
+    """
+    relayoutData = relayoutData or {}
+    if relayoutData.get('xaxis.autorange') == True:
+        return None
+    try:
+        bounds = relayoutData['xaxis.range']
+    except KeyError:
+        try:
+            bounds = [relayoutData['xaxis.range[0]'], relayoutData['xaxis.range[1]']]
+        except KeyError:
+            raise ValueError('No change of the x-axis')
+    start = max(int(numpy.floor(min(bounds))), region.xAxisMin)
+    end = min(int(numpy.ceil(max(bounds))), region.xAxisMax)
+    if start <= region.xAxisMin and end >= region.xAxisMax:
+        return None
+    end = max(end, start + 1)
+    return (start, end)
+
+def sequenceTraces(region, xAxisMin, xAxisMax):
+    """ Creates the traces for both types of sequence display for a part of a gene region.
+    Sequences are only shown for parts up to the length plotted at full resolution. Returns
+    a dict with the traces per display type, empty if there is no sequence to show.
+
+    Positional arguments:
+    region -- GeneRegion of the displayed gene.
+    xAxisMin -- Start of the shown part.
+    xAxisMax -- End of the shown part.
+    """
+    traces = {}
+    if xAxisMax - xAxisMin > cfg.fullResolution:
+        return traces
+    combinedSeq = region.sequence[xAxisMin - region.xAxisMin:]
+    try:  # Create traces for sequence display, either scatter or heatmap
+        traces.update({'heatSeq' : createSequenceTrace('heatSeq', region.strand, combinedSeq, xAxisMin, xAxisMax)})
+        traces.update({'letterSeq' : createSequenceTrace('letterSeq', region.strand, combinedSeq, xAxisMin, xAxisMax)})
+    except IndexError:
+        pass
+    except TypeError:
+        pass
+    return traces
+
 def createGeneModelPlot(isoforms, xAxisMin, xAxisMax, blockHeight, strand):
     """Generates gene model based on the given blocks and coding region.
 
@@ -717,9 +854,19 @@ def createGeneModelPlot(isoforms, xAxisMin, xAxisMax, blockHeight, strand):
     strand -- Strand that the selected gene is on, for coloring.
     """
     traces = []
-    # This loop will check and if necessary cut blockstarts and sizes
-    # depending on the form of overlap
-    for i in isoforms.itertuples():
+    # Clip the exons of all isoforms to the region and split them into coding and
+    # noncoding pieces at once
+    exonFirst = isoforms['exonFirst'].values.astype(numpy.int64)
+    exonCounts = isoforms['exonLast'].values.astype(numpy.int64) - exonFirst
+    isoformOfBlock = numpy.repeat(numpy.arange(len(isoforms)), exonCounts)
+    exons = numpy.arange(exonCounts.sum()) - numpy.repeat(numpy.cumsum(exonCounts) - exonCounts - exonFirst, exonCounts)
+    blockStarts, blockSizes = clipBlocks(isoforms['chromStart'].values[isoformOfBlock], isoforms['chromEnd'].values[isoformOfBlock],
+                                         cfg.exonTable.starts[exons], cfg.exonTable.ends[exons], xAxisMin, xAxisMax)
+    pieces = splitBlocks(isoforms['thickStart'].values[isoformOfBlock], isoforms['thickEnd'].values[isoformOfBlock],
+                         blockStarts, blockStarts + blockSizes, blockHeight)
+    # Pieces are ordered by isoform, find the range of pieces for each isoform
+    pieceBorders = numpy.searchsorted(isoformOfBlock[pieces[3]], numpy.arange(len(isoforms) + 1))
+    for index, i in enumerate(isoforms.itertuples()):
         # Set color depending on the strand the isoform is located on
         if i.strand != strand: # Isoform is on reverse strand, color grey
             color = 'rgb(128,128,128)'
@@ -727,20 +874,13 @@ def createGeneModelPlot(isoforms, xAxisMin, xAxisMax, blockHeight, strand):
         else: # Isoform is on same strand as selected gene, color black
             color = 'rgb(0,0,0)'
             sign = 1
-        # Calculate proper blockStarts and blockSizes
-        blockConstraints = setUpBlockConstraints(i.chromStart, i.chromEnd, i.blockStarts, i.blockSizes, xAxisMin, xAxisMax)
-        blockStarts = blockConstraints[0]
-        blockSizes= blockConstraints[1]
-        loc = blockConstraints[2] 
+        loc = overlapForm(i.chromStart, i.chromEnd, xAxisMin, xAxisMax)
         # Lists for the values needed to draw traces
-        blockVals = []
-        blockWidths = []
-        blockYs = []
+        first, last = pieceBorders[index], pieceBorders[index + 1]
+        blockVals = pieces[0][first:last].tolist()
+        blockWidths = pieces[1][first:last].tolist()
+        blockYs = pieces[2][first:last].tolist()
         name = i.transID
-        # Calculate blocks from block start and end positions, as well as thickness
-        for j in range(len(blockStarts)):
-            blockStart = blockStarts[j]
-            calculateBlocks(i.thickStart, i.thickEnd, blockStart, blockStart + blockSizes[j] , blockVals, blockWidths, blockYs, blockHeight, strand)
         # Find first and last block to draw line properly
         f = lambda i: blockVals[i]
         lineCoords = []
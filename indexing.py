@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Lookup structures that are built once while loading the data and
+queried by the dashboard callbacks."""
+import json
+import os
+import numpy
+import pandas
+
+if __name__ == '__main__':
+    print('Please start the program via validator.py')
+    exit()
+
+def buildGeneIndex(df):
+    """ Maps every gene identifier of an annotation dataframe to the row positions
+    of its isoforms.
+
+    Positional arguments:
+    df -- Annotation dataframe with a geneID column.
+    """
+    return df.groupby('geneID', sort = False).indices
+
+def buildDescriptionIndex(geneIds):
+    """ Maps every gene identifier of the gene_ids column of the advanced descriptions
+    to the row positions mentioning it. Fields can hold multiple identifiers, separated
+    by semicolons, commas or whitespace. Only whole identifiers are mapped.
+
+    Positional arguments:
+    geneIds -- Series with the gene_ids column.
+    """
+    index = {}
+    for position, ids in enumerate(geneIds.fillna('').astype(str).str.split(r'[;,\s]+')):
+        for i in ids:
+            if i != '':
+                index.setdefault(i, []).append(position)
+    return index
+
+def lookupGene(annotations, geneIndices, geneName):
+    """ Returns all isoforms of a gene as dataframe. Only exact matches of the gene
+    identifier are taken into account. If multiple annotation files contain the gene,
+    the first one is used. Returns an empty dataframe if the gene is unknown.
+
+    Positional arguments:
+    annotations -- List of annotation dataframes.
+    geneIndices -- List of gene indices, one per annotation dataframe.
+    geneName -- Identifier of the gene.
+    """
+    for df, index in zip(annotations, geneIndices):
+        positions = index.get(geneName)
+        if positions is not None:
+            # Select per column, iloc would consolidate and thereby copy memory mapped columns
+            return pandas.DataFrame({c : df[c].values[positions] for c in df.columns},
+                                    columns = df.columns, index = df.index[positions])
+    return pandas.DataFrame()
+
+def overlapRange(starts, maxEnds, start, end):
+    """ Binary search for the candidates of an overlap query on intervals sorted by start.
+    Every interval overlapping [start, end] lies within the returned range, intervals
+    in the range still have to be checked for their end point.
+
+    Positional arguments:
+    starts -- Sorted start points.
+    maxEnds -- Running maximum of the end points in the same order.
+    start -- Left border of the region.
+    end -- Right border of the region.
+    """
+    right = numpy.searchsorted(starts, int(end), side = 'right') # Intervals from here on start right of the region
+    left = numpy.searchsorted(maxEnds[:right], int(start), side = 'left') # Intervals before this one end left of the region
+    return (left, right)
+
+class IntervalIndex:
+    """ Index over the intervals of a dataframe, partitioned by chromosome. Within each
+    chromosome intervals are sorted by start point. A running maximum over the end points
+    allows finding the leftmost candidate of an overlap query by binary search, so
+    queries only touch the rows close to the requested region.
+    """
+    def __init__(self, chroms, starts, ends):
+        """ Positional arguments:
+        chroms -- Chromosome of each interval.
+        starts -- Start point of each interval.
+        ends -- End point of each interval.
+        """
+        starts = numpy.asarray(starts, dtype = numpy.int64)
+        ends = numpy.asarray(ends, dtype = numpy.int64)
+        chroms = numpy.asarray(chroms)
+        self.chroms = {}
+        for chrom, positions in pandas.Series(chroms).groupby(chroms, sort = False).indices.items():
+            positions = positions[numpy.argsort(starts[positions], kind = 'mergesort')]
+            chromEnds = ends[positions]
+            self.chroms[chrom] = (positions, starts[positions], chromEnds, numpy.maximum.accumulate(chromEnds))
+
+    def query(self, chrom, start, end):
+        """ Returns the row positions of all intervals on chrom that overlap [start, end],
+        borders included, in ascending order.
+
+        Positional arguments:
+        chrom -- Chromosome to search on.
+        start -- Left border of the region.
+        end -- Right border of the region.
+        """
+        try:
+            positions, starts, ends, maxEnds = self.chroms[chrom]
+        except KeyError:
+            return numpy.empty(0, dtype = numpy.int64)
+        left, right = overlapRange(starts, maxEnds, start, end)
+        hits = left + numpy.flatnonzero(ends[left:right] >= int(start))
+        return numpy.sort(positions[hits])
+
+def overlappingIsoforms(annotations, intervalIndices, chrom, start, end):
+    """ Returns all isoforms from all annotation dataframes that overlap the given region.
+
+    Positional arguments:
+    annotations -- List of annotation dataframes.
+    intervalIndices -- List of interval indices, one per annotation dataframe.
+    chrom -- Chromosome of the region.
+    start -- Left border of the region.
+    end -- Right border of the region.
+    """
+    overlaps = [df.iloc[index.query(chrom, start, end)] for df, index in zip(annotations, intervalIndices)]
+    return pandas.concat(overlaps)
+
+def splitIntegers(values):
+    """ Parses a column of comma separated integer lists, like the blockStarts column of
+    bed12 files, in a single pass. Trailing commas are allowed. Returns all numbers as one
+    array together with the number of values per row, raises a ValueError if a field
+    is not an integer.
+
+    Positional arguments:
+    values -- Series of comma separated strings.
+    """
+    text = pandas.Series(values).astype(str).str.rstrip(',')
+    counts = text.str.count(',').values + 1
+    counts[(text == '').values] = 0
+    if counts.sum() == 0:
+        return numpy.empty(0, dtype = numpy.int64), counts
+    numbers = numpy.array(','.join(text[counts > 0]).split(','), dtype = numpy.int64)
+    return numbers, counts
+
+class ExonTable:
+    """ Exon coordinates of all isoforms of the annotation dataframes, parsed once from
+    the blockStarts and blockSizes columns. Exons are stored in flat arrays holding the
+    transcript, absolute start and end of every exon. The exons of an isoform are a
+    contiguous range of these arrays, so they can be accessed as slices.
+    """
+    def __init__(self, annotations):
+        """ Positional arguments:
+        annotations -- List of annotation dataframes in bed12 layout.
+        """
+        transcripts = []
+        starts = []
+        ends = []
+        self.ranges = [] # First and last exon of each isoform, one pair of arrays per dataframe
+        exonOffset = 0
+        transcriptOffset = 0
+        for df in annotations:
+            blockStarts, counts = splitIntegers(df['blockStarts'])
+            blockSizes, sizeCounts = splitIntegers(df['blockSizes'])
+            if not numpy.array_equal(counts, sizeCounts):
+                raise ValueError('Numbers of block starts and block sizes differ')
+            rows = numpy.repeat(numpy.arange(len(df)), counts)
+            exonStarts = df['chromStart'].values.astype(numpy.int64)[rows] + blockStarts
+            transcripts.append(rows + transcriptOffset)
+            starts.append(exonStarts)
+            ends.append(exonStarts + blockSizes)
+            last = exonOffset + numpy.cumsum(counts)
+            self.ranges.append((last - counts, last))
+            exonOffset += len(rows)
+            transcriptOffset += len(df)
+        self.transcripts = numpy.concatenate(transcripts) if transcripts else numpy.empty(0, dtype = numpy.int64)
+        self.starts = numpy.concatenate(starts) if starts else numpy.empty(0, dtype = numpy.int64)
+        self.ends = numpy.concatenate(ends) if ends else numpy.empty(0, dtype = numpy.int64)
+
+    def exons(self, first, last):
+        """ Returns absolute start and end points of the exons in [first, last) as slices.
+
+        Positional arguments:
+        first -- Position of the first exon.
+        last -- Position after the last exon.
+        """
+        return self.starts[first:last], self.ends[first:last]
+
+class IntervalStore:
+    """ Stores the columns of a bed like dataframe as numpy arrays, partitioned by
+    chromosome, or by chromosome and strand, and sorted by start point. Region queries
+    are answered by binary search and return slices of the stored arrays.
+    """
+    def __init__(self, df, columns, stranded = False):
+        """ Positional arguments:
+        df -- Dataframe with chrom, chromStart and chromEnd columns.
+        columns -- Names of additional columns to store.
+
+        Keyword arguments:
+        stranded -- Partition by chromosome and strand, requires a strand column.
+        """
+        self.columns = ['chromStart', 'chromEnd'] + list(columns)
+        self.stranded = stranded
+        starts = df['chromStart'].values
+        if stranded:
+            keys = [numpy.asarray(df['chrom']), numpy.asarray(df['strand'])]
+        else:
+            keys = numpy.asarray(df['chrom'])
+        self.chroms = {}
+        for chrom, positions in pandas.Series(starts).groupby(keys, sort = False).indices.items():
+            positions = positions[numpy.argsort(starts[positions], kind = 'mergesort')]
+            arrays = {c : df[c].values[positions] for c in self.columns}
+            arrays['maxEnd'] = numpy.maximum.accumulate(arrays['chromEnd'])
+            self.chroms[chrom] = arrays
+        self.empty = {c : df[c].values[:0] for c in self.columns}
+
+    def query(self, chrom, start, end, strand = None):
+        """ Returns a dict holding an array per column with all intervals on chrom
+        that overlap [start, end], borders included, sorted by start point.
+
+        Positional arguments:
+        chrom -- Chromosome to search on.
+        start -- Left border of the region.
+        end -- Right border of the region.
+
+        Keyword arguments:
+        strand -- Strand to search on, only used by stranded stores.
+        """
+        if self.stranded:
+            chrom = (chrom, strand)
+        try:
+            arrays = self.chroms[chrom]
+        except KeyError:
+            return self.empty
+        left, right = overlapRange(arrays['chromStart'], arrays['maxEnd'], start, end)
+        hits = arrays['chromEnd'][left:right] >= start
+        if hits.all(): # Only slices, no copies
+            return {c : arrays[c][left:right] for c in self.columns}
+        return {c : arrays[c][left:right][hits] for c in self.columns}
+
+    def __len__(self):
+        return sum(len(i['chromStart']) for i in self.chroms.values())
+
+class MappedIntervalStore(IntervalStore):
+    """ Interval store backed by a single binary file. The file starts with a magic string,
+    the size of a json header and the header itself, followed by one contiguous column per
+    stored field. The header holds the layout of the columns, an optional fingerprint of
+    the input file and, for every chromosome, the range of rows belonging to it. Columns are opened with numpy.memmap, queries return
+    slices of the mapped columns without reading or copying the file.
+    """
+    magic = b'SEQCOV01'
+
+    def __init__(self, path):
+        """ Positional arguments:
+        path -- Path of a file created by MappedIntervalStore.write.
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(self.magic)) != self.magic:
+                raise ValueError('File ' + str(path) + ' is not a coverage container')
+            headerSize = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(headerSize).decode('utf-8'))
+        dataStart = MappedIntervalStore.alignOffset(len(self.magic) + 8 + headerSize)
+        self.columns = header['columns']
+        self.fingerprint = header.get('fingerprint')
+        self.stranded = False
+        arrays = {}
+        for name, dtype, offset in header['layout']:
+            if header['rows'] > 0:
+                arrays[name] = numpy.memmap(path, dtype = dtype, mode = 'r', offset = dataStart + offset, shape = (header['rows'],))
+            else: # Empty files can not be mapped
+                arrays[name] = numpy.empty(0, dtype = dtype)
+        self.chroms = {}
+        for chrom, (first, last) in header['chroms'].items():
+            self.chroms[chrom] = {c : arrays[c][first:last] for c in arrays}
+        self.empty = {c : arrays[c][:0] for c in self.columns}
+
+    @staticmethod
+    def alignOffset(offset):
+        """ Rounds an offset up to the next multiple of 8 bytes. """
+        return (offset + 7) // 8 * 8
+
+    @staticmethod
+    def write(path, df, columns, fingerprint = None):
+        """ Writes the columns of a bed like dataframe into a single binary file, rows are
+        sorted by chromosome and start point. The file is written to a temporary location
+        first and moved into place once it is complete.
+
+        Positional arguments:
+        path -- Destination of the file.
+        df -- Dataframe with chrom, chromStart and chromEnd columns.
+        columns -- Names of additional columns to store.
+
+        Keyword arguments:
+        fingerprint -- Fingerprint of the input file, stored in the header.
+        """
+        columns = ['chromStart', 'chromEnd'] + list(columns)
+        df = df.sort_values(by = ['chrom', 'chromStart'], kind = 'mergesort')
+        chroms = numpy.asarray(df['chrom'])
+        data = {c : numpy.ascontiguousarray(df[c].values) for c in columns}
+        # Running maximum of the end points, restarted for every chromosome
+        data['maxEnd'] = df.groupby(chroms, sort = False)['chromEnd'].cummax().values.astype(data['chromEnd'].dtype)
+        chromRanges = {}
+        for chrom, positions in pandas.Series(chroms).groupby(chroms, sort = False).indices.items():
+            chromRanges[str(chrom)] = [int(positions.min()), int(positions.max()) + 1]
+        layout = []
+        offset = 0
+        for name, values in data.items():
+            layout.append([name, values.dtype.str, offset])
+            offset = MappedIntervalStore.alignOffset(offset + values.nbytes)
+        header = json.dumps({'columns' : columns, 'rows' : len(df), 'layout' : layout, 'chroms' : chromRanges,
+                             'fingerprint' : fingerprint}).encode('utf-8')
+        dataStart = MappedIntervalStore.alignOffset(len(MappedIntervalStore.magic) + 8 + len(header))
+        tmpPath = str(path) + '.tmp'
+        with open(tmpPath, 'wb') as out:
+            out.write(MappedIntervalStore.magic)
+            out.write(len(header).to_bytes(8, 'little'))
+            out.write(header)
+            for (name, dtype, offset), values in zip(layout, data.values()):
+                out.seek(dataStart + offset)
+                out.write(values.tobytes())
+        os.replace(tmpPath, str(path))
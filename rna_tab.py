@@ -2,15 +2,15 @@
 # -*- coding: utf-8 -*-
 
 import dash
-import pandas
+import heapq
+import numpy
 from app import app
 import cfg
 import time 
-import pickle
 import dash_html_components as html
 from plotly import tools
 import plotly.graph_objs as go
-from iclip_tab import createGeneModelPlot
+from iclip_tab import geneRegion, storeFigureData, loadFigureData, viewWindow, sequenceTraces
 import plotly.utils as pu
 
 @app.callback(
@@ -18,150 +18,82 @@ import plotly.utils as pu
     [dash.dependencies.Input('geneDrop', 'value')],
 )
 def rnaDesc(name):
-    if cfg.descAvail:
-        try:
-            return [
-                html.P(
-                    cfg.geneDescriptions.loc[
-                        cfg.geneDescriptions['ensembl_gene_id'] == name,
-                        ['description']
-                    ].iloc[0]
-                )
-            ]
-        except IndexError:
-            return ['No description available']
-        except KeyError:
-            return ['No description available']
-    else:
+    if not cfg.descAvail:
+        return ['No description available']
+    description = geneRegion(name).description
+    if description is None:
         return ['No description available']
+    return [html.P(description)]
 
 @app.callback(
-    dash.dependencies.Output('spliceGraph', 'figure'),
+    dash.dependencies.Output('spliceFigMem', 'data'),
     [dash.dependencies.Input('spliceMem', 'data'),
-     dash.dependencies.Input('rnaParamList', 'values'),
      dash.dependencies.Input('rnaRadio', 'value'),
-     dash.dependencies.Input('covColorFinal', 'data'),
-     dash.dependencies.Input('eventColorFinal', 'data'),
      dash.dependencies.Input('legendSpacingDiv', 'data'),
-     dash.dependencies.Input('coverageScale', 'value'),
-     dash.dependencies.Input('sequenceRadio', 'value'),
-     dash.dependencies.Input('eventScale', 'value'),
-     dash.dependencies.Input('bsGraphMem', 'data')]
+     dash.dependencies.Input('sequenceRadio', 'value')]
 )
-def showRNA(figData, dataSets, displayType, covColor, eventColor, legendSpacing, coverageScale, seqDisp, eventScale, bsMem):
-    """Update callback that selects traces to be displayed based on settings.
+def showRNA(figToken, displayType, legendSpacing, seqDisp):
+    """Update callback that lays out the traces of all computed datasets for the selected type
+    of splice event display. Selection of the displayed datasets, colors and scaling of the rows
+    are applied in the browser by the showRNA clientside callback, which uses the row
+    descriptions returned with the figure.
 
     Positional arguments:
-    figData -- Trace data from the data callback.
-    datasets -- List of datasets to display.
+    figToken -- Token for the trace data from the data callback.
     displayType -- Type of splice event display.
-    covColor -- Colors for coverage traces.
-    eventColorl -- Colots for splice events.
     legendSpacing -- Specifies margin between colorbar and other legend items.
-    coverageScale -- Scaling factor for coverage plots.
-    eventScale -- Scaling factor for event plots.
+    seqDisp -- Style for the reference sequence.
     """
     legendColumnSpacing = legendSpacing
-    figData = figData
+    figData = loadFigureData(figToken)
+    if figData is None: # Nothing computed yet or evicted from the cache
+        raise dash.exceptions.PreventUpdate()
     traces = figData['rnaTraces']
     geneModels = figData['geneModels']
-    coverageColors = covColor
     try:
-        seqTrace = bsMem[seqDisp]
+        seqTrace = figData[seqDisp]
         if seqDisp == 'heatSeq':
             for i in seqTrace:
                 i['showscale'] = False
     except:
         seqTrace = []
-    #print(seqTrace)
-    eventColors = eventColor
-    eventIndices = [] # Save indices of all elements that contain event traces
-    rnaDataSets = sorted(list(cfg.coverageData.keys()))
-    displayed_rnaDataSet = []
     maxYDict = figData['maxYList']
-    axisTitles = []
-    yVals = []
-    for rm in sorted(dataSets):
-        for set in rnaDataSets:
-            if rm == set.split('_')[0]:
-                displayed_rnaDataSet.append(set)
+    eventMaxHeights = figData['maxHeights']
+    # Rows from top to bottom with their dataset, type, relative height and the scale for the height
+    rows = [{'dataSet' : None, 'type' : 'sequence', 'weight' : 0.5, 'scale' : None}]
     finTraces = []
-    eventIndices = []
-    for index, t in enumerate(traces):
-        try:
-            if len(t[displayType]) > 1:
-                try:
-                    if t[displayType][0]['meta'] in displayed_rnaDataSet:
-                        if displayType == 'two':
-                            for i in t[displayType]:
-                                newColor = eventColors[i['name']]
-                                i['marker'] = {'color' : newColor}
-                        finTraces.append(t[displayType])      
-                        eventIndices.append(index//2)
-                        axisTitles.append('')
-                except KeyError:
-                    if t[displayType]['meta'] in displayed_rnaDataSet:
-                        if displayType == 'two':
-                            newColor = eventColors[t['name']]
-                            t['marker'] = {'color' : newColor}
-                        finTraces.append(t[displayType])      
-                        eventIndices.append(index//2)
-                        axisTitles.append('')
-            else:
-                if t[displayType][0] in displayed_rnaDataSet:
-                    finTraces.append([])
-                    axisTitles.append('')
-                    eventIndices.append(index//2)
-
-        except KeyError:
-            if t['meta'] in displayed_rnaDataSet:
-                newColor = coverageColors[t['meta'].split('_')[0]]
-                yVals.append(maxYDict[t['meta']])
-                axisTitles.append('')
-                t['fillcolor'] = newColor
-                finTraces.append(t)              
-    numIsoforms = len(geneModels) # Number of isoforms in the gene model
-    numRows = len(finTraces)+numIsoforms+1#+1 for sequence trace
+    eventIndex = 0 # Position of the current dataset in eventMaxHeights
+    for t in traces:
+        if displayType in t: # Splice events of a dataset
+            events = t[displayType]
+            if isinstance(events, dict): # Single trace for the score heatmap
+                ds = events['meta']
+            elif isinstance(events[0], dict):
+                ds = events[0]['meta']
+            else: # No events in the region, only holds the name of the dataset
+                ds = events[0]
+                events = []
+            rows.append({'dataSet' : ds, 'type' : 'events', 'weight' : eventRowHeight(eventMaxHeights[eventIndex]),
+                         'scale' : 'eventScale'})
+            eventIndex += 1
+            finTraces.append(events)
+        else: # Coverage of a dataset
+            rows.append({'dataSet' : t['meta'], 'type' : 'coverage', 'weight' : 3, 'scale' : 'coverageScale',
+                         'maxY' : maxYDict[t['meta']]})
+            finTraces.append(t)
+    for model in geneModels:
+        rows.append({'dataSet' : None, 'type' : 'model', 'weight' : 0.5, 'scale' : None})
+    numRows = len(rows)
     
     # Setup row heights based on available data
     
     plotSpace = 0.9  # Space taken up by data tracks
     spacingSpace = 1.0 - plotSpace  # Space left for spacer tracks
-    rowHeight = plotSpace / numRows
     if numRows > 1:
         vSpace = spacingSpace / (numRows - 1)
     else:
         vSpace = spacingSpace
-    rowHeights = []
-    rowHeights.append(rowHeight/2)
-    eventHeights = []
-    eventMaxHeights = figData['maxHeights']
-    for index, i in enumerate(eventMaxHeights):
-        if index in eventIndices:
-            if i == 0:
-                eventHeights.append(0)           
-            if i > 0 and i <= 5:
-                eventHeights.append(1)
-            if i >= 6 and i < 10:
-                eventHeights.append(2)
-            if i >= 10:
-                eventHeights.append(i % 5 +1)
-    if cfg.spliceEventAvail:
-        for i in range(1,numRows):
-            if i > len(finTraces): 
-                rowHeights.append(0.5 * rowHeight) # Gene model row
-            elif (i % 2 == 0):
-                try:
-                    rowHeights.append(eventHeights[(i//2)-1] * rowHeight * eventScale) # Splice event row
-                except IndexError:
-                    rowHeights.append(0)
-            else:
-                rowHeights.append(3 * rowHeight * coverageScale) # Coverage row
-    else:
-        for i in range(1,numRows):
-            if i > len(finTraces): rowHeights.append(0.5 * rowHeight) # Gene model row
-            else:
-                rowHeights.append(3 * rowHeight * coverageScale) # Coverage row
+    rowHeights = [i['weight'] for i in rows]
     fig = tools.make_subplots(print_grid=False, rows=numRows, cols=1,
                               shared_xaxes=True, row_width=rowHeights[::-1], vertical_spacing = vSpace)
         # Layouting of the figure
@@ -192,187 +124,213 @@ def showRNA(figData, dataSets, displayType, covColor, eventColor, legendSpacing,
     fig['layout'].update(barmode='relative')
 
     # Reverse x-axis if gene is on - strand to always show models in 3'->5'
-    if figData['strand'] == '-':
+    if figData['window'] is not None: # Zoomed in, show the computed part of the region
+        fig['layout']['xaxis'].update(range=figData['window'][::1 if figData['strand'] == '+' else -1])
+    elif figData['strand'] == '-':
         fig['layout']['xaxis'].update(autorange='reversed')
     for i in range(1, numRows+1):  # prevent zoom on y axis
         fig['layout']['yaxis' + str(i)].update(fixedrange=True)
-    try:
-        maxYVal = max(yVals)
-    except ValueError:
-        maxYVal = 0
+    maxYVal = max([i['maxY'] for i in rows if i['type'] == 'coverage'] + [0])
     blockHeight = 0.4
-    for i in range(1, numRows):   
-            if cfg.spliceEventAvail:
-                if i % 2 != 0 and i <= len(finTraces): # Coverage row
-                    fig['layout']['yaxis' + str(i+1)].update(range=[0, maxYVal],title={'text': axisTitles[i-1]})
-                    fig['layout']['yaxis' + str(i+1)].update(showticklabels=True, showgrid=True, zeroline=True)
-                else: # Event or gene model row
-                    if i > len(finTraces): # Gene model row
-                        fig['layout']['yaxis' + str(i+1)].update(showticklabels=False, showgrid=False, zeroline=False)
-                        fig['layout']['yaxis' + str(i+1)].update(range=[-blockHeight, blockHeight])
-                    else: # Event row
-                        fig['layout']['yaxis' + str(i+1)].update(showticklabels=False, showgrid=False, zeroline=False, title={'text': axisTitles[i-1]})
-            else:
-                if i <= len(finTraces): # Coverage row
-                    fig['layout']['yaxis' + str(i+1)].update(range=[0, maxYVal], title={'text': axisTitles[i-1]})
-                    fig['layout']['yaxis' + str(i+1)].update(showticklabels=True, showgrid=True, zeroline=True)
-                else: # Gene model row
-                    fig['layout']['yaxis' + str(i+1)].update(showticklabels=False, showgrid=False, zeroline=False)
-                    fig['layout']['yaxis' + str(i+1)].update(range=[-blockHeight, blockHeight], )
+    for index, row in enumerate(rows[1:]):
+        axis = fig['layout']['yaxis' + str(index + 2)]
+        if row['type'] == 'coverage':
+            axis.update(range=[0, maxYVal], title={'text': ''})
+            axis.update(showticklabels=True, showgrid=True, zeroline=True)
+        elif row['type'] == 'events':
+            axis.update(showticklabels=False, showgrid=False, zeroline=False, title={'text': ''})
+        else: # Gene model row
+            axis.update(showticklabels=False, showgrid=False, zeroline=False)
+            axis.update(range=[-blockHeight, blockHeight])
     # Setup plot height, add 85 to account for margins
     fig['layout'].update(margin=go.layout.Margin(l=60, r=40, t=25, b=60),)
     fig['layout']['yaxis'].update(visible = False, showticklabels=False, showgrid=False, zeroline=False)
-    rowScales = [x/rowHeight for x in rowHeights]
-    size = 0 
-    for i in rowScales:
-        size += 50*i
-    fig['layout']['height'] = (size + 85)
+    fig['layout']['height'] = 50 * sum(rowHeights) + 85
     # set spacing for the second legend column
     fig['layout']['legend'].update(x = legendColumnSpacing)
-    #print('Showcallback: ' + str(end-start))
-    return fig
+    return {'figure' : fig, 'rows' : rows}
+
+# Display only settings are applied in the browser, see assets/clientside.js
+app.clientside_callback(
+    dash.dependencies.ClientsideFunction('seqing', 'showRNA'),
+    dash.dependencies.Output('spliceGraph', 'figure'),
+    [dash.dependencies.Input('spliceFigMem', 'data'),
+     dash.dependencies.Input('rnaParamList', 'values'),
+     dash.dependencies.Input('covColorFinal', 'data'),
+     dash.dependencies.Input('eventColorFinal', 'data'),
+     dash.dependencies.Input('coverageScale', 'value'),
+     dash.dependencies.Input('eventScale', 'value')]
+)
+
+def eventRowHeight(maxHeight):
+    """Returns the relative height of the splice event row of a dataset.
+
+    Positional arguments:
+    maxHeight -- Number of stacked event rows.
+    """
+    if maxHeight == 0:
+        return 0
+    if maxHeight <= 5:
+        return 1
+    if maxHeight < 10:
+        return 2
+    return maxHeight % 5 + 1
 
 @app.callback(
     dash.dependencies.Output('spliceMem', 'data'),
-    [dash.dependencies.Input('geneDrop', 'value')],
+    [dash.dependencies.Input('geneDrop', 'value'),
+     dash.dependencies.Input('rnaParamList', 'values'),
+     dash.dependencies.Input('spliceGraph', 'relayoutData')],
     [dash.dependencies.State('rnaRadio', 'value'),
-     dash.dependencies.State('rnaParamList', 'values'),
      dash.dependencies.State('covColorFinal', 'data'),
      dash.dependencies.State('eventColorFinal', 'data'),
      dash.dependencies.State('legendSpacingDiv', 'data'),
      dash.dependencies.State('coverageScale', 'value'),
-     dash.dependencies.State('eventScale', 'value')]
+     dash.dependencies.State('eventScale', 'value'),
+     dash.dependencies.State('spliceMem', 'data')]
 )
-def rnaCallback(geneName, displayMode,rnaParamList, colorsFinal, eventColorsFinal, legendSpacing,
-                coverageScale, eventScale):
-    """Data callback that selects relevant data and creates all possible traces.
+def rnaCallback(geneName, rnaParamList, relayoutData, displayMode, colorsFinal, eventColorsFinal, legendSpacing,
+                coverageScale, eventScale, oldToken):
+    """Data callback that selects relevant data and creates the traces of the selected datasets.
+        If only the dataset selection changed, traces of datasets that were already computed
+        for the current gene are kept and only newly selected datasets are computed. After
+        zooming or panning the traces are created for the shown part of the gene region only.
+        The trace data is kept in the figure cache, the store only receives its token.
 
         Positional arguments:
         geneName -- Name of the selected gene in order to filter the data.
-        displaymode --determines how splice events will be visualized.
         rnaParamList -- Selected RNA data sets to plot.
+        relayoutData -- Last zoom or pan of the graph.
+        displaymode --determines how splice events will be visualized.
         colorsFinal -- Last confirmed color.
         eventColorsFinal -- Last confirmed colors for splice events.
         legendSpacing -- Specifies margin between colorbar and other legend items.
         coverageScale -- Scaling factor for coverage plots.
         eventScale -- Scaling factor for event plots.
+        oldToken -- Token for the data of the last call of this callback.
         """
     colors = colorsFinal
+    # Filter out needed datasets
+    rnaDataSets = sorted(list(cfg.coverageData.keys()))
+    displayed_rnaDataSet = []
+    for rm in sorted(rnaParamList or []):
+        for set in rnaDataSets:
+            if rm == set.split('_')[0]:
+                displayed_rnaDataSet.append(set)
+    triggers = [t['prop_id'] for t in dash.callback_context.triggered]
+    oldFigData = loadFigureData(oldToken)
+    sameGene = oldFigData is not None and oldFigData.get('gene') == geneName
+    region = geneRegion(geneName)
+    if region.isoforms.empty: # Unknown gene or no gene selected
+        raise dash.exceptions.PreventUpdate()
+    if triggers == ['rnaParamList.values'] and sameGene:
+        # Only the dataset selection changed, add the datasets that are missing
+        missing = [ds for ds in displayed_rnaDataSet if ds not in oldFigData['dataSets']]
+        if len(missing) == 0:
+            raise dash.exceptions.PreventUpdate()
+        xAxisMin, xAxisMax = oldFigData['window'] or (region.xAxisMin, region.xAxisMax)
+        newData = createRNAData(missing, xAxisMin, xAxisMax,
+                                region.chrom, colors, displayMode, eventColorsFinal)
+        return storeFigureData(mergeRNAData(oldFigData, newData))
+    window = None # Part of the gene region that is shown, None for the whole region
+    if triggers == ['spliceGraph.relayoutData']:
+        if not sameGene:
+            raise dash.exceptions.PreventUpdate()
+        try:
+            window = viewWindow(relayoutData, region)
+        except ValueError:
+            raise dash.exceptions.PreventUpdate()
+        if window == (tuple(oldFigData['window']) if oldFigData['window'] else None):
+            raise dash.exceptions.PreventUpdate()
+    xAxisMin, xAxisMax = window or (region.xAxisMin, region.xAxisMax) # Borders of the plot region
     figData = {}
-    
-    # Select appropriate data from gene annotations
-    currentGene = pandas.DataFrame()
-    for index, elem in enumerate(cfg.geneAnnotations):
-        currentGene = elem[elem['geneID'].str.contains(geneName)]
-        if not currentGene.empty:
-            break
-
-    # Get axis minimum and maximum over all isoforms. Also get current chromosome
-    xAxisMax = currentGene['chromEnd'].max()
-    xAxisMin = currentGene['chromStart'].min()
-    chrom = currentGene['chrom'].iloc[0]
-    strand = currentGene['strand'].iloc[0]
-    figData.update({'strand': strand})
+    figData.update({'gene' : geneName})
+    figData.update({'strand': region.strand})
+    figData.update({'window' : window})
+    # Traces for sequence display, either scatter or heatmap
+    figData.update(sequenceTraces(region, xAxisMin, xAxisMax))
     color_dict = colors  # Color per mutant
     figData.update({'covColors' : color_dict})
-    # Filter out needed datasets
-    rnaDataSets = sorted(list(cfg.coverageData.keys()))
-    displayed_rnaDataSet = rnaDataSets
-   # for rm in sorted(rnaParamList):
-    #    for set in rnaDataSets:
-     #       if rm == set.split('_')[0]:
-      #          displayed_rnaDataSet.append(set)
+    figData.update(createRNAData(displayed_rnaDataSet, xAxisMin, xAxisMax, region.chrom,
+                                 color_dict, displayMode, eventColorsFinal))
+    figData.update({'geneModels' : region.geneModels})
+    return storeFigureData(figData)
+
+def createRNAData(dataSets, xAxisMin, xAxisMax, chrom, colorDict, displayMode, eventColorsFinal):
+    """Selects the coverage and splice event data of the given datasets for a region and
+        creates their traces. Returns a dict with the traces, event heights, axis titles
+        and maximum coverage values, ordered by dataset.
 
+        Positional arguments:
+        dataSets -- Names of the datasets to create traces for.
+        xAxisMin -- Left border of relevant area.
+        xAxisMax -- Right border of relevant area.
+        chrom -- Chromosome to search on.
+        colorDict -- Colors for the coverage plots.
+        displayMode -- Determines how splice events are visualized.
+        eventColorsFinal -- Last confirmed colors for splice events.
+    """
     # Dicts for lists of axis values
     xVals = {}
     yVals = {}
     maxYVal = 0 # Used to scale y-axes later
     maxYVals = {}
-    eventDict = {} # stores dataframes with relevant splice event data
-    iterTime = 0
-    evSel = 0
-    covSel = 0
-    for ds in sorted(displayed_rnaDataSet): # Select relevant coverage files from Index
-        covStart = time.time()
+    eventDict = {} # stores relevant splice event data per dataset
+    for ds in sorted(dataSets): # Select relevant coverage files from Index
         spliceSlice = coverageDataSelection(ds, xAxisMin, xAxisMax, chrom)
-        covEnd = time.time()
-        covSel += covEnd-covStart
-        # Pre-init y-value list
-        yVal = [0] * (len(range(xAxisMin, xAxisMax)))
-        organism = ds.split("_")[0] # Prefix of the curret data frame, first filter
-        spliceEvents = pandas.DataFrame() # will hold splice event data for the current data set
-        evStart = time.time()
-        if any(organism in s for s in cfg.spliceEventNames[1]): # Check if there are splice events for the current prefix
-            for d in sorted(cfg.spliceEventDFs.keys()):
-                if ds in d: # Check for remaining filename, to match the correct files
-                    # Criteria to filter relevant lines from current dataframe
-                    bcrit11 = cfg.spliceEventDFs[d]['chrom'] == chrom
-                    bcrit21 = cfg.spliceEventDFs[d]['chromStart'] >= xAxisMin
-                    bcrit22 = cfg.spliceEventDFs[d]['chromStart'] <= xAxisMax
-                    bcrit31 = cfg.spliceEventDFs[d]['chromEnd'] >= xAxisMin
-                    bcrit32 = cfg.spliceEventDFs[d]['chromEnd'] <= xAxisMax
-                    spliceEvents = cfg.spliceEventDFs[d].loc[bcrit11 & ((bcrit21 & bcrit22) | (bcrit31 & bcrit32))]
-        # Use itertuples to iterate over rows, since itertuples is supposed to be faster
-        evEnd = time.time()
-        evSel += evEnd-evStart
-        iterStart = time.time()
-        for row in spliceSlice.itertuples():
-            # Increment all values covered by the current row, will overshoot when row crosses border of gene, thus try except
-            for j in range(row.chromStart, row.chromEnd):
-                if (j - xAxisMin) >=0: # Ensure we don't fall into negative list indices
-                    try:
-                        yVal[j - xAxisMin] += row.count
-                    except IndexError:
-                            pass
-        iterEnd = time.time()
-        iterTime += iterEnd-iterStart
+        spliceEvents = {} # will hold splice event data for the current data set
+        if ds in cfg.spliceEventDFs: # Check if there are splice events for the current data set
+            spliceEvents = spliceEventSelection(ds, xAxisMin, xAxisMax, chrom)
+        # Coverage as steps, points are only needed where the value changes
+        xVal, yVal = coverageRuns(spliceSlice['chromStart'], spliceSlice['chromEnd'],
+                                  spliceSlice['count'], xAxisMin, xAxisMax)
+        if xAxisMax - xAxisMin > cfg.fullResolution: # Long region, reduce to the envelope per pixel
+            xVal, yVal = envelopeRuns(xVal, yVal, xAxisMin, xAxisMax)
          # Store reference to value list in dict
         yVals[ds] = yVal
         # Safe event dataframe to be used in the next function
         eventDict[ds] = spliceEvents
-        # Create x-axis values
-        xVal = list(range(xAxisMin, xAxisMax))
         xVals[ds] = xVal
         # Find maximum y-axis value for axis scaling
-        maxYVals.update({ds: max(yVal)})
-        if max(yVal) > maxYVal: maxYVal = max(yVal)
-    figData.update({'maxY' : maxYVal})
-    figData.update({'maxYList' : maxYVals})
+        if len(yVal) > 0:
+            maxY = yVal.max().item()
+        else:
+            maxY = 0
+        maxYVals.update({ds: maxY})
+        if maxY > maxYVal: maxYVal = maxY
     # Create RNA-seq traces from data
-    rnaSeqPlotData = createRNAPlots(xVals, yVals, eventDict, displayed_rnaDataSet, 
-                          color_dict, displayMode, eventColorsFinal)
-    traces = rnaSeqPlotData[0]
-    eventMaxHeights = rnaSeqPlotData[1]
-    axisTitles = rnaSeqPlotData[2]
-    figData.update({'rnaTraces' : traces})
-    figData.update({'maxHeights' : eventMaxHeights})
-    figData.update({'axisTitles' : axisTitles})
-    overlappingGenes = []
-    for i in cfg.geneAnnotations: # Select data for gene models from all annotation files
-        bcrit11 = i['chrom'] == chrom
-        bcrit21 = i['chromStart'] >= xAxisMin
-        bcrit22 = i['chromStart'] <= xAxisMax
-        bcrit31 = i['chromEnd'] >= xAxisMin
-        bcrit32 = i['chromEnd'] <= xAxisMax
-        bcrit41 = i['chromStart'] <= xAxisMin
-        bcrit42 = i['chromEnd'] >= xAxisMax
-        preDF = i.loc[bcrit11 & ((bcrit21 & bcrit22) | (bcrit31 & bcrit32) | (bcrit41 & bcrit42))]
-        result = preDF[~preDF['geneID'].str.contains(geneName)]
-        overlappingGenes.append(result)
-        
-    overlaps = pandas.concat(overlappingGenes)
-    isoformList = pandas.concat([currentGene, overlaps]) 
-    blockHeight = 0.4
+    traces, eventMaxHeights, axisTitles = createRNAPlots(xVals, yVals, eventDict, dataSets,
+                                                         colorDict, displayMode, eventColorsFinal)
+    return {'dataSets' : sorted(dataSets), 'maxY' : maxYVal, 'maxYList' : maxYVals,
+            'rnaTraces' : traces, 'maxHeights' : eventMaxHeights, 'axisTitles' : axisTitles}
+
+def mergeRNAData(figData, newData):
+    """Merges the traces of newly computed datasets into the data of the data callback.
+        Both hold the per dataset entries of createRNAData in dataset order, the merged
+        lists keep that order. figData is modified by this function.
 
-    # Calculate gene models. We have to distinguish between coding region and non-coding region
-    geneModels = createGeneModelPlot(isoformList, xAxisMin, xAxisMax, blockHeight, strand)
-    figData.update({'geneModels' : geneModels})
+        Positional arguments:
+        figData -- Data of the data callback.
+        newData -- Data of additional datasets as returned by createRNAData.
+    """
+    tracesPerSet = int(cfg.spliceAvail) + int(cfg.spliceEventAvail)
+    dataSets = sorted(figData['dataSets'] + newData['dataSets'])
+    for key, size in [('rnaTraces', tracesPerSet), ('maxHeights', int(cfg.spliceEventAvail)),
+                      ('axisTitles', tracesPerSet)]:
+        chunks = {}
+        for source in [figData, newData]:
+            for index, ds in enumerate(source['dataSets']):
+                chunks[ds] = source[key][index * size:(index + 1) * size]
+        figData[key] = [entry for ds in dataSets for entry in chunks[ds]]
+    figData['maxYList'].update(newData['maxYList'])
+    figData['maxY'] = max(figData['maxYList'].values())
+    figData['dataSets'] = dataSets
     return figData
 
 def coverageDataSelection(ds, xAxisMin, xAxisMax, chrom):
-    """ This function performs selection and loading of relevant coverage data. 
-        Due to size, coverage data is indexed, and only needed files will be laoded
-        on demand.
+    """ This function performs selection of relevant coverage data. Coverage data
+        is stored in a memory mapped container per dataset, the selection is a slice
+        of the mapped columns, returned as dict of arrays.
         
         Positional arguments:
         ds -- Name of the dataset .
@@ -380,31 +338,141 @@ def coverageDataSelection(ds, xAxisMin, xAxisMax, chrom):
         xAxisMax -- Right border of relevant area.
         chrom -- Chromosome to search on.
     """
-    fileIndex = cfg.coverageData[ds]
-    dfBcrit11 = fileIndex['start'] <= xAxisMin
-    dfBcrit12 = fileIndex['end'] >= xAxisMin
-    dfBcrit21 = fileIndex['start'] <= xAxisMax
-    dfBcrit22 = fileIndex['end'] >= xAxisMax
-    dfBcrit31 = fileIndex['start'] >= xAxisMin
-    dfBcrit32 = fileIndex['end'] <= xAxisMax
-    relevantFiles = fileIndex.loc[(dfBcrit11 & dfBcrit12) | (dfBcrit21 & dfBcrit22) | (dfBcrit31 & dfBcrit32)]
-    finalDF = []
-    for i in relevantFiles.itertuples(): # Build dataframe from parts
-        try:
-            df = pickle.load(open(i.fileName, 'rb'))
-            finalDF.append(df)
-        except FileNotFoundError:
-            print(i.fileName + ' was not found')
-    try: # Final selection of relevant values from the combined df
-        finalDF = pandas.concat(finalDF)
-        bcrit11 = finalDF['chrom'] == chrom
-        bcrit21 = finalDF['chromStart'] >= xAxisMin
-        bcrit22 = finalDF['chromStart'] <= xAxisMax
-        bcrit31 = finalDF['chromEnd'] >= xAxisMin
-        bcrit32 = finalDF['chromEnd'] <= xAxisMax
-        return finalDF.loc[bcrit11 & ((bcrit21 & bcrit22) | (bcrit31 & bcrit32))]
-    except ValueError:
-        return pandas.DataFrame()    
+    return cfg.coverageData[ds].query(chrom, xAxisMin, xAxisMax)
+
+def spliceEventSelection(ds, xAxisMin, xAxisMax, chrom):
+    """ Selects the splice events of a dataset that start or end within the given region.
+    Returns a dict holding an array per column.
+
+    Positional arguments:
+    ds -- Name of the dataset.
+    xAxisMin -- Start of the region.
+    xAxisMax -- End of the region.
+    chrom -- Chromosome of the region.
+    """
+    events = cfg.spliceEventDFs[ds].query(chrom, xAxisMin, xAxisMax)
+    # Events extending over both sides of the region are not shown
+    selection = (((events['chromStart'] >= xAxisMin) & (events['chromStart'] <= xAxisMax))
+                 | ((events['chromEnd'] >= xAxisMin) & (events['chromEnd'] <= xAxisMax)))
+    return {c : events[c][selection] for c in events}
+
+def calculateCoverage(chromStarts, chromEnds, counts, xAxisMin, xAxisMax):
+    """ Accumulates bedGraph rows into per base coverage values for the region
+        [xAxisMin, xAxisMax). Rows are clipped to the region, overlapping rows are summed
+        up and rows outside of the region are ignored. Uses a difference array instead of
+        incrementing every covered base.
+
+        Positional arguments:
+        chromStarts -- Array of row start points.
+        chromEnds -- Array of row end points.
+        counts -- Array of row values.
+        xAxisMin -- Left border of relevant area.
+        xAxisMax -- Right border of relevant area.
+
+        Returns:
+        numpy array with one value per base of the region.
+    """
+    length = max(int(xAxisMax) - int(xAxisMin), 0)
+    counts = numpy.asarray(counts)
+    # Cast to signed integers first, unsigned coordinates would wrap around on subtraction
+    starts = numpy.clip(numpy.asarray(chromStarts, dtype = numpy.int64) - int(xAxisMin), 0, length)
+    ends = numpy.clip(numpy.asarray(chromEnds, dtype = numpy.int64) - int(xAxisMin), 0, length)
+    ends = numpy.maximum(starts, ends)
+    diff = (numpy.bincount(starts, weights = counts, minlength = length + 1)
+            - numpy.bincount(ends, weights = counts, minlength = length + 1))
+    coverage = numpy.cumsum(diff[:length])
+    if numpy.issubdtype(counts.dtype, numpy.integer) or counts.size == 0:
+        coverage = numpy.rint(coverage).astype(numpy.int64)
+    return coverage
+
+def coverageRuns(chromStarts, chromEnds, counts, xAxisMin, xAxisMax):
+    """ Computes the coverage of the region [xAxisMin, xAxisMax) like calculateCoverage, but
+        as runs of constant value instead of one value per base. The coverage can only change
+        at the borders of bedGraph rows, so only these positions are evaluated and neighbouring
+        runs with the same value are merged. An additional point at the last base of the
+        region closes the last run, so the result can be drawn as step line.
+
+        Positional arguments:
+        chromStarts -- Array of row start points.
+        chromEnds -- Array of row end points.
+        counts -- Array of row values.
+        xAxisMin -- Left border of relevant area.
+        xAxisMax -- Right border of relevant area.
+
+        Returns:
+        Tuple of numpy arrays with the first base and the value of each run.
+    """
+    length = max(int(xAxisMax) - int(xAxisMin), 0)
+    counts = numpy.asarray(counts)
+    if length == 0:
+        return numpy.empty(0, dtype = numpy.int64), numpy.empty(0, dtype = numpy.int64)
+    # Cast to signed integers first, unsigned coordinates would wrap around on subtraction
+    starts = numpy.clip(numpy.asarray(chromStarts, dtype = numpy.int64) - int(xAxisMin), 0, length)
+    ends = numpy.clip(numpy.asarray(chromEnds, dtype = numpy.int64) - int(xAxisMin), 0, length)
+    ends = numpy.maximum(starts, ends)
+    borders = numpy.unique(numpy.concatenate([[0], starts, ends]))
+    borders = borders[borders < length]
+    # Rows starting or ending at the end of the region are counted after the last border
+    diff = (numpy.bincount(numpy.searchsorted(borders, starts), weights = counts, minlength = len(borders) + 1)
+            - numpy.bincount(numpy.searchsorted(borders, ends), weights = counts, minlength = len(borders) + 1))
+    values = numpy.cumsum(diff[:len(borders)])
+    if numpy.issubdtype(counts.dtype, numpy.integer) or counts.size == 0:
+        values = numpy.rint(values).astype(numpy.int64)
+    changes = numpy.concatenate([[True], values[1:] != values[:-1]])
+    borders = borders[changes]
+    values = values[changes]
+    if borders[-1] != length - 1:
+        borders = numpy.append(borders, length - 1)
+        values = numpy.append(values, values[-1])
+    return borders + int(xAxisMin), values
+
+def envelopeRuns(xVals, yVals, xAxisMin, xAxisMax, numBuckets = 2000):
+    """ Reduces coverage runs, as returned by coverageRuns, to the minimum and maximum per
+        bucket of equal size. Runs are split at the bucket borders, each bucket keeps the
+        pieces holding its minimum and maximum, the first of them is moved to the start of
+        the bucket. Regions with at most one base per bucket are returned unchanged.
+
+        Positional arguments:
+        xVals -- Array of run start points.
+        yVals -- Array of run values.
+        xAxisMin -- Left border of relevant area.
+        xAxisMax -- Right border of relevant area.
+
+        Keyword arguments:
+        numBuckets -- Number of buckets, about the width of the graph in pixels.
+
+        Returns:
+        Tuple of numpy arrays with the x and y values of the steps.
+    """
+    length = int(xAxisMax) - int(xAxisMin)
+    width = -(-length // numBuckets) # Round up
+    if len(xVals) == 0 or width <= 1:
+        return xVals, yVals
+    offsets = numpy.asarray(xVals, dtype = numpy.int64) - int(xAxisMin)
+    yVals = numpy.asarray(yVals)
+    pieces = numpy.union1d(offsets, numpy.arange(0, length, width))
+    values = yVals[numpy.searchsorted(offsets, pieces, side = 'right') - 1]
+    buckets = pieces // width
+    firsts = numpy.flatnonzero(numpy.concatenate([[True], buckets[1:] != buckets[:-1]]))
+    groups = numpy.repeat(numpy.arange(len(firsts)), numpy.diff(numpy.append(firsts, len(pieces))))
+    positions = []
+    for extremes in [numpy.minimum.reduceat(values, firsts), numpy.maximum.reduceat(values, firsts)]:
+        # First piece of each bucket holding the extreme value
+        matches = numpy.flatnonzero(values == extremes[groups])
+        positions.append(matches[numpy.unique(groups[matches], return_index = True)[1]])
+    keep = numpy.unique(numpy.concatenate(positions))
+    xSteps = pieces[keep]
+    ySteps = values[keep]
+    # Start every bucket with its first extreme value
+    newBucket = numpy.concatenate([[True], buckets[keep][1:] != buckets[keep][:-1]])
+    xSteps[newBucket] = buckets[keep][newBucket] * width
+    changes = numpy.concatenate([[True], ySteps[1:] != ySteps[:-1]])
+    xSteps = xSteps[changes]
+    ySteps = ySteps[changes]
+    if xSteps[-1] != length - 1:
+        xSteps = numpy.append(xSteps, length - 1)
+        ySteps = numpy.append(ySteps, ySteps[-1])
+    return xSteps + int(xAxisMin), ySteps
 
 def overlap(a, b):
     """check if two intervals overlap.
@@ -424,7 +492,7 @@ def createRNAPlots(xVals, yVals, eventData, displayed, colorDict,
     Positional arguments:
     xVals -- x-axis values for coverage plot.
     yVals -- y-axis values for coverage plot.
-    eventData -- Dict containing the dataframes with relevant splice events.
+    eventData -- Dict containing the relevant splice events of each dataset.
     displayed -- Displayed datasets.
     colorDict -- Colors for the coverage plots.
     displayMode -- Determines how splice events are visualized.
@@ -451,10 +519,11 @@ def createRNAPlots(xVals, yVals, eventData, displayed, colorDict,
     return (data, eventMaxHeights, axisTitles)
 
 def createAreaChart(xVals, yVals, ds, colorDict, axisTitles):
-    """ Creates an area chart from provided values. axisTitles is modified by this function.
+    """ Creates an area chart from provided values. The values are drawn as steps, each value
+        holds until the next x-axis value. axisTitles is modified by this function.
     
         Positional arguments:
-        xVals -- X-axis values for the area chart.
+        xVals -- X-axis values for the area chart, as returned by coverageRuns.
         yVals -- Y-axis values for the area chart.
         ds -- Dataset this chart is for, used for color selection and naming.
         colorDict -- Dict holding colors by datasets.
@@ -472,7 +541,7 @@ def createAreaChart(xVals, yVals, ds, colorDict, axisTitles):
         fill='tozeroy',
         fillcolor=orgColor,
         hoveron='points+fills',
-        line=dict(color='black'),
+        line=dict(color='black', shape='hv'),
         text=ds,
         hoverinfo='y',
         cliponaxis=True
@@ -486,25 +555,40 @@ def createEventPlots(eventData, ds, axisTitles, eventMaxHeights, evColors, legen
         and legendSet
     
         Positional arguments:
-        eventData -- The dataframe containing the splice event data.
+        eventData -- Dict containing the splice event data of each dataset.
         ds -- Name of the dataset plots should be created for.
         axistitles -- List that holds axistitles.
         eventMaxHeights -- List that contains the number of stacked event rows for each event trace.
         evColors -- Colors for the different splice event types.
         legendSet -- Keeps track of which legend items to show to avoid duplicates.
     """
-    maxStack = 0 # keeps track of the maximum number of stacked bars, to avoid empty rows
+    events = eventData[ds]
+    if len(events) == 0: # Dataset without splice event file
+        events = {'chromStart' : [], 'chromEnd' : [], 'score' : [], 'type' : []}
+    chromStarts = numpy.asarray(events['chromStart']).astype(numpy.int64)
+    chromEnds = numpy.asarray(events['chromEnd']).astype(numpy.int64)
+    # Stack the events once, the rows are the same for every display mode
+    stackRows, maxStack = stackEvents(chromStarts, chromEnds)
+    # Avoid problems with events that don't follow the convention of chromStart < chromEnd
+    minVals = numpy.minimum(chromStarts, chromEnds)
+    maxVals = numpy.maximum(chromStarts, chromEnds)
+    allXValues = minVals + ((maxVals - 1) - minVals) / 2
+    allWidths = maxVals - minVals
+    allBases = stackRows + 0.5 * stackRows
+    allScores = numpy.asarray(events['score'])
+    types = numpy.asarray(events['type'], dtype = object)
+    eventXValues = {} # Stores x-axis values per event type
+    eventWidths = {} # Stores widths per event type
+    eventBases = {} # Stores y offset per event type
+    eventScores = {}
+    for k in set(types):
+        selection = types == k
+        eventXValues[k] = allXValues[selection].tolist()
+        eventWidths[k] = allWidths[selection].tolist()
+        eventBases[k] = allBases[selection].tolist()
+        eventScores[k] = allScores[selection].tolist()
     traceDict = {}
     for i in ['one', 'two']:
-        intervals = [] # Used to calculate overlaps, stores used intervals as well as row that interval was put on
-        eventXValues = {} # Stores x-axis values per event type
-        eventWidths = {} # Stores widths per event type
-        eventBases = {} # Stores y offset per event type
-        eventScores = {}
-        # Iterate through dataframe rows and calculate stacking aswell as bar parameters
-
-        for row in eventData[ds].itertuples():
-            maxStack = calculateEvents(row.type, row.chromStart, row.chromEnd, row.score, eventXValues, eventWidths, eventBases, eventScores, intervals, maxStack)
         # eventMaxHeights will be used to scale the size of event traces based on the number
         # of stacked event rows  
         traces = []
@@ -556,18 +640,10 @@ def createEventPlots(eventData, ds, axisTitles, eventMaxHeights, evColors, legen
             traceDict.update({i : [ds]})
     else: # Displaymode: Score heatmap
         colorScale = (-1.0,1.0) # Scores range from -1 to 1, setup color scale for consistent coloring
-        intervals = [] # Used to calculate overlaps, stores used intervals as well as row that interval was put on
-        eventXValues = [] # Stores x-axis values per event type
-        eventWidths = [] # Stores widths per event type
-        eventBases = [] # Stores y offset per event type
-        eventScores = [] # score for each event
-        # Iterate through dataframe rows and calculate stacking aswell as bar parameters
-       # maxStack = 0 # keeps track of the maximum number of stacked bars, to avoid empty rows
-        for row in eventData[ds].itertuples():
-            maxStack = calculateEventsScoreColored(row.chromStart, row.chromEnd, row.score, eventXValues, eventWidths, eventBases, eventScores, intervals, maxStack)
-        # eventMaxHeights will be used to scale the size of event traces based on the number
-        # of stacked event rows
-        #eventMaxHeights.append(maxStack)    
+        eventXValues = allXValues.tolist()
+        eventWidths = allWidths.tolist()
+        eventBases = allBases.tolist()
+        eventScores = allScores.tolist() # score for each event
         trace = go.Bar(
             x=eventXValues,
             y=[1]*len(eventXValues),
@@ -605,129 +681,34 @@ def createEventPlots(eventData, ds, axisTitles, eventMaxHeights, evColors, legen
     eventMaxHeights.append(maxStack)
     return traceDict
 
-def calculateEvents(key, chromStart, chromEnd, score, eventXValues, eventWidths, eventBases, eventScores, intervals, maxStack, oneKey=False):
-    """ This function calculates a bar and its vertical position for displayMode one and two. 
-        It directly modifies eventXValues, eventWidths, eventBases, eventScores and intervals 
-        and returns a new value for maxstack. 
-        
-        Positional arguments:
-        key -- The type of splice event this event belongs to.
-        chromstart -- Start of the event.
-        chromEnd -- End of the event.
-        score -- Score of the event.
-        eventXValues -- Holds x-axis center coordinates of all events that have been processed already.
-        eventWidths -- Holds widths of all processed events.
-        eventBases -- Hold the vertical offset of all processed events.
-        eventScores -- Holds the scores of all processed events.
-        intervals -- Stores events as tuple containing start and end positions as well as vertical offset.
-        maxStack -- Keeps track of the currently highest event row for layouting purposes.
-    """
-    # Avoid problems with events that don't follow the convention of chromStart < chromEnd
-    maxVal = max(chromStart, chromEnd)
-    minVal = min(chromStart, chromEnd)
-    if len(intervals) == 0: # Row is the first row, no comparisons
-        try: # If list already exist append
-            eventXValues[key].append(minVal + ((maxVal-1) - minVal) / 2)
-            eventWidths[key].append(maxVal - minVal)
-            eventBases[key].append(0)
-            eventScores[key].append(score)
-            intervals.append(((minVal, maxVal),0))
-        except KeyError: # Else create corresponding lists in dictionary
-            eventXValues[key] = [minVal + ((maxVal-1) - minVal) / 2]
-            eventWidths[key] = [maxVal - minVal]
-            eventBases[key] = [0]
-            eventScores[key] = [score]
-            intervals.append(((minVal, maxVal),0))
-        maxStack = 1
-    else: # Row is not the first row, check through already processed intervals to calculate offset
-        numOverlaps = 0
-        heights = [] # Store all rows on which overlaps occur
-        for i in intervals:
-            if overlap(i[0], (minVal, maxVal)) == True:
-                heights.append(i[1])
-                numOverlaps += 1
-        if len(heights) > 0:
-            slot = 0 # First free row the new bar can be placed on
-            for value in range(0, max(heights)+2): # Find first open slot
-                if value not in heights:
-                    slot = value
-                    break
-            numOverlaps = slot # Set numOverlaps accordingly
-        try: # Try to append values to the list
-            eventXValues[key].append(minVal + ((maxVal-1) - minVal) / 2)
-            eventWidths[key].append(maxVal - minVal)
-            if numOverlaps >= maxStack: # Check if a new row needs to be created to place this event
-                if numOverlaps > maxStack + 1:
-                    maxStack += 1
-                    numOverlaps = maxStack
-                else:
-                    maxStack = numOverlaps + 1
-            eventBases[key].append(numOverlaps + 0.5*numOverlaps)
-            eventScores[key].append(score)
-            intervals.append(((minVal, maxVal),numOverlaps))
-        except KeyError: # Create the list corresponding to key
-            eventXValues[key]  = [minVal + ((maxVal-1) - minVal) / 2]
-            eventWidths[key] = [maxVal - minVal]
-            if numOverlaps >= maxStack: # Check if a new row needs to be created to place this event
-                if numOverlaps > maxStack + 1:
-                    maxStack += 1
-                    numOverlaps = maxStack
-                else:
-                    maxStack = numOverlaps + 1
-            eventBases[key] = [numOverlaps + 0.5*numOverlaps]
-            eventScores[key] = [score]
-            intervals.append(((minVal, maxVal), numOverlaps))
-    return maxStack
-
-def calculateEventsScoreColored(chromStart, chromEnd, score, eventXValues, eventWidths, eventBases, eventScores, intervals, maxStack):
-    """ This function calculates a bar and its vertical position for displayMode three. 
-        It directly modifies eventXValues, eventWidths, eventBases, eventScores and intervals 
-        and returns a new value for maxstack. 
-    
+def stackEvents(chromStarts, chromEnds):
+    """ Assigns every event to the lowest row that is not used by an overlapping event.
+        Events are swept by start point while a heap holds the end points of the events
+        on the currently used rows and a second heap the free rows. Returns the row of
+        each event in input order and the number of rows.
+
         Positional arguments:
-        chromstart -- Start of the event.
-        chromEnd -- End of the event.
-        score -- Score of the event.
-        eventXValues -- Holds x-axis center coordinates of all events that have been processed already.
-        eventWidths -- Holds widths of all processed events.
-        eventBases -- Hold the vertical offset of all processed events.
-        eventScores -- Holds the scores of all processed events.
-        intervals -- Stores events as tuple containing start and end positions as well as vertical offset.
-        maxStack -- Keeps track of the currently highest event row for layouting purposes.
+        chromStarts -- Array of event start points.
+        chromEnds -- Array of event end points.
     """
-    maxVal = max(chromStart, chromEnd) 
-    minVal = min(chromStart, chromEnd)
-    if len(intervals) == 0: # Row is the first row, no comparisons
-        eventXValues.append(minVal + ((maxVal-1) - minVal) / 2)
-        eventWidths.append(maxVal - minVal)
-        eventBases.append(0)
-        eventScores.append(score)
-        intervals.append(((minVal, maxVal),0))
-        maxStack = 1
-    else: # Row is not the first row, check through already processed intervals to calculate offset
-        numOverlaps = 0
-        heights = [] # Store all rows on which overlaps occur
-        for i in intervals:
-            if overlap(i[0], (minVal, maxVal)) == True:
-                heights.append(i[1])
-                numOverlaps += 1
-        if len(heights) > 0:
-            slot = 0 # First free row the new bar can be placed on
-            for value in range(0, max(heights)+2): # Find first open slot
-                if value not in heights:
-                    slot = value
-                    break
-            numOverlaps = slot # Set numOverlaps accordingly
-        eventXValues.append(minVal + ((maxVal-1) - minVal) / 2)
-        eventWidths.append(maxVal - minVal)
-        if numOverlaps >= maxStack:
-            if numOverlaps > maxStack + 1: # Check if a new row needs to be created to place this event
-                maxStack += 1
-                numOverlaps = maxStack
-            else:
-                maxStack = numOverlaps + 1
-        eventBases.append(numOverlaps + 0.5*numOverlaps)
-        eventScores.append(score)
-        intervals.append(((minVal, maxVal),numOverlaps))
-    return maxStack
+    minVals = numpy.minimum(chromStarts, chromEnds)
+    maxVals = numpy.maximum(chromStarts, chromEnds)
+    # Events without size only overlap events that start left of them, handle them
+    # before events with the same start point
+    order = numpy.lexsort((maxVals > minVals, minVals))
+    rows = numpy.zeros(len(minVals), dtype = numpy.int64)
+    active = [] # (end point, row) of events on used rows
+    free = [] # Rows that became free again
+    numRows = 0
+    for index, start, end in zip(order.tolist(), minVals[order].tolist(), maxVals[order].tolist()):
+        while len(active) > 0 and active[0][0] <= start: # Event has ended, its row is free
+            heapq.heappush(free, heapq.heappop(active)[1])
+        if len(free) > 0:
+            row = heapq.heappop(free)
+        else:
+            row = numRows
+            numRows += 1
+        heapq.heappush(active, (end, row))
+        rows[index] = row
+    return rows, numRows
 
@@ -5,6 +5,7 @@ from app import app
 import dash
 import dash_html_components as html
 import cfg
+import indexing
 
 @app.callback(
     dash.dependencies.Output('bsGraph', 'config'),
@@ -601,10 +602,7 @@ def setHeadline(name):
     clicks -- Related to button, not needed otherwise.
     name -- Name of the currently selected gene.
     """
-    for i in cfg.geneAnnotations:
-        currentGene = i[i['geneID'].str.contains(name)]
-        if not currentGene.empty:
-            break
+    currentGene = indexing.lookupGene(cfg.geneAnnotations, cfg.geneIndices, name)
     strand = currentGene['strand'].iloc[0]
     title = name + ' (' + strand + ')'
     return title
@@ -9,12 +9,17 @@ import settings_tab as settings
 import description_tab as details
 import validator as val
 import converter as conv
+import indexing
+import cache
 import json
+import os
+import tempfile
 import dash_html_components as html
 from Bio.Alphabet import generic_dna
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 import collections
+from pathlib import Path
 import pandas
 import numpy as np
 
@@ -22,12 +27,11 @@ class TestConverter(unittest.TestCase):
     def testConvertGTFToBed(self):
         gtfHeader = ['seqname', 'source', 'feature', 'start', 'end', 'score',
                'strand', 'frame', 'attribute']
-        bedHeader = ['chrom','chromStart','chromEnd','name','score','strand','thickStart',
+        bedHeader = ['chrom','chromStart','chromEnd','geneID','transID','score','strand','thickStart',
              'thickEnd','itemRGB','blockCount','blockSizes','blockStarts']
         dtypes = {'seqname' : 'object', 'source' : 'object', 'feature' : 'object', 'start' : 'uint32', 'end': 'uint32', 'score' : 'object',
                               'strand' : 'category', 'frame' : 'object', 'attribute' : 'object'}
-        dtypesBed12 = {'chrom' : 'category', 'chromStart' : 'uint32','chromEnd': 'uint32', 'name' : 'object', 'score' : 'int16', 'strand' : 'category','thickStart' : 'uint64',
-                 'thickEnd' : 'uint64', 'blockCount' : 'uint32','itemRGB' : 'int16','blockSizes' : 'object','blockStarts' : 'object'}
+        dtypesBed12 = conv.dtypes
         testCases = []
         # Case that should work
         bedFile = []
@@ -39,14 +43,91 @@ class TestConverter(unittest.TestCase):
         for key, dtype in dtypes.items():
             df[key] = df[key].astype(dtype)
         outFile = []
-        outFile.append(['Chr1',3630,3913,'AT1G01010.1',0,'+',3759,3913,0,1,'283','0'])
+        outFile.append(['Chr1',3630,3913,'AT1G01010','AT1G01010.1',0,'+',3759,3913,0,1,'283','0'])
         outDF = pandas.DataFrame(data = outFile, columns = bedHeader)
         for key, dtype in dtypesBed12.items():
             outDF[key] = outDF[key].astype(dtype)        
         testCases.append((df,outDF))
+        # Multiple exons in file order, second transcript without CDS
+        bedFile = []
+        bedFile.append(['Chr2', 'Araport11', 'exon', 500, 600, '.', '-', '.', 'gene_id "AT2G1"; transcript_id "AT2G1.1";'])
+        bedFile.append(['Chr2', 'Araport11', 'CDS', 520, 600, '.', '-', '0', 'gene_id "AT2G1"; transcript_id "AT2G1.1";'])
+        bedFile.append(['Chr2', 'Araport11', 'exon', 100, 200, '.', '-', '.', 'gene_id "AT2G1"; transcript_id "AT2G1.1";'])
+        bedFile.append(['Chr2', 'Araport11', 'CDS', 150, 200, '.', '-', '0', 'gene_id "AT2G1"; transcript_id "AT2G1.1";'])
+        bedFile.append(['Chr2', 'Araport11', 'exon', 100, 300, '.', '-', '.', 'gene_id "AT2G1"; transcript_id "AT2G1.2";'])
+        df = pandas.DataFrame(data = bedFile, columns = gtfHeader)
+        for key, dtype in dtypes.items():
+            df[key] = df[key].astype(dtype)
+        outFile = []
+        outFile.append(['Chr2',99,600,'AT2G1','AT2G1.1',0,'-',149,600,0,2,'101,101','400,0'])
+        outFile.append(['Chr2',99,300,'AT2G1','AT2G1.2',0,'-',99,300,0,1,'201','0'])
+        outDF = pandas.DataFrame(data = outFile, columns = bedHeader)
+        for key, dtype in dtypesBed12.items():
+            outDF[key] = outDF[key].astype(dtype)
+        testCases.append((df,outDF))
         for i in testCases:
             self.assertTrue(conv.convertGTFToBed(i[0]).equals(i[1]))
             
+    def testStreamGTFToBed(self):
+        gtfLines = []
+        for gene in range(3):
+            for transcript in range(2):
+                attributes = 'gene_id "G' + str(gene) + '"; transcript_id "G' + str(gene) + '.' + str(transcript) + '";'
+                for exon in range(3):
+                    start = gene * 1000 + exon * 100 + transcript * 10 + 1
+                    gtfLines.append(['Chr1', 'test', 'exon', start, start + 50, '.', '+', '.', attributes])
+                    gtfLines.append(['Chr1', 'test', 'CDS', start + 5, start + 50, '.', '+', '0', attributes])
+        gtf = pandas.DataFrame(gtfLines)
+        expected = conv.convertGTFToBed(pandas.DataFrame(gtfLines, columns = ['seqname', 'source', 'feature', 'start', 'end',
+                                                                              'score', 'strand', 'frame', 'attribute']))
+        with tempfile.TemporaryDirectory() as tmpDir:
+            path = os.path.join(tmpDir, 'test.gtf')
+            gtf.to_csv(path, sep = '\t', header = False, index = False, quoting = 3)
+            # Transcripts spanning chunk borders have to be merged
+            for chunkSize in [1, 5, 1000]:
+                df, validation = conv.streamGTFToBed(path, None, val.validateGTF, chunkSize)
+                self.assertTrue(validation[0])
+                self.assertTrue(df.equals(expected))
+            self.assertEqual(len(expected), 6)
+            # Invalid chunks are reported
+            gtf.loc[3, 6] = '*'
+            gtf.to_csv(path, sep = '\t', header = False, index = False, quoting = 3)
+            df, validation = conv.streamGTFToBed(path, None, val.validateGTF, 5)
+            self.assertFalse(validation[0])
+
+    def testStreamGFF3ToBed(self):
+        gffLines = []
+        gffLines.append(['Chr1', 'test', 'chromosome', 1, 10000, '.', '.', '.', 'ID=Chr1;Name=Chr1'])
+        gffLines.append(['Chr1', 'test', 'gene', 100, 900, '.', '+', '.', 'ID=G1;Name=G1'])
+        gffLines.append(['Chr1', 'test', 'mRNA', 100, 900, '.', '+', '.', 'ID=G1.1;Parent=G1'])
+        gffLines.append(['Chr1', 'test', 'exon', 100, 300, '.', '+', '.', 'ID=G1.1:exon:1;Parent=G1.1'])
+        gffLines.append(['Chr1', 'test', 'CDS', 150, 300, '.', '+', '0', 'ID=G1.1:cds;Parent=G1.1'])
+        # Exon shared by both isoforms, lines of the two isoforms are interleaved
+        gffLines.append(['Chr1', 'test', 'exon', 500, 900, '.', '+', '.', 'Parent=G1.1,G1.2'])
+        gffLines.append(['Chr1', 'test', 'mRNA', 400, 900, '.', '+', '.', 'ID=G1.2;Parent=G1'])
+        gffLines.append(['Chr1', 'test', 'CDS', 500, 800, '.', '+', '0', 'ID=G1.1:cds;Parent=G1.1'])
+        gffLines.append(['Chr1', 'test', 'exon', 400, 450, '.', '+', '.', 'Parent=G1.2'])
+        # Exon attached directly to its gene
+        gffLines.append(['Chr1', 'test', 'ncRNA_gene', 2000, 2100, '.', '-', '.', 'ID=G2'])
+        gffLines.append(['Chr1', 'test', 'exon', 2000, 2100, '.', '-', '.', 'Parent=G2'])
+        outFile = []
+        outFile.append(['Chr1',99,900,'G1','G1.1',0,'+',149,800,0,2,'201,401','0,400'])
+        outFile.append(['Chr1',399,900,'G1','G1.2',0,'+',399,900,0,2,'401,51','100,0'])
+        outFile.append(['Chr1',1999,2100,'G2','G2',0,'-',1999,2100,0,1,'101','0'])
+        outDF = pandas.DataFrame(data = outFile, columns = conv.gtfHeader)
+        for key, dtype in conv.dtypes.items():
+            outDF[key] = outDF[key].astype(dtype)
+        with tempfile.TemporaryDirectory() as tmpDir:
+            path = os.path.join(tmpDir, 'test.gff3')
+            with open(path, 'w') as out:
+                out.write('##gff-version 3\n')
+                pandas.DataFrame(gffLines).to_csv(out, sep = '\t', header = False, index = False, quoting = 3)
+            self.assertEqual(conv.check_input_file(path).file_type, 'GFF3')
+            for chunkSize in [1, 4, 1000]:
+                df, validation = conv.streamGFF3ToBed(path, val.validateGTF, chunkSize)
+                self.assertTrue(validation[0])
+                self.assertTrue(df.equals(outDF))
+
 class TestValidator(unittest.TestCase):
     def testISRGB(self):
         testCases = []
@@ -153,6 +234,21 @@ class TestValidator(unittest.TestCase):
         for key, dtype in dtypes.items():
             df[key] = df[key].astype(dtype)
         testCases.append((df,(False,'Bad strand symbol')))
+        # Case that should fail on a bad block size in a later row
+        bedFile = []
+        bedFile.append(['chrom1', 0, 10 , 'test.1', 0, '-', 0, 10, 0, 2, '2,4,','0,3,'])
+        bedFile.append(['chrom1', 20, 40 , 'test.1', 0, '-', 1, 10, 0, 2,'2,x','20,23'])
+        df = pandas.DataFrame(data = bedFile, columns = bedHeader)
+        for key, dtype in dtypes.items():
+            df[key] = df[key].astype(dtype)
+        testCases.append((df,(False,'Column blockSizes contains non int values')))
+        # Case that should fail on differing numbers of block sizes and starts
+        bedFile = []
+        bedFile.append(['chrom1', 0, 10 , 'test.1', 0, '-', 0, 10, 0, 2, '2,4','0,3,5'])
+        df = pandas.DataFrame(data = bedFile, columns = bedHeader)
+        for key, dtype in dtypes.items():
+            df[key] = df[key].astype(dtype)
+        testCases.append((df,(False,'Columns blockSizes and blockStarts differ in length')))
         for i in testCases:
             result = val.validateBed12(i[0])
             self.assertEqual(result[0], i[1][0])
@@ -236,6 +332,233 @@ class TestValidator(unittest.TestCase):
         self.assertFalse(val.validateBed("2222")[0])
         self.assertFalse(val.validateBed(pandas.DataFrame())[0])        
         
+    def testIngestFile(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            validPath = Path(tmpDir) / 'set1_crosslinks.bedgraph'
+            invalidPath = Path(tmpDir) / 'set2_crosslinks.bedgraph'
+            with open(str(validPath), 'w') as out:
+                out.write('Chr1\t10\t11\t3\nChr1\t20\t21\t1\n')
+            with open(str(invalidPath), 'w') as out:
+                out.write('Chr1\t10\t11\n')
+            target = os.path.join(tmpDir, 'iclip_set1')
+            self.assertTrue(val.ingestFile(validPath, 'iclip', target, 'abc', pandas.DataFrame()))
+            self.assertEqual(cache.readFrame(target, 'abc')['count'].tolist(), [3, 1])
+            # Invalid files are not cached, the loader reports their errors
+            target = os.path.join(tmpDir, 'iclip_set2')
+            self.assertFalse(val.ingestFile(invalidPath, 'iclip', target, 'abc', pandas.DataFrame()))
+            self.assertFalse(cache.entryValid(target, 'abc'))
+            # Failures to write the cache are not mistaken for invalid files
+            with self.assertRaises(OSError):
+                val.ingestFile(validPath, 'iclip', os.path.join(str(validPath), 'entry'), 'abc', None)
+
+    def testEventDataSet(self):
+        fileDict = val.fileDict
+        val.fileDict = {'Col2_LL2' : None, 'Col2_LL24' : None, 'v1.2_LL24' : None}
+        testCases = []
+        # Name of the event file, dataset
+        testCases.append(('Col2_LL24.dpsi', 'Col2_LL24'))
+        testCases.append(('Col2_LL2.dpsi.bed', 'Col2_LL2'))
+        testCases.append(('v1.2_LL24.dpsi', 'v1.2_LL24'))
+        testCases.append(('Col2_LL36.dpsi', 'Col2_LL36'))
+        for i in testCases:
+            self.assertEqual(val.eventDataSet(i[0]), i[1])
+        val.fileDict = fileDict
+
+class TestIndexing(unittest.TestCase):
+    def testLookupGene(self):
+        annoHeader = ['chrom','chromStart','chromEnd','transID','geneID']
+        annotations = []
+        annotations.append(pandas.DataFrame(data = [['Chr1', 0, 10, 'AT1G10.1', 'AT1G10'],
+                                                    ['Chr1', 20, 30, 'AT1G1.1', 'AT1G1'],
+                                                    ['Chr1', 5, 12, 'AT1G10.2', 'AT1G10']], columns = annoHeader))
+        annotations.append(pandas.DataFrame(data = [['Chr2', 0, 10, 'AT2G10.1', 'AT2G10']], columns = annoHeader))
+        geneIndices = [indexing.buildGeneIndex(i) for i in annotations]
+        # Exact matches only, prefixes of other identifiers must not match
+        self.assertEqual(indexing.lookupGene(annotations, geneIndices, 'AT1G1')['transID'].tolist(), ['AT1G1.1'])
+        self.assertEqual(indexing.lookupGene(annotations, geneIndices, 'AT1G10')['transID'].tolist(), ['AT1G10.1', 'AT1G10.2'])
+        self.assertEqual(indexing.lookupGene(annotations, geneIndices, 'AT2G10')['chrom'].tolist(), ['Chr2'])
+        self.assertTrue(indexing.lookupGene(annotations, geneIndices, 'AT3G10').empty)
+
+    def testBuildDescriptionIndex(self):
+        geneIds = pandas.Series(['AT1G10', 'AT1G1', 'AT1G2.1;AT1G3, AT1G4', np.nan, 'AT1G1'])
+        index = indexing.buildDescriptionIndex(geneIds)
+        testCases = []
+        # gene identifier, row positions
+        # Whole identifiers only, prefixes and wildcards do not match
+        testCases.append(('AT1G1', [1, 4]))
+        testCases.append(('AT1G10', [0]))
+        testCases.append(('AT1G2', None))
+        testCases.append(('AT1G2X1', None))
+        # Fields with multiple identifiers
+        testCases.append(('AT1G2.1', [2]))
+        testCases.append(('AT1G3', [2]))
+        testCases.append(('AT1G4', [2]))
+        for i in testCases:
+            self.assertEqual(index.get(i[0]), i[1])
+        self.assertEqual(sorted(index.keys()), ['AT1G1', 'AT1G10', 'AT1G2.1', 'AT1G3', 'AT1G4'])
+
+    def testIntervalIndex(self):
+        chroms = ['Chr1', 'Chr1', 'Chr2', 'Chr1', 'Chr1', 'Chr1']
+        starts = [100, 0, 100, 400, 150, 220]
+        ends = [200, 1000, 200, 500, 180, 230]
+        index = indexing.IntervalIndex(chroms, starts, ends)
+        testCases = []
+        # chrom, start, end, positions
+        # Contained, spanning and partially overlapping intervals
+        testCases.append(('Chr1', 160, 250, [0, 1, 4, 5]))
+        # Borders are included
+        testCases.append(('Chr1', 200, 220, [0, 1, 5]))
+        testCases.append(('Chr1', 500, 600, [1, 3]))
+        testCases.append(('Chr1', 1001, 1100, []))
+        testCases.append(('Chr2', 0, 99, []))
+        testCases.append(('Chr2', 0, 100, [2]))
+        testCases.append(('Chr3', 0, 100, []))
+        for i in testCases:
+            self.assertEqual(index.query(i[0], i[1], i[2]).tolist(), i[3])
+        # Compare with a full scan over random intervals
+        rng = np.random.RandomState(0)
+        starts = rng.randint(0, 10000, 500)
+        ends = starts + rng.randint(0, 800, 500)
+        chroms = rng.choice(['Chr1', 'Chr2'], 500)
+        index = indexing.IntervalIndex(chroms, starts, ends)
+        for start in range(0, 10000, 450):
+            end = start + 300
+            expected = np.flatnonzero((chroms == 'Chr1') & (starts <= end) & (ends >= start)).tolist()
+            self.assertEqual(index.query('Chr1', start, end).tolist(), expected)
+
+    def testExonTable(self):
+        first = pandas.DataFrame({'chromStart' : [100, 1000], 'blockStarts' : ['0,50,', '0'], 'blockSizes' : ['10,20,', '5']})
+        second = pandas.DataFrame({'chromStart' : [7], 'blockStarts' : ['3,13'], 'blockSizes' : ['1,2']})
+        table = indexing.ExonTable([first, second])
+        testCases = []
+        # dataframe, row, exon starts, exon ends
+        testCases.append((0, 0, [100, 150], [110, 170]))
+        testCases.append((0, 1, [1000], [1005]))
+        testCases.append((1, 0, [10, 20], [11, 22]))
+        for i in testCases:
+            exonFirst, exonLast = table.ranges[i[0]]
+            starts, ends = table.exons(exonFirst[i[1]], exonLast[i[1]])
+            self.assertEqual(starts.tolist(), i[2])
+            self.assertEqual(ends.tolist(), i[3])
+        self.assertEqual(table.transcripts.tolist(), [0, 0, 1, 2, 2])
+        with self.assertRaises(ValueError):
+            indexing.ExonTable([pandas.DataFrame({'chromStart' : [0], 'blockStarts' : ['0,5'], 'blockSizes' : ['5']})])
+
+    def testIntervalStore(self):
+        df = pandas.DataFrame({'chrom' : ['Chr1', 'Chr1', 'Chr2', 'Chr1'], 'chromStart' : [30, 10, 10, 20],
+                               'chromEnd' : [31, 11, 11, 21], 'count' : [3, 1, 2, 5]})
+        store = indexing.IntervalStore(df, ['count'])
+        testCases = []
+        # chrom, start, end, chromStart, count
+        testCases.append(('Chr1', 0, 100, [10, 20, 30], [1, 5, 3]))
+        testCases.append(('Chr1', 11, 30, [10, 20, 30], [1, 5, 3]))
+        testCases.append(('Chr1', 12, 29, [20], [5]))
+        testCases.append(('Chr1', 32, 100, [], []))
+        testCases.append(('Chr2', 0, 10, [10], [2]))
+        testCases.append(('Chr3', 0, 100, [], []))
+        for i in testCases:
+            sites = store.query(i[0], i[1], i[2])
+            self.assertEqual(sites['chromStart'].tolist(), i[3])
+            self.assertEqual(sites['count'].tolist(), i[4])
+        self.assertEqual(len(store), 4)
+        # Stranded stores are partitioned by chromosome and strand
+        df['strand'] = ['+', '-', '+', '+']
+        store = indexing.IntervalStore(df, [], stranded = True)
+        self.assertEqual(store.query('Chr1', 0, 100, '+')['chromStart'].tolist(), [20, 30])
+        self.assertEqual(store.query('Chr1', 0, 100, '-')['chromStart'].tolist(), [10])
+        self.assertEqual(store.query('Chr2', 0, 100, '-')['chromStart'].tolist(), [])
+
+    def testMappedIntervalStore(self):
+        df = pandas.DataFrame({'chrom' : ['Chr2', 'Chr1', 'Chr1', 'Chr1'], 'chromStart' : [5, 30, 10, 20],
+                               'chromEnd' : [50, 40, 25, 22], 'count' : [4, 3, 1, 5]})
+        df['chromStart'] = df['chromStart'].astype('uint64')
+        df['chromEnd'] = df['chromEnd'].astype('uint64')
+        with tempfile.TemporaryDirectory() as tmpDir:
+            path = os.path.join(tmpDir, 'test.cov')
+            indexing.MappedIntervalStore.write(path, df, ['count'])
+            store = indexing.MappedIntervalStore(path)
+            reference = indexing.IntervalStore(df, ['count'])
+            # Results have to match the in-memory store
+            for chrom, start, end in [('Chr1', 0, 100), ('Chr1', 23, 29), ('Chr1', 41, 100), ('Chr2', 0, 5), ('Chr3', 0, 10)]:
+                sites = store.query(chrom, start, end)
+                expected = reference.query(chrom, start, end)
+                for column in ['chromStart', 'chromEnd', 'count']:
+                    self.assertEqual(sites[column].tolist(), expected[column].tolist())
+            self.assertEqual(len(store), 4)
+            del store, sites
+            # Files without the container header are rejected
+            with open(path, 'wb') as out:
+                out.write(b'not a container')
+            self.assertRaises(ValueError, indexing.MappedIntervalStore, path)
+
+class TestCache(unittest.TestCase):
+    def testFrameRoundTrip(self):
+        df = pandas.DataFrame({'chrom' : pandas.Series(['Chr1', 'Chr2', 'Chr1'], dtype = 'category'),
+                               'chromStart' : np.array([1, 5, 9], dtype = 'uint32'),
+                               'chromEnd' : np.array([2, 6, 10], dtype = 'uint32'),
+                               'score' : np.array([0.5, 1.0, 2.0], dtype = 'float32'),
+                               'blockSizes' : ['10,20,', '5,', '7,'],
+                               'geneID' : ['AT1G1', np.nan, '']})
+        with tempfile.TemporaryDirectory() as tmpDir:
+            cacheDir = os.path.join(tmpDir, 'entry')
+            cache.writeFrame(cacheDir, df, 'abc')
+            loaded = cache.readFrame(cacheDir, 'abc')
+            pandas.testing.assert_frame_equal(loaded, df)
+            # Numeric columns stay memory mapped, also columns of the same type and after
+            # looking up rows of a gene
+            mapped = [np.load(os.path.join(cacheDir, i), mmap_mode = 'r') for i in ['col1.npy', 'col2.npy']]
+            frame = cache.mappedFrame(['chromStart', 'chromEnd', 'geneID'], mapped + [loaded['geneID'].values], 3)
+            for name, column in zip(['chromStart', 'chromEnd'], mapped):
+                self.assertTrue(np.shares_memory(frame[name].values, column))
+            geneIndex = indexing.buildGeneIndex(frame)
+            self.assertEqual(indexing.lookupGene([frame], [geneIndex], 'AT1G1')['chromEnd'].tolist(), [2])
+            for name, column in zip(['chromStart', 'chromEnd'], mapped):
+                self.assertTrue(np.shares_memory(frame[name].values, column))
+            del frame, mapped, loaded
+            # Entries for other file contents or without manifest are treated as missing
+            self.assertIsNone(cache.readFrame(cacheDir, 'def'))
+            self.assertIsNone(cache.readFrame(os.path.join(tmpDir, 'missing'), 'abc'))
+            cache.writeFrame(cacheDir, df.iloc[:0], 'abc')
+            self.assertEqual(len(cache.readFrame(cacheDir, 'abc')), 0)
+
+    def testFingerprintStore(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            inputPath = os.path.join(tmpDir, 'input.bed')
+            storePath = os.path.join(tmpDir, 'fingerprints.json')
+            with open(inputPath, 'w') as out:
+                out.write('Chr1\t0\t10\n')
+            for hashContent in [False, True]:
+                store = cache.FingerprintStore(storePath, hashContent)
+                store.update([inputPath, os.path.join(tmpDir, 'missing.bed')])
+                first = store.get(inputPath)
+                store.save()
+                # Unchanged files keep their fingerprint across starts
+                self.assertEqual(cache.FingerprintStore(storePath, hashContent).get(inputPath), first)
+                os.utime(inputPath, ns = (0, 12345))
+                if hashContent: # Same content, only the modification time changed
+                    self.assertEqual(store.get(inputPath), first)
+                else:
+                    self.assertNotEqual(store.get(inputPath), first)
+            self.assertEqual(store.get(inputPath), 'md5:' + cache.contentHash(inputPath))
+            self.assertRaises(FileNotFoundError, store.get, os.path.join(tmpDir, 'missing.bed'))
+
+    def testFigureCache(self):
+        figureCache = cache.FigureCache(10)
+        first = figureCache.put('aaaa')
+        second = figureCache.put('bbbb')
+        self.assertNotEqual(first, second)
+        self.assertEqual(figureCache.get(first), 'aaaa')
+        # The least recently used entry is evicted once the limit is exceeded
+        third = figureCache.put('cccc')
+        self.assertEqual(figureCache.get(second), None)
+        self.assertEqual(figureCache.get(first), 'aaaa')
+        self.assertEqual(figureCache.get(third), 'cccc')
+        # Entries larger than the limit are kept until the next entry arrives
+        large = figureCache.put('d' * 20)
+        self.assertEqual(figureCache.get(large), 'd' * 20)
+        self.assertEqual(figureCache.get(first), None)
+        self.assertEqual(figureCache.get(None), None)
+
 class TestDashboard(unittest.TestCase):
     def testFormatChangeiCLIP(self):
         self.maxDiff = None
@@ -290,7 +613,79 @@ class TestDashboard(unittest.TestCase):
         self.assertFalse(rna.overlap((1,4),(1,1)))
         self.assertFalse(rna.overlap((1,4),(5,7)))
         self.assertFalse(rna.overlap((1,4),(4,7)))
-    
+
+    def testCalculateCoverage(self):
+        testCases = []
+        # Single row inside the region
+        # chromStarts, chromEnds, counts, xAxisMin, xAxisMax
+        caseInput = ([12], [15], [2], 10, 20)
+        caseOutput = [0,0,2,2,2,0,0,0,0,0]
+        testCases.append((caseInput, caseOutput))
+        # Overlapping rows are summed up
+        caseInput = ([10, 12], [14, 16], [1, 3], 10, 20)
+        caseOutput = [1,1,4,4,3,3,0,0,0,0]
+        testCases.append((caseInput, caseOutput))
+        # Rows crossing the borders of the region are clipped
+        caseInput = ([5, 18], [12, 30], [2, 5], 10, 20)
+        caseOutput = [2,2,0,0,0,0,0,0,5,5]
+        testCases.append((caseInput, caseOutput))
+        # Rows outside of the region and row spanning the whole region
+        caseInput = ([0, 25, 0], [10, 30, 40], [7, 7, 1], 10, 15)
+        caseOutput = [1,1,1,1,1]
+        testCases.append((caseInput, caseOutput))
+        # No rows
+        caseInput = ([], [], [], 10, 13)
+        caseOutput = [0,0,0]
+        testCases.append((caseInput, caseOutput))
+        for i in testCases:
+            coverage = rna.calculateCoverage(np.array(i[0][0], dtype = 'uint64'), np.array(i[0][1], dtype = 'uint64'),
+                                             np.array(i[0][2]), i[0][3], i[0][4])
+            self.assertIsInstance(coverage, np.ndarray)
+            self.assertEqual(coverage.tolist(), i[1])
+
+    def testCoverageRuns(self):
+        testCases = []
+        # chromStarts, chromEnds, counts, xAxisMin, xAxisMax, x values, y values
+        # Single row inside the region
+        testCases.append(([12], [15], [2], 10, 20, [10, 12, 15, 19], [0, 2, 0, 0]))
+        # Rows crossing the borders of the region are clipped, bordering rows with equal values are merged
+        testCases.append(([5, 12, 14], [12, 14, 30], [2, 5, 5], 10, 20, [10, 12, 19], [2, 5, 5]))
+        # Run ending at the last base
+        testCases.append(([0], [19], [3], 10, 20, [10, 19], [3, 0]))
+        # No rows and empty region
+        testCases.append(([], [], [], 10, 13, [10, 12], [0, 0]))
+        testCases.append(([], [], [], 10, 10, [], []))
+        for i in testCases:
+            xVals, yVals = rna.coverageRuns(np.array(i[0], dtype = 'uint64'), np.array(i[1], dtype = 'uint64'),
+                                            np.array(i[2]), i[3], i[4])
+            self.assertEqual(xVals.tolist(), i[5])
+            self.assertEqual(yVals.tolist(), i[6])
+        # Expanded to single bases the runs match calculateCoverage
+        rng = np.random.RandomState(0)
+        for i in range(50):
+            starts = rng.randint(0, 200, 20)
+            ends = starts + rng.randint(0, 40, 20)
+            counts = rng.randint(1, 4, 20)
+            xVals, yVals = rna.coverageRuns(starts, ends, counts, 50, 150)
+            positions = np.searchsorted(xVals, np.arange(50, 150), side = 'right') - 1
+            self.assertEqual(yVals[positions].tolist(), rna.calculateCoverage(starts, ends, counts, 50, 150).tolist())
+
+    def testEnvelopeRuns(self):
+        testCases = []
+        # x values, y values, xAxisMin, xAxisMax, numBuckets, reduced x values, reduced y values
+        # Buckets of five bases keep their minimum and maximum, the first one moves to the bucket start
+        testCases.append(([0, 1, 2, 3, 6, 8, 9], [2, 0, 3, 1, 4, 0, 0], 0, 10, 2, [0, 2, 5, 8, 9], [0, 3, 4, 0, 0]))
+        testCases.append(([100, 101, 102, 103, 106, 108, 109], [2, 0, 3, 1, 4, 0, 0], 100, 110, 2,
+                          [100, 102, 105, 108, 109], [0, 3, 4, 0, 0]))
+        # Short regions are kept at full resolution
+        testCases.append(([0, 1, 2, 3, 6, 8, 9], [2, 0, 3, 1, 4, 0, 0], 0, 10, 20, [0, 1, 2, 3, 6, 8, 9], [2, 0, 3, 1, 4, 0, 0]))
+        testCases.append(([], [], 0, 0, 2, [], []))
+        for i in testCases:
+            xVals, yVals = rna.envelopeRuns(np.array(i[0], dtype = np.int64), np.array(i[1], dtype = np.int64),
+                                            i[2], i[3], numBuckets = i[4])
+            self.assertEqual(list(xVals), i[5])
+            self.assertEqual(list(yVals), i[6])
+
     def testGenerateMasterSequence(self):
         testCases = []
         records = collections.OrderedDict()
@@ -527,70 +922,241 @@ class TestDashboard(unittest.TestCase):
             details.tableColors = tableColors
             self.assertIsNot(details.createDetailRow(i[0], i[1], i[2]), i[3])
 
-    def testCalculateEvents(self):
+    def testStackEvents(self):
         testCases = []
-        # Single event
-        # chromStart, chromEnd, score, eventXValues, eventWidths, eventBases, eventScores, intervals, maxStack
-        caseInput = ('test',0, 10, 0.5, {}, {}, {}, {}, [], 0)
-        caseOutput = ({'test' : [4.5]}, {'test' : [10]}, {'test' : [0]}, {'test' : [0.5]}, [((0,10),0)], 1)
-        testCases.append((caseInput, caseOutput))
-        # Events overlapping
-        # chromStart, chromEnd, score, eventXValues, eventWidths, eventBases, eventScores, intervals, maxStack
-        caseInput = ('test', 0, 10, 0.5, {'test' : [4.5]}, {'test' : [10]}, {'test' : [0]}, {'test' : [0.5]}, [((0,10),0)], 1)
-        caseOutput = ({'test' : [4.5,4.5]}, {'test' : [10,10]}, {'test' : [0,1.5]}, {'test' : [0.5,0.5]}, [((0,10),0),((0,10),1)], 2)
-        testCases.append((caseInput, caseOutput))
-        # Event bordering on right
-        # chromStart, chromEnd, score, eventXValues, eventWidths, eventBases, eventScores, intervals, maxStack
-        caseInput = ('test', 10, 15, 0.5, {'test' : [4.5]}, {'test' : [10]}, {'test' : [0]}, {'test' : [0.5]}, [((0,10),0)], 1)
-        caseOutput = ({'test' : [4.5,12.0]}, {'test' : [10,5]}, {'test' : [0,0]}, {'test' : [0.5,0.5]}, [((0,10),0),((10,15),0)], 1)
-        testCases.append((caseInput, caseOutput))
-        # Event bordering on left
-        # chromStart, chromEnd, score, eventXValues, eventWidths, eventBases, eventScores, intervals, maxStack
-        caseInput = ('test', 0, 5, 0.5, {'test' : [7]}, {'test' : [5]}, {'test' : [0]}, {'test' : [0.5]}, [((5,10),0)], 1)
-        caseOutput = ({'test' : [7,2]}, {'test' : [5,5]}, {'test' : [0,0]}, {'test' : [0.5,0.5]}, [((5,10),0),((0,5),0)], 1)
-        testCases.append((caseInput, caseOutput))
+        # chromStarts, chromEnds, rows, number of rows
+        testCases.append(([], [], [], 0))
+        # Bordering events share a row, the freed row is reused
+        testCases.append(([0, 0, 10, 16], [10, 20, 15, 30], [0, 1, 0, 0], 2))
+        # Reversed events, rows are returned in input order
+        testCases.append(([20, 5, 0], [0, 8, 10], [0, 2, 1], 3))
+        # Events without size only overlap events that start left of them
+        testCases.append(([0, 5, 5], [10, 5, 9], [0, 1, 1], 2))
         for i in testCases:
-            xVals = i[0][4]
-            widths = i[0][5]
-            bases = i[0][6]
-            scores = i[0][7]
-            intervals = i[0][8]
-            overlap = rna.calculateEvents(i[0][0], i[0][1], i[0][2],
-                            i[0][3], i[0][4], i[0][5], i[0][6], i[0][7], i[0][8], i[0][9])
-            self.assertEqual((xVals, widths, bases, scores, intervals, overlap), i[1])
-
-    def testCalculateEventsScoreColored(self):
+            rows, numRows = rna.stackEvents(np.array(i[0], dtype = np.int64), np.array(i[1], dtype = np.int64))
+            self.assertEqual(rows.tolist(), i[2])
+            self.assertEqual(numRows, i[3])
+
+    def testEventRowHeight(self):
         testCases = []
+        # Number of stacked events, relative row height
+        testCases.append((0, 0))
+        testCases.append((1, 1))
+        testCases.append((5, 1))
+        testCases.append((6, 2))
+        testCases.append((9, 2))
+        testCases.append((12, 3))
+        for i in testCases:
+            self.assertEqual(rna.eventRowHeight(i[0]), i[1])
+
+    def testMergeRNAData(self):
+        rna.cfg.spliceAvail = True
+        rna.cfg.spliceEventAvail = True
+        figData = {'dataSets' : ['a', 'c'], 'maxY' : 5, 'maxYList' : {'a' : 5, 'c' : 2},
+                   'rnaTraces' : ['covA', 'evA', 'covC', 'evC'], 'maxHeights' : [1, 3],
+                   'axisTitles' : ['', '', '', '']}
+        newData = {'dataSets' : ['b'], 'maxY' : 7, 'maxYList' : {'b' : 7},
+                   'rnaTraces' : ['covB', 'evB'], 'maxHeights' : [2], 'axisTitles' : ['', '']}
+        result = rna.mergeRNAData(figData, newData)
+        self.assertEqual(result['dataSets'], ['a', 'b', 'c'])
+        self.assertEqual(result['rnaTraces'], ['covA', 'evA', 'covB', 'evB', 'covC', 'evC'])
+        self.assertEqual(result['maxHeights'], [1, 2, 3])
+        self.assertEqual(result['axisTitles'], [''] * 6)
+        self.assertEqual(result['maxYList'], {'a' : 5, 'b' : 7, 'c' : 2})
+        self.assertEqual(result['maxY'], 7)
+
+    def testMergeICLIPTraces(self):
+        dataSetNames = getattr(iclip.cfg, 'dataSetNames', None)
+        sortKeys = getattr(iclip.cfg, 'sortKeys', None)
+        iclip.cfg.dataSetNames = ['LL36', 'LL24', 'LL12']
+        iclip.cfg.sortKeys = [['lambda x : x[-2:]', 'False']]
+        iCLIPTraces = [[{'meta' : 'LL36'}, []]]
+        newTraces = [[{'meta' : 'LL12'}, []], [{'meta' : 'LL24'}, []]]
+        result = iclip.mergeICLIPTraces(iCLIPTraces, newTraces)
+        self.assertEqual([i[0]['meta'] for i in result], ['LL12', 'LL24', 'LL36'])
+        iclip.cfg.dataSetNames = dataSetNames
+        iclip.cfg.sortKeys = sortKeys
+
+    def testGeneRegionMissingGene(self):
+        names = ['geneAnnotations', 'geneIndices', 'descAvail', 'geneDescriptions', 'advancedDesc', 'advancedDescIndex']
+        saved = {i : getattr(iclip.cfg, i, None) for i in names}
+        annotations = pandas.DataFrame({'chrom' : ['Chr1'], 'chromStart' : [0], 'chromEnd' : [10],
+                                        'transID' : ['AT1G1.1'], 'geneID' : ['AT1G1'], 'strand' : ['+']})
+        iclip.cfg.geneAnnotations = [annotations]
+        iclip.cfg.geneIndices = [indexing.buildGeneIndex(annotations)]
+        iclip.cfg.descAvail = True
+        iclip.cfg.geneDescriptions = pandas.DataFrame({'ensembl_gene_id' : ['AT1G2'], 'description' : ['Second gene']})
+        iclip.cfg.advancedDesc = pandas.DataFrame({'gene_ids' : ['AT1G1'], 'symbol' : ['ONE']})
+        iclip.cfg.advancedDescIndex = indexing.buildDescriptionIndex(iclip.cfg.advancedDesc['gene_ids'])
+        iclip.geneRegion.cache_clear()
+        # Genes without annotation and a cleared gene selection
+        for name in ['AT9G9', None]:
+            region = iclip.geneRegion(name)
+            self.assertTrue(region.isoforms.empty)
+            self.assertIsNone(region.xAxisMin)
+            self.assertEqual(region.geneModels, [])
+            self.assertTrue(region.details.empty)
+            for callback in [iclip.setDesc, rna.rnaDesc]:
+                self.assertEqual(json.loads(callback(name))['response']['props']['children'], ['No description available'])
+            details.showDetails(name)
+        # Descriptions do not depend on the annotations
+        self.assertEqual(iclip.geneRegion('AT1G2').description['description'], 'Second gene')
+        iclip.geneRegion.cache_clear()
+        for i in names:
+            setattr(iclip.cfg, i, saved[i])
+
+    def checkRows(self, response):
+        """ Checks that the row descriptions returned with a figure match the rows created by
+        make_subplots, as the clientside callbacks rely on this. Returns the row descriptions.
+        """
+        figData = json.loads(response)['response']['props']['data']
+        layout = figData['figure']['layout']
+        rows = figData['rows']
+        self.assertEqual(len(rows), len([i for i in layout if i.startswith('yaxis')]))
+        # Rows from top to bottom, heights proportional to their weights
+        domains = [layout['yaxis' + (str(i + 1) if i > 0 else '')]['domain'] for i in range(len(rows))]
+        self.assertEqual(domains, sorted(domains, reverse = True))
+        ratios = [(d[1] - d[0]) / r['weight'] for d, r in zip(domains, rows) if r['weight'] > 0]
+        for i in ratios:
+            self.assertAlmostEqual(i, ratios[0])
+        # Every trace is drawn in a row of its dataset
+        for trace in figData['figure']['data']:
+            number = trace.get('yaxis', 'y')[1:]
+            row = rows[int(number) - 1 if number != '' else 0]
+            self.assertEqual(row['dataSet'], trace.get('meta'))
+        return rows
+
+    def testShowICLIPRows(self):
+        names = ['figureCache', 'bsRawDFs', 'bsProcDFs', 'procAvail', 'dsElements', 'fullResolution']
+        saved = {i : getattr(iclip.cfg, i, None) for i in names}
+        crosslinks = pandas.DataFrame({'chrom' : ['Chr1'] * 3, 'chromStart' : [10, 20, 30],
+                                       'chromEnd' : [11, 21, 31], 'count' : [3, 1, 2]})
+        bindingSites = pandas.DataFrame({'chrom' : ['Chr1'], 'chromStart' : [15], 'chromEnd' : [25], 'strand' : ['+']})
+        iclip.cfg.figureCache = cache.FigureCache(2**20)
+        iclip.cfg.bsRawDFs = {'A' : indexing.IntervalStore(crosslinks, ['count']),
+                              'B' : indexing.IntervalStore(crosslinks, ['count'])}
+        # No binding site file for B, its binding site row stays empty
+        iclip.cfg.bsProcDFs = {'A' : indexing.IntervalStore(bindingSites, [], stranded = True)}
+        iclip.cfg.procAvail = True
+        iclip.cfg.dsElements = 2
+        iclip.cfg.fullResolution = 20000
+        colors = {'A' : 'rgb(0, 0, 255)', 'B' : 'rgb(255, 0, 0)'}
+        figData = {'strand' : '+', 'window' : None,
+                   'letterSeq' : [{'type' : 'scatter', 'x' : [0, 1], 'y' : [0, 0], 'mode' : 'text'}],
+                   'iCLIPTraces' : [iclip.createICLIPTrace(i, 40, 0, 'Chr1', '+', colors) for i in ['A', 'B']],
+                   'geneModels' : [[{'type' : 'scatter', 'x' : [0, 40], 'y' : [0, 0]}]] * 2}
+        token = iclip.storeFigureData(figData)
+        for seqDisp in ['letterSeq', 'heatSeq']:
+            rows = self.checkRows(iclip.showICLIP(token, seqDisp, 0.1))
+            self.assertEqual([(i['dataSet'], i['scale']) for i in rows],
+                             [(None, None), ('A', 'iCLIPScale'), ('A', 'bsScale'), ('B', 'iCLIPScale'),
+                              ('B', 'bsScale'), (None, None), (None, None)])
+        for i in names:
+            setattr(iclip.cfg, i, saved[i])
+
+    def testShowRNARows(self):
+        names = ['figureCache', 'coverageData', 'spliceEventDFs', 'spliceAvail', 'spliceEventAvail',
+                 'eventTypes', 'fullResolution']
+        saved = {i : getattr(rna.cfg, i, None) for i in names}
+        coverage = pandas.DataFrame({'chrom' : ['Chr1'] * 2, 'chromStart' : [0, 20],
+                                     'chromEnd' : [20, 40], 'count' : [2, 5]})
+        events = pandas.DataFrame({'chrom' : ['Chr1'] * 3, 'chromStart' : [5, 8, 30],
+                                   'chromEnd' : [15, 25, 35], 'score' : [0.5, -0.2, 1.0], 'type' : ['SE', 'RI', 'SE']})
+        rna.cfg.figureCache = cache.FigureCache(2**20)
+        rna.cfg.coverageData = {'a_1' : indexing.IntervalStore(coverage, ['count']),
+                                'b_1' : indexing.IntervalStore(coverage, ['count'])}
+        # No events for b_1, its event row holds no traces
+        rna.cfg.spliceEventDFs = {'a_1' : indexing.IntervalStore(events, ['score', 'type'])}
+        rna.cfg.spliceAvail = True
+        rna.cfg.spliceEventAvail = True
+        rna.cfg.eventTypes = ['RI', 'SE']
+        rna.cfg.fullResolution = 20000
+        colors = {'a' : 'rgb(0, 0, 255)', 'b' : 'rgb(255, 0, 0)'}
+        eventColors = {'RI' : 'rgb(0, 255, 0)', 'SE' : 'rgb(255, 0, 255)'}
+        for displayType in ['one', 'two', 'three']:
+            figData = {'strand' : '-', 'window' : None,
+                       'geneModels' : [[{'type' : 'scatter', 'x' : [0, 40], 'y' : [0, 0]}]]}
+            figData.update(rna.createRNAData(['a_1', 'b_1'], 0, 40, 'Chr1', colors, displayType, eventColors))
+            rows = self.checkRows(rna.showRNA(iclip.storeFigureData(figData), displayType, 0.1, 'letterSeq'))
+            self.assertEqual([(i['dataSet'], i['type']) for i in rows],
+                             [(None, 'sequence'), ('a_1', 'coverage'), ('a_1', 'events'),
+                              ('b_1', 'coverage'), ('b_1', 'events'), (None, 'model')])
+            self.assertEqual([i['weight'] for i in rows], [0.5, 3, 1, 3, 0, 0.5])
+            self.assertEqual([i.get('maxY') for i in rows], [None, 5, None, 5, None, None])
+        for i in names:
+            setattr(rna.cfg, i, saved[i])
+
+    def testCreateEventPlots(self):
+        testCases = []
+        # chromStarts, chromEnds, eventXValues, eventWidths, eventBases, maxStack
         # Single event
-        # chromStart, chromEnd, score, eventXValues, eventWidths, eventBases, eventScores, intervals, maxStack
-        caseInput = (0, 10, 0.5, [], [], [], [], [], 0)
-        caseOutput = ([4.5], [10], [0], [0.5], [((0,10),0)], 1)
-        testCases.append((caseInput, caseOutput))
+        testCases.append(([0], [10], [4.5], [10], [0], 1))
         # Events overlapping
-        # chromStart, chromEnd, score, eventXValues, eventWidths, eventBases, eventScores, intervals, maxStack
-        caseInput = (0, 10, 0.5, [4.5], [10], [0], [0.5], [((0,10),0)], 1)
-        caseOutput = ([4.5,4.5], [10,10], [0,1.5], [0.5,0.5], [((0,10),0),((0,10),1)], 2)
-        testCases.append((caseInput, caseOutput))
+        testCases.append(([0, 0], [10, 10], [4.5, 4.5], [10, 10], [0, 1.5], 2))
         # Event bordering on right
-        # chromStart, chromEnd, score, eventXValues, eventWidths, eventBases, eventScores, intervals, maxStack
-        caseInput = (10, 15, 0.5, [4.5], [10], [0], [0.5], [((0,10),0)], 1)
-        caseOutput = ([4.5,12.0], [10,5], [0,0], [0.5,0.5], [((0,10),0),((10,15),0)], 1)
-        testCases.append((caseInput, caseOutput))
+        testCases.append(([0, 10], [10, 15], [4.5, 12.0], [10, 5], [0, 0], 1))
         # Event bordering on left
-        # chromStart, chromEnd, score, eventXValues, eventWidths, eventBases, eventScores, intervals, maxStack
-        caseInput = (0, 5, 0.5, [7], [5], [0], [0.5], [((5,10),0)], 1)
-        caseOutput = ([7,2], [5,5], [0,0], [0.5,0.5], [((5,10),0),((0,5),0)], 1)
-        testCases.append((caseInput, caseOutput))
+        testCases.append(([5, 0], [10, 5], [7, 2], [5, 5], [0, 0], 1))
         for i in testCases:
-            xVals = i[0][3]
-            widths = i[0][4]
-            bases = i[0][5]
-            scores = i[0][6]
-            intervals = i[0][7]
-            overlap = rna.calculateEventsScoreColored(i[0][0], i[0][1],
-                            i[0][2], i[0][3], i[0][4], i[0][5], i[0][6], i[0][7], i[0][8])
-            self.assertEqual((xVals, widths, bases, scores, intervals, overlap), i[1])
-    
+            eventData = {'test' : pandas.DataFrame({'chromStart' : i[0], 'chromEnd' : i[1],
+                                                    'score' : [0.5]*len(i[0]), 'type' : ['SE']*len(i[0])})}
+            axisTitles = []
+            eventMaxHeights = []
+            legendSet = {'one' : True, 'SE' : False}
+            traces = rna.createEventPlots(eventData, 'test', axisTitles, eventMaxHeights, {'SE' : 'red'}, legendSet)
+            for trace in [traces['one'][0], traces['two'][0], traces['three']]:
+                self.assertEqual(list(trace.x), i[2])
+                self.assertEqual(list(trace.width), i[3])
+                self.assertEqual(list(trace.base), i[4])
+            self.assertEqual(list(traces['three'].marker.color), [0.5]*len(i[0]))
+            self.assertEqual(eventMaxHeights, [i[5]])
+            self.assertEqual(legendSet, {'one' : False, 'SE' : True})
+        # Events are split by type for displayMode two
+        eventData = {'test' : pandas.DataFrame({'chromStart' : [0, 5, 20], 'chromEnd' : [10, 15, 30],
+                                                'score' : [0.1, 0.2, 0.3], 'type' : ['SE', 'RI', 'SE']})}
+        traces = rna.createEventPlots(eventData, 'test', [], [], {'SE' : 'red', 'RI' : 'blue'},
+                                      {'one' : True, 'SE' : False, 'RI' : False})
+        self.assertEqual([j.name for j in traces['two']], ['RI', 'SE'])
+        self.assertEqual(list(traces['two'][0].base), [1.5])
+        self.assertEqual(list(traces['two'][1].x), [4.5, 24.5])
+        self.assertEqual(list(traces['two'][1].base), [0, 0])
+        self.assertEqual(list(traces['three'].marker.color), [0.1, 0.2, 0.3])
+        # Dataset without splice event file
+        traces = rna.createEventPlots({'test' : {}}, 'test', [], [], {}, {'one' : True})
+        self.assertEqual(traces, {'one' : ['test'], 'two' : ['test'], 'three' : ['test']})
+
+    def testEnvelopeBars(self):
+        testCases = []
+        # chromStarts, counts, xMin, xMax, numBuckets, x values, counts, widths
+        testCases.append(([0, 2, 7, 8], [5, 9, 1, 3], 0, 10, 2, [2.5, 7.5], [9, 3], [5, 5]))
+        # Crosslinks starting left of the region count for the first bucket
+        testCases.append(([8, 12, 14, 29], [4, 2, 1, 6], 10, 30, 4, [12.5, 27.5], [4, 6], [5, 5]))
+        testCases.append(([], [], 0, 10, 2, [], [], []))
+        for i in testCases:
+            xVals, counts, widths = iclip.envelopeBars(np.array(i[0], dtype = np.int64), np.array(i[1], dtype = np.int64),
+                                                       i[2], i[3], numBuckets = i[4])
+            self.assertEqual(xVals.tolist(), i[5])
+            self.assertEqual(counts.tolist(), i[6])
+            self.assertEqual(widths.tolist(), i[7])
+
+    def testViewWindow(self):
+        region = collections.namedtuple('Region', ['xAxisMin', 'xAxisMax'])(100, 200)
+        testCases = []
+        # relayoutData, window
+        testCases.append(({'xaxis.range[0]' : 120.4, 'xaxis.range[1]' : 150.6}, (120, 151)))
+        # Reversed axis on the - strand and ranges beyond the region
+        testCases.append(({'xaxis.range' : [180, 90]}, (100, 180)))
+        testCases.append(({'xaxis.range[0]' : 150.2, 'xaxis.range[1]' : 150.4}, (150, 151)))
+        # Whole region
+        testCases.append(({'xaxis.autorange' : True}, None))
+        testCases.append(({'xaxis.range[0]' : 50, 'xaxis.range[1]' : 250}, None))
+        for i in testCases:
+            self.assertEqual(iclip.viewWindow(i[0], region), i[1])
+        # No change of the x-axis
+        for i in [None, {'autosize' : True}, {'yaxis.range[0]' : 0, 'yaxis.range[1]' : 5}]:
+            with self.assertRaises(ValueError):
+                iclip.viewWindow(i, region)
+
     def testSetUpBlockConstraints(self):
         testCases = []
         # Test overlap on right side of region and with chromStart/end equal xAxisMin/Max
@@ -651,21 +1217,22 @@ class TestDashboard(unittest.TestCase):
         caseOutput = ([30],[0.4],[19])
         testCases.append((caseInput,caseOutput))
         
-        # Block lies right of coding region
+        # Block lies right of coding region, centers and widths follow the same half open
+        # convention as blocks left of the coding region
         # thickStart, thickEnd, blockStart, blockEnd, blockHeight
         caseInput = (0,10, 20, 40, 0.4)
         # blockVals, blockYs, blockWidths
-        caseOutput = ([30],[0.2],[21])
+        caseOutput = ([29.5],[0.2],[20])
         testCases.append((caseInput,caseOutput))
         # thickStart, thickEnd, blockStart, blockEnd, blockHeight
         caseInput = (0,10, 21, 41, 0.4)
         # blockVals, blockYs, blockWidths
-        caseOutput = ([31],[0.2],[21])
+        caseOutput = ([30.5],[0.2],[20])
         testCases.append((caseInput,caseOutput))
         # thickStart, thickEnd, blockStart, blockEnd, blockHeight
         caseInput = (0,10, 21, 40, 0.4)
         # blockVals, blockYs, blockWidths
-        caseOutput = ([30.5],[0.2],[20])
+        caseOutput = ([30],[0.2],[19])
         testCases.append((caseInput,caseOutput))
         
         # Block lies left of coding region
@@ -749,6 +1316,19 @@ class TestDashboard(unittest.TestCase):
             iclip.calculateBlocks(i[0][0],i[0][1],i[0][2],i[0][3], inputBlockVals, inputBlockWidths, inputBlockYs, i[0][4])
             output = (inputBlockVals, inputBlockYs, inputBlockWidths)
             self.assertEqual(output, i[1])
+
+    def testSplitBlocks(self):
+        # Blocks of two isoforms at once: left of, overlapping and containing the coding region,
+        # a clipped block and a block without size
+        thickStarts = [20, 20, 5, 5, 5]
+        thickEnds = [30, 30, 15, 15, 15]
+        blockStarts = [0, 25, 1, -1, 7]
+        blockEnds = [10, 35, 20, 39, 7]
+        vals, widths, ys, blocks = iclip.splitBlocks(thickStarts, thickEnds, blockStarts, blockEnds, 0.4)
+        self.assertEqual(vals.tolist(), [4.5, 27, 32, 2.5, 10.0, 17.5])
+        self.assertEqual(widths.tolist(), [10, 5, 5, 4, 11, 4])
+        self.assertEqual(ys.tolist(), [0.2, 0.4, 0.2, 0.2, 0.4, 0.2])
+        self.assertEqual(blocks.tolist(), [0, 1, 1, 2, 2, 2])
             
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -6,18 +6,16 @@ import runpy
 from argparse import ArgumentParser
 from pathlib import Path
 from xml.dom import minidom
-import pickle
 import os
-import hashlib
 import itertools
 import pandas
 from Bio import SeqIO
 from Bio.Alphabet import generic_dna
 import converter
+import indexing
+import cache
 import time
-import gzip
-import bz2
-import zipfile
+from concurrent.futures import ProcessPoolExecutor
 
 __author__ = "Yannik Bramkamp"
 
@@ -26,12 +24,16 @@ start = time.time()
 geneIndex = pandas.DataFrame()
 plotColors = []
 geneAnnotations = []
+geneIndices = [] # Maps gene identifiers to row positions, one dict per annotation file
+intervalIndices = [] # Interval index over the isoforms, one per annotation file
+exonTable = None # Exon coordinates of the isoforms of all annotation files
 sequences = []
 ensembl = False
 geneDescriptions = None
 descAvail = True
 dropList = []
 advancedDescriptions = None
+advancedDescIndex = {}
 subTables = None
 dsElements = 0 # number of traces per dataset, i.e Rawdata+ bindingsites = 2
 bsRawDFs = {}
@@ -43,7 +45,7 @@ spliceElements = 0
 fileDict = {} # This dictionary will holde the file indexes for each dataset
 spliceAvail = False # splice data available
 spliceEventsAvail = False  # splice events available
-spliceEventsDFs = {}
+spliceEventsDFs = {} # Interval stores with splice event data, one per RNA-seq dataset
 spliceEventsElements = 0
 spliceEventNames = [[],[]]
 spliceEventTypes = []
@@ -107,11 +109,19 @@ def validateBed12(df):
         if (all(x in ['+', '-'] for x in df['strand'].cat.categories.tolist())) != True:
             msg = 'Bad strand symbol(has to be + or -'
             return [False, msg]
-        if all(y.isdigit() for z in df['blockSizes'].map(lambda x: x.split(',')[:-1]).tolist()[0] for y in z ) == False:
-            msg = 'Column blockSizes contains non int values'
-            return [False, msg]    
-        if all(y.isdigit() for z in df['blockStarts'].map(lambda x: x.split(',')[:-1]).tolist()[0] for y in z ) == False:
-            msg = 'Column blockStarts contains non int values'
+        # Parse the block columns of all rows at once
+        counts = []
+        for column in ['blockSizes', 'blockStarts']:
+            try:
+                values, columnCounts = indexing.splitIntegers(df[column])
+            except ValueError:
+                values = None
+            if values is None or (values < 0).any():
+                msg = 'Column ' + column + ' contains non int values'
+                return [False, msg]
+            counts.append(columnCounts)
+        if (counts[0] != counts[1]).any():
+            msg = 'Columns blockSizes and blockStarts differ in length'
             return [False, msg]
         return [True, msg]
     except (TypeError, AttributeError, KeyError):
@@ -176,193 +186,174 @@ def isRGB(color):
     except TypeError:
         return False
 
-def md5Gzip(fname):
-    hash_md5 = hashlib.md5()
+def cachePath(path, kind):
+    """ Returns the location of the cached data for an input file, a directory of the
+    columnar cache or a coverage container.
+
+    Positional arguments:
+    path -- Path of the input file.
+    kind -- Type of data in the file, keeps entries for different inputs apart.
+    """
+    if kind == 'coverage':
+        try:
+            file_name = path.stem.split('_')[0]+'_'+path.stem.split('_')[1]
+        except IndexError:
+            file_name = path.stem.split('_')[0]
+        return binFilePath + 'coverage/' + str(file_name) + '.cov'
+    return binFilePath + 'cache/' + kind + '_' + str(path.stem) + '/'
+
+def parseInput(path, kind, geneIndex):
+    """ Reads and validates an input file. Returns the dataframe together with the
+    validation result, gtf and gff3 annotations are converted to bed12 if they are valid.
+
+    Positional arguments:
+    path -- Path of the input file.
+    kind -- Type of data in the file.
+    geneIndex -- Dataframe mapping transcript identifiers to gene identifiers.
+    """
+    if kind == 'annotation':
+        typeGuess = converter.check_input_file(str(path))
+        if typeGuess.header_present == True:
+            header = 1
+        else:
+            header = None
+        if typeGuess.file_type == 'BED12':
+            dtypes = {'chrom' : 'category', 'chromStart' : 'uint32','chromEnd': 'uint32','transID' : 'object','score' : 'int16','strand' : 'category','thickStart' : 'uint64',
+             'thickEnd' : 'uint64', 'blockCount' : 'uint32','blockSizes' : 'object','blockStarts' : 'object'}
+            df = pandas.read_csv(path, sep = '\t', compression='infer', comment = '#', names = bedHeader, dtype = dtypes, header = header)
+            df = df.join(geneIndex.set_index('transID'), on='transID')
+            return df, validateBed12(df)
+        if typeGuess.file_type == 'GFF3':
+            return converter.streamGFF3ToBed(path, validateGTF)
+        # GTF files are streamed in chunks and converted to bed12 on the fly
+        return converter.streamGTFToBed(path, header, validateGTF)
+    if kind == 'iclip':
+        dtypes = {'chrom' : 'category' ,'chromStart' : 'uint64','chromEnd' : 'uint64', 'count' : 'uint32'}
+        df = pandas.read_csv(path, compression='infer', sep = '\t', names = rawHeader, dtype = dtypes)
+        return df, validateBedGraph(df)
+    if kind == 'coverage':
+        dtypes = {'chrom' : 'category', 'chromStart' : 'uint64','chromEnd' : 'uint64'}
+        df = pandas.read_csv(path, compression='infer', sep= '\t', names= rawHeader, dtype = dtypes)
+        return df, validateBedGraph(df)
+    # Binding sites and splice events are both 6 column bed files
+    dtypes = {'chrom' : 'category', 'chromStart' : 'uint64','chromEnd' : 'uint64','type' : 'category', 'score' : 'float32', 'strand' : 'category'}
+    df = pandas.read_csv(path, compression='infer', sep = '\t', names = bsHeader, dtype = dtypes)
+    return df, validateBed(df)
+
+def writeInputCache(target, kind, df, fingerprint):
+    """ Writes the cached data for a valid input file.
+
+    Positional arguments:
+    target -- Location of the cached data, see cachePath.
+    kind -- Type of data in the file.
+    df -- Parsed dataframe.
+    fingerprint -- Fingerprint of the input file.
+    """
+    if kind == 'coverage':
+        indexing.MappedIntervalStore.write(target, df, ['count'], fingerprint)
+    else:
+        cache.writeFrame(target, df, fingerprint)
+
+def cacheValid(target, kind, fingerprint):
+    """ Checks whether the cached data for an input file is up to date.
+
+    Positional arguments:
+    target -- Location of the cached data, see cachePath.
+    kind -- Type of data in the file.
+    fingerprint -- Fingerprint of the input file.
+    """
+    if kind == 'coverage':
+        try:
+            return indexing.MappedIntervalStore(target).fingerprint == fingerprint
+        except (IOError, UnicodeDecodeError, ValueError, KeyError):
+            return False
+    return cache.entryValid(target, fingerprint)
+
+def ingestFile(path, kind, target, fingerprint, geneIndex):
+    """ Task of the parallel ingest, parses, validates and caches a single input file.
+    Returns whether the file was cached. Invalid files are not cached, the loaders parse
+    them again and report their errors in the usual order. Other errors, like a failure to
+    write the cache, are raised.
 
-    with gzip.open(fname, 'rb') as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5
+    Positional arguments:
+    path -- Path of the input file.
+    kind -- Type of data in the file.
+    target -- Location of the cached data, see cachePath.
+    fingerprint -- Fingerprint of the input file.
+    geneIndex -- Dataframe mapping transcript identifiers to gene identifiers, only
+        needed for annotation files.
+    """
+    try:
+        df, validation = parseInput(path, kind, geneIndex)
+    except (FileNotFoundError, ValueError): # Reported by the loader
+        return False
+    if validation[0] == True:
+        writeInputCache(target, kind, df, fingerprint)
+        return True
+    return False
 
-def md5Bz2(fname):
-    hash_md5 = hashlib.md5()
+def ingestInputs():
+    """ Parses and caches all input files without up to date cached data in a process
+    pool. The loaders afterwards read the data from the cache.
+    """
+    tasks = []
+    inputs = [('annotation', geneAnnotationPaths), ('iclip', bindingSiteRawPaths), ('bindingsites', bindingSitePaths),
+              ('coverage', spliceSitePaths), ('events', spliceEventsPaths)]
+    for kind, paths in inputs:
+        for path in paths or []:
+            try:
+                fingerprint = fingerprints.get(path)
+            except (IOError, TypeError):
+                continue # Reported by the loader
+            target = cachePath(path, kind)
+            if not cacheValid(target, kind, fingerprint):
+                # Only annotation files need the gene index, don't send it with every task
+                tasks.append((path, kind, target, fingerprint, geneIndex if kind == 'annotation' else None))
+    if workers < 2 or len(tasks) < 2: # Not worth starting a pool, the loaders parse the files themselves
+        return
+    print('Parsing ' + str(len(tasks)) + ' input files using ' + str(workers) + ' processes.')
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        futures = [(task[0], pool.submit(ingestFile, *task)) for task in tasks]
+        for path, future in futures:
+            try:
+                future.result()
+            except Exception as e: # The loader parses the file again
+                print('Parallel parsing of ' + str(path) + ' failed: ' + type(e).__name__ + ': ' + str(e))
 
-    with bz2.open(fname, 'rb') as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5
+def loadCachedTable(path, kind):
+    """ Returns the dataframe for an input file together with its validation result.
+    The columnar cache is used if it holds an entry for the current file content,
+    otherwise the file is parsed and validated, valid results are cached.
 
-def md5Zip(fname):
-    hash_md5 = hashlib.md5()
-    with zipfile.open(fname, 'rb') as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5
+    Positional arguments:
+    path -- Path of the input file.
+    kind -- Type of data in the file.
+    """
+    checksum = fingerprints.get(path)
+    df = cache.readFrame(cachePath(path, kind), checksum)
+    if df is not None:
+        print('Loaded from cache')
+        return df, [True, '']
+    df, validation = parseInput(path, kind, geneIndex)
+    if validation[0] == True:
+        writeInputCache(cachePath(path, kind), kind, df, checksum)
+    return df, validation
 
 def loadAnnotations():
     for idx, i in enumerate(geneAnnotationPaths):
         try:
             typeGuess = converter.check_input_file(str(i))
-            if typeGuess.header_present == True:
-                header = 1  
-            else:
-                header = None
             print('Loading file ' + str(idx+1) )
-            if typeGuess.file_type == 'BED12':           
-    #        try:
-    #            if i.suffix.lower() =='.bed':
-                if typeGuess.zipped == True:
-                    if typeGuess.zip_type == 'gzip':
-                        checksum = md5Gzip(str(i))
-                    elif typeGuess.zio_type == 'bzip2':
-                        checksum = md5Bz2(str(i))
-                    elif typeGuess.zio_type == 'zip':
-                        checksum = md5Zip(str(i))       
-                else:
-                    checksum = hashlib.md5(open(str(i)).read().encode('utf-8'))
-                if checksums.get(str(i.stem), None) != checksum.hexdigest():
-                    dtypes = {'chrom' : 'category', 'chromStart' : 'uint32','chromEnd': 'uint32','transID' : 'object','score' : 'int16','strand' : 'category','thickStart' : 'uint64',
-                 'thickEnd' : 'uint64', 'blockCount' : 'uint32','blockSizes' : 'object','blockStarts' : 'object'}
-                    df = pandas.read_csv(i, sep = '\t', compression='infer', comment = '#', names = bedHeader, dtype = dtypes, header = header)
-                    df = df.join(geneIndex.set_index('transID'), on='transID') 
-                    validation = validateBed12(df)
-                    if validation[0] == True:
-                        geneAnnotations.append(df)
-                        out = open(binFilePath + str(i.stem)+'.bin', 'wb')
-                        pickle.dump(df, out)
-                        out.close()
-                    else:
-                        print('Error in file ' + str(i) + ':')
-                        print(validation[1])
-                    checksums[str(i.stem)] = checksum.hexdigest()
-                else:
-                    try:
-                        df = pickle.load(open(binFilePath + str(i.stem)+'.bin', 'rb'))
-                        geneAnnotations.append(df)
-                        print('Loaded from pickle')
-                    except IOError:
-                        print('pickle not  found, loading from raw file')
-                        dtypes = {'chrom' : 'category', 'chromStart' : 'uint32','chromEnd': 'uint32','transID' : 'object','score' : 'int16','strand' : 'category','thickStart' : 'uint64',
-                                  'thickEnd' : 'uint64', 'blockCount' : 'uint32','blockSizes' : 'object','blockStarts' : 'object'}
-                        df = pandas.read_csv(i, sep = '\t', compression='infer', comment = '#', names = bedHeader, dtype = dtypes, header = header)
-                        df = df.join(geneIndex.set_index('transID'), on='transID') 
-                        validation = validateBed12(df)
-                        if validation[0] == True:
-                            geneAnnotations.append(df)
-                            out = open(binFilePath + str(i.stem)+'.bin', 'wb')
-                            pickle.dump(df, out)
-                            out.close()
-                        else:
-                            print('Error in file ' + str(i) + ':')
-                            print(validation[1])
-                    except UnicodeDecodeError:
-                        print('Error decoding pickle binary file, will load from raw file instead')
-                        dtypes = {'chrom' : 'category', 'chromStart' : 'uint32','chromEnd': 'uint32','transID' : 'object','score' : 'int16','strand' : 'category','thickStart' : 'uint64',
-                                  'thickEnd' : 'uint64', 'blockCount' : 'uint32','blockSizes' : 'object','blockStarts' : 'object'}
-                        df = pandas.read_csv(i, sep = '\t', compression='infer', comment = '#', names = bedHeader, dtype = dtypes, header = header)
-                        df = df.join(geneIndex.set_index('transID'), on='transID')                     
-                        validation = validateBed12(df)
-                        if validation[0] == True:
-                            geneAnnotations.append(df)
-                            out = open(binFilePath + str(i.stem)+'.bin', 'wb')
-                            pickle.dump(df, out)
-                            out.close()
-                        else:
-                            print('Error in file ' + str(i) + ':')
-                            print(validation[1])
-                    except ModuleNotFoundError:
-                        print('Pickle was created using different package versions, will load from raw file instead')
-                        dtypes = {'chrom' : 'category', 'chromStart' : 'uint32','chromEnd': 'uint32','transID' : 'object','score' : 'int16','strand' : 'category','thickStart' : 'uint64',
-                                  'thickEnd' : 'uint64', 'blockCount' : 'uint32','blockSizes' : 'object','blockStarts' : 'object'}
-                        df = pandas.read_csv(i, sep = '\t', compression='infer', comment = '#', names = bedHeader, dtype = dtypes, header = header)
-                        df = df.join(geneIndex.set_index('transID'), on='transID')                          
-                        validation = validateBed12(df)
-                        if validation[0] == True:
-                            geneAnnotations.append(df)
-                            out = open(binFilePath + str(i.stem)+'.bin', 'wb')
-                            pickle.dump(df, out)
-                            out.close()
-                        else:
-                            print('Error in file ' + str(i) + ':')
-                            print(validation[1])
-            elif typeGuess.file_type == 'GTF':
-    #            if i.suffix.lower() == '.gtf':
-                if typeGuess.zipped == True:
-                    if typeGuess.zip_type == 'gzip':
-                        checksum = md5Gzip(str(i))
-                    elif typeGuess.zio_type == 'bzip2':
-                        checksum = md5Bz2(str(i))
-                    elif typeGuess.zio_type == 'zip':
-                        checksum = md5Zip(str(i))       
-                else:
-                    checksum = hashlib.md5(open(str(i)).read().encode('utf-8'))
-                if checksums.get(str(i.stem), None) != checksum.hexdigest():
-                    dtypes = {'seqname' : 'object', 'source' : 'object', 'feature' : 'object', 'start' : 'uint32', 'end': 'uint32', 'score' : 'object',
-                              'strand' : 'category', 'frame' : 'object', 'attribute' : 'object'}
-                    df = pandas.read_csv(i, sep = '\t', compression='infer', comment = '#', names = gtfheader, dtype = dtypes, header = header)
-                    validation = validateGTF(df)
-                    if validation[0] == True:
-                        df = converter.convertGTFToBed(df)
-                        out = open(binFilePath + str(i.stem)+'.bin', 'wb')
-                        pickle.dump(df, out)
-                        out.close()
-                        geneAnnotations.append(df)
-                    else:
-                        print('Error in file ' + str(i) + ':')
-                        print(validation[1])
-                    checksums[str(i.stem)] = checksum.hexdigest()                        
-                else:
-                    try:
-                        df = pickle.load(open(binFilePath + str(i.stem)+'.bin', 'rb'))
-                        geneAnnotations.append(df)
-                        print('Loaded from pickle')
-                    except IOError:
-                        print('pickle not  found, loading from raw file')
-                        dtypes = {'seqname' : 'object', 'source' : 'object', 'feature' : 'object', 'start' : 'uint32', 'end': 'uint32', 'score' : 'category',
-                              'strand' : 'category', 'frame' : 'object', 'attribute' : 'object'}
-                        df = pandas.read_csv(i, sep = '\t', compression='infer', comment = '#', names = gtfheader, dtype = dtypes, header = header)
-                        validation = validateGTF(df)
-                        if validation[0] == True:
-                            df = converter.convertGTFToBed(df)
-                            out = open(binFilePath + str(i.stem)+'.bin', 'wb')
-                            pickle.dump(df, out)
-                            out.close()
-                            geneAnnotations.append(df)
-                        else:
-                            print('Error in file ' + str(i) + ':')
-                            print(validation[1])
-                    except UnicodeDecodeError:
-                        print('Error decoding pickle binary file, will load from raw file instead')
-                        dtypes = {'seqname' : 'object', 'source' : 'object', 'feature' : 'object', 'start' : 'uint32', 'end': 'uint32', 'score' : 'category',
-                              'strand' : 'category', 'frame' : 'object', 'attribute' : 'object'}
-                        df = pandas.read_csv(i, sep = '\t', comment = '#', compression='infer', names = gtfheader, dtype = dtypes, header = header)
-                        validation = validateGTF(df)
-                        if validation[0] == True:
-                            df = converter.convertGTFToBed(df)
-                            out = open(binFilePath + str(i.stem)+'.bin', 'wb')
-                            pickle.dump(df, out)
-                            out.close()
-                            geneAnnotations.append(df)
-                        else:
-                            print('Error in file ' + str(i) + ':')
-                            print(validation[1])
-                    except ModuleNotFoundError:
-                        print('Pickle was created using different package versions, will load from raw file instead')
-                        dtypes = {'seqname' : 'object', 'source' : 'object', 'feature' : 'object', 'start' : 'uint32', 'end': 'uint32', 'score' : 'category',
-                              'strand' : 'category', 'frame' : 'object', 'attribute' : 'object'}
-                        df = pandas.read_csv(i, sep = '\t', comment = '#', compression='infer', names = gtfheader, dtype = dtypes, header = header)
-                        validation = validateGTF(df)
-                        if validation[0] == True:
-                            df = converter.convertGTFToBed(df)
-                            out = open(binFilePath + str(i.stem)+'.bin', 'wb')
-                            pickle.dump(df, out)
-                            out.close()
-                            geneAnnotations.append(df)
-                        else:
-                            print('Error in file ' + str(i) + ':')
-                            print(validation[1])
-            elif typeGuess.file_type == 'unsupported':
-                print('Invalid file format, please use only .bed or .gtf files')              
+            if typeGuess.file_type in ['BED12', 'GTF', 'GFF3']:
+                df, validation = loadCachedTable(i, 'annotation')
+            else:
+                print('Invalid file format, please use only .bed, .gtf or .gff3 files')
+                continue
+            if validation[0] == True:
+                geneAnnotations.append(df)
+            else:
+                print('Error in file ' + str(i) + ':')
+                print(validation[1])
         except FileNotFoundError:
             print('File ' + str(i) + ' not found, skipping')
         except ValueError as e:
@@ -370,14 +361,16 @@ def loadAnnotations():
     if len(geneAnnotations) == 0:
         print('No valid gene annotation files found, terminating.')
         exit()
-    
-    # Write new checksums file
-    try:
-        out = open(binFilePath + 'checksums', 'wb')
-        pickle.dump(checksums, out)
-        out.close()
-    except FileNotFoundError:
-        pass
+    # Index gene identifiers and isoform coordinates for fast lookup during runtime
+    for df in geneAnnotations:
+        geneIndices.append(indexing.buildGeneIndex(df))
+        intervalIndices.append(indexing.IntervalIndex(df['chrom'], df['chromStart'], df['chromEnd']))
+    # Parse the exons of all isoforms once, every isoform refers to its range of exons
+    global exonTable
+    exonTable = indexing.ExonTable(geneAnnotations)
+    for df, (first, last) in zip(geneAnnotations, exonTable.ranges):
+        df['exonFirst'] = first
+        df['exonLast'] = last
 
 def loadSequences():
     try:
@@ -421,7 +414,7 @@ def loadBasicDescriptions():
         descAvail = False
 
 def loadAdvancedDescriptions():
-    global advancedDescriptions
+    global advancedDescriptions, advancedDescIndex
     try:
         advancedDescriptions = pandas.read_csv(advancedDescPath, compression='infer', sep = '\t')
         if len(advancedDescriptions.index.values) > 0:
@@ -436,6 +429,9 @@ def loadAdvancedDescriptions():
         advancedDescriptions = None
     except ValueError:
         advancedDescriptions = None
+    if advancedDescriptions is not None:
+        # Map gene identifiers to their rows for exact lookups during runtime
+        advancedDescIndex = indexing.buildDescriptionIndex(advancedDescriptions['gene_ids'])
 
 def loadSubTables():
     global subTables
@@ -453,13 +449,11 @@ def loadICLIPData():
         print('Loading iCLIP data.')
         for i in bindingSiteRawPaths:
             try:
-                dtypes = {'chrom' : 'category' ,'chromStart' : 'uint64','chromEnd' : 'uint64', 'count' : 'uint32'}
-                df = pandas.read_csv(i, compression='infer', sep = '\t', names = rawHeader, dtype = dtypes)
-                validation = validateBedGraph(df)
+                df, validation = loadCachedTable(i, 'iclip')
                 if validation[0] == True:
                     if i.stem.split('_')[0] not in dataSetNames:
                         dataSetNames.append(i.stem.split('_')[0])
-                        bsRawDFs.update({str(dataSetNames[-1]) : df})
+                        bsRawDFs.update({str(dataSetNames[-1]) : indexing.IntervalStore(df, ['count'])})
                     else:
                         print('Warning, you are using the same prefix for multiple iCLIP files, file ' + str(i) + ' will be ignored')
                 else:
@@ -481,14 +475,12 @@ def loadBSData():
     for i in bindingSitePaths:
         if i.stem.split('_')[0] in dataSetNames:
             try:
-                dtypes = {'chrom' : 'category', 'chromStart' : 'uint64','chromEnd' : 'uint64','type' : 'category', 'score' : 'float32', 'strand' : 'category'}
-                df = pandas.read_csv(i, compression='infer', sep = '\t', names = bsHeader, dtype = dtypes)
-                validation = validateBed(df)
+                df, validation = loadCachedTable(i, 'bindingsites')
                 if validation[0] == True:
                     if i.stem.split('_')[0] in bsProcDFs:
                         print('Warning, you are using the same prefix for multiple binding site files, file ' + str(i) + ' will be ignored')
                     else:
-                        bsProcDFs.update({i.stem.split('_')[0] : df})
+                        bsProcDFs.update({i.stem.split('_')[0] : indexing.IntervalStore(df, [], stranded = True)})
                 else:
                     print('Error in file ' + str(i) + ':')
                     print(validation[1])                   
@@ -510,7 +502,7 @@ def loadCoverageData():
         print('Loading RNA-seq data')
     for path in spliceSitePaths:
         try:
-            checksum = hashlib.md5(open(str(path)).read().encode('utf-8'))
+            checksum = fingerprints.get(path)
         except FileNotFoundError:
             print('Error loading file ' + str(path) + ', skipping.')
             continue
@@ -519,118 +511,76 @@ def loadCoverageData():
         except IndexError:
             file_name = path.stem.split('_')[0] 
         print(file_name)
-        if coverageChecksums.get(str(path.stem), None) != checksum.hexdigest():
-            try: 
-                dtypes = {'chrom' : 'category', 'chromStart' : 'uint64','chromEnd' : 'uint64','type' : 'category', 'score' : 'float32', 'strand' : 'category'}
-                df = pandas.read_csv(path, compression='infer', sep= '\t', names= rawHeader, dtype = dtypes)
-                validation = validateBedGraph(df)
-                coverageChecksums[str(path.stem)] = checksum.hexdigest()
+        # Try to open the existing container, it is only valid for an unchanged input file
+        containerPath = cachePath(path, 'coverage')
+        try:
+            fileIndex = indexing.MappedIntervalStore(containerPath)
+            if fileIndex.fingerprint != checksum:
+                fileIndex = None
+        except (IOError, UnicodeDecodeError, ValueError, KeyError):
+            fileIndex = None
+        if fileIndex == None:
+            try:
+                df, validation = parseInput(path, 'coverage', geneIndex)
             except FileNotFoundError:
                 validation = [False]
             except ValueError as e:
-                print('File ' + str(path.stem) + ' had errornous datatypes or missing values, skipping: ' + str(e))                       
+                print('File ' + str(path.stem) + ' had errornous datatypes or missing values, skipping: ' + str(e))
+                validation = [False]
             if validation[0]:
-                df.sort_values(by=['chromStart'])
-                # Split dataframe into small parts, these will be pickled and loaded on demand.
-                # Store covered region as minimum starting point and maximum ending point in the file name.
-                dfList = [df.iloc[i:i+chunkSize,] for i in range(0, len(df),chunkSize)]
-                # This index will be used to filter out relevant files during runtime
-                fileIndex = pandas.DataFrame(columns = ['start', 'end', 'fileName'])
-                for i in dfList: 
-                    end = i['chromEnd'].max()
-                    start = i['chromStart'].min()
-                    fileName = binFilePath + 'coverage/' + str(file_name) + "_" + str(start) + "_" + str(end) + '.bin'
-                    fileIndex.loc[len(fileIndex)] = [start, end, fileName]
-                    out = open(fileName, 'wb')
-                    pickle.dump(i, out)
-                    out.close()
-                indexOut = open(binFilePath + 'coverage/' + str(file_name) + '_' + 'index.bin', 'wb')
-                pickle.dump(fileIndex, indexOut)
-                indexOut.close()
-                fileDict.update({file_name : fileIndex})
-                dfList = []
-                # Add the dataset to the list of datasets, check  for number of underscores
-                if path.stem.split('_')[0] not in spliceSetNames[1]:
-                    try:
-                        spliceSetNames[0].append(path.stem.split('_')[1])
-                        spliceSetNames[1].append(path.stem.split('_')[0])
-                    except IndexError:
-                        spliceSetNames[1].append(path.stem.split('_')[0])
-                        spliceSetNames[0].append(path.stem.split('_')[0])
-                out = open(binFilePath + str(path.stem)+'.bin', 'wb')
-                pickle.dump(df, out)
-                out.close()
-        else: # Checksum matches, try to load old index from pickle
+                writeInputCache(containerPath, 'coverage', df, checksum)
+                fileIndex = indexing.MappedIntervalStore(containerPath)
+            else:
+                print('Error loading file ' + str(path))
+                continue
+        fileDict.update({file_name : fileIndex})
+        # Add the dataset to the list of datasets, check  for number of underscores
+        if path.stem.split('_')[0] not in spliceSetNames[1]:
             try:
-                fileIndex = pickle.load(open(binFilePath + 'coverage/' + str(file_name) + '_' + 'index.bin', 'rb'))
-                fileDict.update({file_name : fileIndex})
-                if path.stem.split('_')[0] not in spliceSetNames[1]:
-                    try:
-                        spliceSetNames[0].append(path.stem.split('_')[1])
-                        spliceSetNames[1].append(path.stem.split('_')[0])
-                    except IndexError:
-                        spliceSetNames[1].append(path.stem.split('_')[0])
-                        spliceSetNames[0].append(path.stem.split('_')[0])
-            except (FileNotFoundError, UnicodeDecodeError, IOError, ImportError):
-                try:
-                    df = pandas.read_csv(path, compression='infer', sep= '\t', names= rawHeader, dtype = dtypes)
-                    validation = validateBedGraph(df)
-                except FileNotFoundError:
-                    validation = [False]
-                except ValueError as e:
-                    print('File ' + str(path.stem) + ' had errornous datatypes or missing values, skipping: ' + str(e))    
-                if validation[0]:
-                    df.sort_values(by=['chromStart'])
-                    dfList = [df.iloc[i:i+chunkSize,] for i in range(0, len(df),chunkSize)]
-                    fileIndex = pandas.DataFrame(columns = ['start', 'end', 'fileName'])
-                    for i in dfList:
-                        end = i['chromEnd'].max()    
-                        start = i['chromStart'].min()
-                        fileName = binFilePath + 'coverage/' + str(file_name) + "_" + str(start) + "_" + str(end) + '.bin'
-                        fileIndex.loc[len(fileIndex)] = [start, end, fileName]
-                        out = open(fileName, 'wb')
-                        pickle.dump(i, out)
-                        out.close()
-                    indexOut = open(binFilePath + 'coverage/' + str(file_name) + '_' + 'index.bin', 'wb')
-                    print(binFilePath + 'coverage/' + str(file_name) + '_' + 'index.bin')
-                    pickle.dump(fileIndex, indexOut)
-                    indexOut.close()
-                    fileDict.update({file_name : fileIndex})
-                    dfList = []
-                    if path.stem.split('_')[0] not in spliceSetNames[1]:
-                        try:
-                            spliceSetNames[0].append(path.stem.split('_')[1])
-                            spliceSetNames[1].append(path.stem.split('_')[0])
-                        except IndexError:
-                            spliceSetNames[1].append(path.stem.split('_')[0])
-                            spliceSetNames[0].append(path.stem.split('_')[0])
-                else:
-                    print('Error loading file ' + str(path))
-                        
+                spliceSetNames[0].append(path.stem.split('_')[1])
+                spliceSetNames[1].append(path.stem.split('_')[0])
+            except IndexError:
+                spliceSetNames[1].append(path.stem.split('_')[0])
+                spliceSetNames[0].append(path.stem.split('_')[0])
     if len(fileDict.keys()) > 0:
         spliceElements += 1
         spliceAvail = True
     print('Done.')   
 
+def eventDataSet(name):
+    """ Returns the name of the RNA-seq dataset an event file belongs to. Event files
+    share the name of their coverage file, apart from additional extensions like .dpsi.
+
+    Positional arguments:
+    name -- Name of the event file as used for coverage files.
+    """
+    for dataSet in sorted(fileDict.keys(), key = len, reverse = True):
+        if name == dataSet or name.startswith(dataSet + '.'):
+            return dataSet
+    return name.split('.')[0]
+
 def loadSpliceEvents():
     global spliceEventsAvail, spliceEventsElements
     if len(spliceEventsPaths) > 0:
         print('Loading splice event data')
     for i in spliceEventsPaths:
         try:
-            dtypes = {'chrom' : 'category', 'chromStart' : 'uint64','chromEnd' : 'uint64','type' : 'category', 'score' : 'float32', 'strand' : 'category'}
-            df = pandas.read_csv(i, compression='infer', sep= '\t', names= bsHeader, dtype = dtypes)
-            validation = validateBed(df)
+            df, validation = loadCachedTable(i, 'events')
             try:
                 file_name = i.stem.split('_')[0]+'_'+i.stem.split('_')[1]
             except IndexError:
                 file_name = i.stem.split('_')[0]       
             if validation[0]:
-                if file_name in spliceEventsDFs:
+                dataSet = eventDataSet(file_name)
+                if dataSet in spliceEventsDFs:
                     print('Warning, you are using the same prefix for multiple bed files, file ' + str(
                         i) + ' will be ignored')
                 else:
-                    spliceEventsDFs.update({file_name: df})
+                    # Events are selected by start and end point regardless of their order,
+                    # order them so they can be indexed by start point
+                    df = df.assign(chromStart = df[['chromStart', 'chromEnd']].min(axis = 1),
+                                   chromEnd = df[['chromStart', 'chromEnd']].max(axis = 1))
+                    spliceEventsDFs.update({dataSet: indexing.IntervalStore(df, ['score', 'type'])})
                 if i.stem.split('_')[0] not in spliceEventNames[1]:
                     try:
                         spliceEventNames[0].append(i.stem.split('_')[1])
@@ -667,7 +617,7 @@ parser = ArgumentParser(description = '''Interactive, web based visualization fo
                         An optional file containing gene descriptions can be provided with -desc,
                         this file should be a tab seperated 4 column csv.
                         The -seqs option can be used to provide fasta files containing dna sequence information.''')
-parser.add_argument(dest='geneAnno', help = '''files containing gene annotations in bed12 or gtf format,
+parser.add_argument(dest='geneAnno', help = '''files containing gene annotations in bed12, gtf or gff3 format,
                     atleast one such file is required for execution. These files should not include a header.''',
                     nargs = '+', type = Path,metavar = 'GENE ANNOTATION FILE')
 parser.add_argument('-bsdata', dest = 'bsdata', help = '''files containing binding site data in 6 column bed format. 
@@ -750,10 +700,34 @@ parser.add_argument('-pswd',
                     metavar = 'String')
 parser.add_argument('-chunksize',
                     dest = 'chunkSize',
-                    help = '''Allows specification of the chunk size usedfor subdividing coverage data in lines. Default is 10000''',
+                    help = '''Deprecated, coverage data is no longer split into chunks. Kept for compatibility''',
                     type = int,
                     default = 10000,
                     metavar = 'Integer')
+parser.add_argument('-hash',
+                    dest = 'contentHash',
+                    help = '''Detect changed input files by content hash instead of size and modification time.
+                    Slower on changed files, but keeps cached data valid when files are copied or touched''',
+                    action = 'store_true')
+parser.add_argument('-workers',
+                    dest = 'workers',
+                    help = '''Number of processes used to parse input files that are not cached yet. Default is 4''',
+                    type = int,
+                    default = 4,
+                    metavar = 'Integer')
+parser.add_argument('-figcache',
+                    dest = 'figureCacheSize',
+                    help = '''Memory in MB used to keep the figure data of recently viewed genes on the server. Default is 256''',
+                    type = int,
+                    default = 256,
+                    metavar = 'Integer')
+parser.add_argument('-fullres',
+                    dest = 'fullResolution',
+                    help = '''Maximum length in bases of a region that is plotted at full resolution. Coverage and crosslink
+                    tracks of longer regions are reduced to their highest and lowest values per pixel. Default is 20000''',
+                    type = int,
+                    default = 20000,
+                    metavar = 'Integer')
 parser.add_argument('-name',
                     dest = 'name',
                     help = '''Name to create subfolder for binary files''',
@@ -772,6 +746,10 @@ if __name__ == '__main__':
     
     # Check if xml config file was provided
     useCfg = False
+    contentHash = args.contentHash
+    workers = args.workers
+    figureCacheSize = args.figureCacheSize
+    fullResolution = args.fullResolution
     if args.cfg != None:
         try:
             configFile = minidom.parse(str(args.cfg))
@@ -881,7 +859,7 @@ if __name__ == '__main__':
         except (AttributeError, IndexError):
             password = ''
     
-    # Setup directories to store pickles
+    # Setup directories to store binary files
     if subDir == '':
         binFilePath = os.path.join(os.path.dirname(__file__),'bin_data/')
     else:
@@ -893,14 +871,11 @@ if __name__ == '__main__':
     coveragePath = os.path.join(binFilePath, 'coverage/')
     if not os.path.exists(coveragePath):
         os.mkdir(coveragePath)
+    # Fingerprints decide whether cached data is still valid, compute them for all inputs at once
+    fingerprints = cache.FingerprintStore(binFilePath + 'fingerprints.json', contentHash, max(workers, 1))
+    fingerprints.update(itertools.chain(geneAnnotationPaths or [], bindingSiteRawPaths or [], bindingSitePaths or [],
+                                        spliceSitePaths or [], spliceEventsPaths or []))
         
-    # Dict containing checksums for gene annotation files, files loaded once will
-    # be serialized to speed up future loading
-    try:
-        sums = pickle.load(open(binFilePath+'checksums', 'rb'))
-    except IOError:
-        sums = []
-    checksums = dict(sums)
     
     if len(plotColors) == 0:
         print('No valid color strings provided, using defaults')
@@ -914,10 +889,11 @@ if __name__ == '__main__':
     except ValueError:
         print('geneIndex not set')
         geneIndex = pandas.DataFrame(columns = ['geneID', 'transID'])
-    # Load gene annotations from either bed or gtf files. also handle pickling
+    # Parse uncached input files in parallel, the loaders below read them from the cache
+    ingestInputs()
+    # Load gene annotations from either bed or gtf files
     loadAnnotations()
-    test = [k for k in [i['geneID'].tolist() for i in geneAnnotations]]
-    geneNames = list(set().union(*test))
+    geneNames = list(set().union(*[i.keys() for i in geneIndices]))
     print('Done.')
     print('Loading description and sequence data if provided.')
     # Read dna sequences from fasta
@@ -953,21 +929,15 @@ if __name__ == '__main__':
     # Setup data for binding sites
     loadBSData()
     
-    try:
-        coverageSums = pickle.load(open(binFilePath + 'coverage_checksums', 'rb'))
-    except IOError:
-        coverageSums = []
-    coverageChecksums = dict(coverageSums)
-        
-    
     # Setup data for splice sites
     loadCoverageData()           
-    # Write new checksums file
-    out = open(binFilePath + 'coverage_checksums', 'wb')
-    pickle.dump(coverageChecksums, out)
-    out.close()
     
     loadSpliceEvents()
+    # Write fingerprints of all input files for the next start
+    try:
+        fingerprints.save()
+    except IOError:
+        pass
     
     # Keys for sorting of dataset names in iCLIP tab
     if sortKeys == None:
@@ -999,8 +969,8 @@ if __name__ == '__main__':
         'procAvail' : procAvail, # Binding site data available True/False
         'dsElements' : dsElements, # Number of elements per dataset, can be 0,1,2
         'spliceElements': spliceElements, # Number of elements per rna dataset, can be 0, 1
-        'bsProcDFs' : bsProcDFs, # Dataframes with binding site data
-        'bsRawDFs' : bsRawDFs, # Dataframes with iCLIP data
+        'bsProcDFs' : bsProcDFs, # Interval stores with binding site data
+        'bsRawDFs' : bsRawDFs, # Interval stores with iCLIP data
         'dataSetNames' : dataSetNames, # Names for the data sets
         'spliceSetNames' : spliceSetNames, # Names for the rnaSeq data sets
         'rawAvail' : rawAvail, # iCLIP data available True/False
@@ -1009,18 +979,24 @@ if __name__ == '__main__':
         'geneDescriptions' : geneDescriptions, # dataframe with gene descriptions
         'sequences' : sequences, # list containing sequence files
         'geneAnnotations' : geneAnnotations, # dataframes containing gene annotation data
+        'geneIndices' : geneIndices, # gene identifier to row position mappings for the annotations
+        'intervalIndices' : intervalIndices, # interval indices for overlap queries on the annotations
+        'exonTable' : exonTable, # parsed exon coordinates of all isoforms
         'ensembl' : ensembl, # ensembl style fasta format True/False
         'sortKeys' : sortKeys, # arguments for the list.sort function
         'advancedDesc' : advancedDescriptions, # advanced descriptions for Details tab
+        'advancedDescIndex' : advancedDescIndex, # gene identifier to row position mapping for the advanced descriptions
         'subTables' : subTables, # subtable information for Details tab
         'spliceEventElements' : spliceEventsElements, # Number of elements per rna dataset
-        'spliceEventDFs' : spliceEventsDFs,  # Dataframes with splice event data
+        'spliceEventDFs' : spliceEventsDFs,  # Interval stores with splice event data per dataset
         'spliceEventNames' : spliceEventNames, # Names for the splice event data sets
         'spliceEventAvail' : spliceEventsAvail, # splice event data available True/False,
         'eventColors' : spliceEventColors, # Colorsfor the splice event types
         'coverageColors' : coverageColorDict, # Colors for the coverage plots
         'eventTypes' : sorted(spliceEventTypes), # List containing types of splice events
         'authentication': password, # Password for authentication
+        'figureCache' : cache.FigureCache(figureCacheSize * 2**20), # Figure data of the data callbacks
+        'fullResolution' : fullResolution, # Longest region plotted at full resolution
         'coverageData' : fileDict} # Types of splice events
     end = time.time()
     runpy.run_module('app_layout', init_globals = globalDict, run_name = '__main__')